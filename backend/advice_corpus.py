@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+
+try:
+    from backend import llm_cache
+except ImportError:
+    import llm_cache
+
+# --- Configuration ---
+CORPUS_PATH = os.getenv(
+    "ADVICE_CORPUS_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "advice_corpus.db")
+)
+# Bump when the table layout changes; readers ignore corpora built for another layout
+SCHEMA_VERSION = "1"
+# Bump when the advice prompt changes, so scripts/build_advice_corpus.py regenerates every entry
+# (until it does, readers ignore the stale corpus and ask the live model)
+PROMPT_VERSION = "1"
+# NDVI statuses the UI sends besides the numeric bands ("Critical" from the dashboard, "Unknown" by default)
+NDVI_STATUSES = ("healthy", "moderate", "stressed", "bare", "critical", "unknown")
+ENABLED = os.getenv("ADVICE_CORPUS", "1") == "1"
+
+_local = threading.local()
+_lock = threading.Lock()
+_meta = None
+_STATS = {"hits": 0, "misses": 0}
+
+
+def create_schema(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS advice ("
+        " disease TEXT NOT NULL, ndvi TEXT NOT NULL, language TEXT NOT NULL,"
+        " advice TEXT NOT NULL, source TEXT NOT NULL,"
+        " PRIMARY KEY (disease, ndvi, language)) WITHOUT ROWID"
+    )
+
+
+def corpus_key(disease_name, ndvi_status, language="en"):
+    """Same normalization as the live advice cache: (disease, NDVI band, language)."""
+    return llm_cache.normalize_text(disease_name), llm_cache.bucket_ndvi(ndvi_status), language or "en"
+
+
+def _connect():
+    """Read-only connection per thread, or None when no usable corpus is installed."""
+    global _meta
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    if not ENABLED or not os.path.exists(CORPUS_PATH):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{CORPUS_PATH}?mode=ro", uri=True, check_same_thread=False)
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.Error as e:
+        print(f"Advice corpus unavailable: {e}")
+        return None
+    if meta.get("schema_version") != SCHEMA_VERSION:
+        print(f"Advice corpus ignored: schema {meta.get('schema_version')} != {SCHEMA_VERSION}")
+        conn.close()
+        return None
+    if meta.get("prompt_version") != PROMPT_VERSION:
+        print(f"Advice corpus ignored: prompt {meta.get('prompt_version')} != {PROMPT_VERSION}")
+        conn.close()
+        return None
+    with _lock:
+        _meta = meta
+    _local.conn = conn
+    return conn
+
+
+def lookup(disease_name, ndvi_status, language="en"):
+    """Returns the precomputed advice result for a known combination, or None."""
+    conn = _connect()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute(
+            "SELECT advice, source FROM advice WHERE disease = ? AND ndvi = ? AND language = ?",
+            corpus_key(disease_name, ndvi_status, language)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Advice corpus read error: {e}")
+        row = None
+
+    with _lock:
+        _STATS["hits" if row else "misses"] += 1
+    if row is None:
+        return None
+    return {"status": "success", "advice": row[0], "source": row[1]}
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+        meta = dict(_meta or {})
+    stats["installed"] = bool(meta)
+    stats["corpus_version"] = meta.get("corpus_version")
+    stats["prompt_version"] = meta.get("prompt_version")
+    stats["entries"] = int(meta.get("entries", 0))
+    return stats
@@ -1,34 +1,55 @@
 import os
 import time
 import random
-import google.generativeai as genai
-from geopy.geocoders import Nominatim
+import threading
+
+try:
+    from backend import llm_cache, llm_client, single_flight, geocoding, sentinel_auth, tile_cache, ndvi_stats
+except ImportError:
+    import llm_cache
+    import llm_client
+    import single_flight
+    import geocoding
+    import sentinel_auth
+    import tile_cache
+    import ndvi_stats
+
+# --- Configuration ---
+# Current weather is shared per cell (1 decimal ~ 11 km) for this long
+WEATHER_TTL_S = int(os.getenv("WEATHER_TTL_S", "900"))
+WEATHER_CELL_DIGITS = 1
+WEATHER_CACHE_SIZE = 4096
+# Served while Open-Meteo is unreachable, and retried after this long
+WEATHER_FALLBACK_TTL_S = 60
+WEATHER_FALLBACK = {
+    "temp": 28.5,
+    "humidity": 65,
+    "wind_speed": 12.0,
+    "condition": "Sunny (Offline)",
+    "forecast": "Data unavailable."
+}
+
+_weather_lock = threading.Lock()
+_weather_cache = {}
 
 def get_coordinates(place_name):
     """
-    Geocodes a place name to (lat, lon).
+    Geocodes a place name to (lat, lon) through the shared, cached geocoder.
     """
-    try:
-        geolocator = Nominatim(user_agent="open_agri_os_v3")
-        location = geolocator.geocode(place_name)
-        if location:
-            return (location.latitude, location.longitude)
-        return None
-    except Exception as e:
-        print(f"Geocoding Error: {e}")
-        return None
+    location = geocoding.geocode(place_name)
+    if location:
+        return (location["lat"], location["lon"])
+    return None
 
-def get_weather(lat, lon):
-    """
-    Fetches real-time weather data from Open-Meteo API.
-    """
+def _fetch_weather(lat, lon):
+    """Current conditions from the Open-Meteo API, or None if it cannot be reached."""
     try:
         import urllib.request
         import json
         
         url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,wind_speed_10m,weather_code"
         
-        with urllib.request.urlopen(url) as response:
+        with urllib.request.urlopen(url, timeout=5) as response:
             data = json.loads(response.read().decode())
             current = data.get('current', {})
             
@@ -51,14 +72,38 @@ def get_weather(lat, lon):
             
     except Exception as e:
         print(f"Weather API Error: {e}")
-        # Fallback if API fails
-        return {
-            "temp": 28.5,
-            "humidity": 65,
-            "wind_speed": 12.0,
-            "condition": "Sunny (Offline)",
-            "forecast": "Data unavailable."
-        }
+        return None
+
+def get_weather(lat, lon=None):
+    """
+    Fetches real-time weather data from Open-Meteo API
+    for a geocoding.ResolvedLocation (or Lat + Lon).
+    Readings are kept for WEATHER_TTL_S per ~11 km cell; concurrent scouts of a cell share one call.
+    """
+    if isinstance(lat, geocoding.ResolvedLocation):
+        lat, lon = lat.coords
+    cell = (round(float(lat), WEATHER_CELL_DIGITS), round(float(lon), WEATHER_CELL_DIGITS))
+    with _weather_lock:
+        cached = _weather_cache.get(cell)
+    if cached is not None and cached[0] > time.time():
+        return dict(cached[1])
+
+    def load():
+        weather, ttl = _fetch_weather(lat, lon), WEATHER_TTL_S
+        if weather is None:
+            # Fallback if API fails; tried again sooner than a live reading
+            weather, ttl = dict(WEATHER_FALLBACK), WEATHER_FALLBACK_TTL_S
+        now = time.time()
+        with _weather_lock:
+            if len(_weather_cache) >= WEATHER_CACHE_SIZE:
+                for key in [k for k, (expires, _) in _weather_cache.items() if expires <= now]:
+                    del _weather_cache[key]
+                if len(_weather_cache) >= WEATHER_CACHE_SIZE:
+                    _weather_cache.clear()
+            _weather_cache[cell] = (now + ttl, weather)
+        return weather
+
+    return dict(single_flight.do(f"weather:{cell[0]},{cell[1]}", load))
 
 def get_crop_recommendation(lat, lon):
     """
@@ -87,35 +132,53 @@ def get_crop_recommendation(lat, lon):
             "sowing_window": "Year-round"
         }
 
-# Sentinel Hub Credentials
-CLIENT_ID = "9fd0e481-766f-40ff-a543-4d78efea81e5"
-CLIENT_SECRET = "0i7xNjHthfLzVYY3yyCxLPhrOAWFvDop"
-
 def get_auth_token():
     """
-    Obtains an access token from Sentinel Hub.
+    Sentinel Hub access token from the shared token manager (cached, refreshed before expiry).
     """
-    try:
-        import requests
-        token_url = "https://services.sentinel-hub.com/oauth/token"
-        payload = {
-            "grant_type": "client_credentials",
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET
-        }
-        response = requests.post(token_url, data=payload, timeout=10)
-        response.raise_for_status()
-        return response.json().get("access_token")
-    except Exception as e:
-        print(f"Auth Error: {e}")
-        return None
+    return sentinel_auth.get_token()
 
 def get_sentinel_ndvi(coords):
     """
-    Fetches live NDVI image from Sentinel Hub.
+    Fetches live NDVI image from Sentinel Hub
+    (with field statistics when ndvi_stats.MODE is "raw").
     """
     import requests
-    import datetime
+    
+    evalscript = """
+    //VERSION=3
+    function setup() {
+        return {
+            input: ["B04", "B08"],
+            output: { bands: 4 }
+        };
+    }
+
+    function evaluatePixel(sample) {
+        let ndvi = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+        
+        // Visualizer (Green for healthy, Yellow/Red for stressed)
+        if (ndvi > 0.6) return [0, 0.8, 0, 1]; // Dark Green
+        if (ndvi > 0.4) return [0.5, 0.9, 0, 1]; // Light Green
+        if (ndvi > 0.2) return [0.9, 0.9, 0, 1]; // Yellow
+        return [0.8, 0, 0, 1]; // Red (Soil/Dead)
+    }
+    """
+    
+    # Coordinates (Bounding Box approx 1km around the snapped point), last 30 days
+    lat, lon = coords
+    bbox = tile_cache.field_bbox(lat, lon)
+    past, today = tile_cache.time_window()
+    raw = ndvi_stats.MODE == "raw"
+    if raw:
+        key = ndvi_stats.tile_key(bbox, (past, today))
+    else:
+        key = tile_cache.tile_key(bbox, (past, today), evalscript, 512, 512)
+    
+    # Same render as an earlier scout: straight from disk
+    entry = tile_cache.get_entry(key)
+    if entry:
+        return _ndvi_result(entry)
     
     # 1. Authenticate
     token = get_auth_token()
@@ -126,91 +189,68 @@ def get_sentinel_ndvi(coords):
         return _get_mock_ndvi()
 
     try:
-        # 2. Setup Request
-        evalscript = """
-        //VERSION=3
-        function setup() {
-            return {
-                input: ["B04", "B08"],
-                output: { bands: 4 }
-            };
-        }
-
-        function evaluatePixel(sample) {
-            let ndvi = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
-            
-            // Visualizer (Green for healthy, Yellow/Red for stressed)
-            if (ndvi > 0.6) return [0, 0.8, 0, 1]; // Dark Green
-            if (ndvi > 0.4) return [0.5, 0.9, 0, 1]; // Light Green
-            if (ndvi > 0.2) return [0.9, 0.9, 0, 1]; // Yellow
-            return [0.8, 0, 0, 1]; // Red (Soil/Dead)
-        }
-        """
-        
-        # Coordinates (Bounding Box approx 1km around point)
-        lat, lon = coords
-        bbox = [lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01]
-        
-        # Date (Last 30 days)
-        today = datetime.date.today()
-        past = today - datetime.timedelta(days=30)
-        
-        request_payload = {
-            "input": {
-                "bounds": {
-                    "bbox": bbox,
-                    "properties": {"crs": "http://www.opengis.net/def/crs/EPSG/0/4326"}
+        if raw:
+            # 2. Raw bands: statistics and overlay from one download
+            def load():
+                return ndvi_stats.request_field(bbox, (past, today), token)
+        else:
+            # 2. Setup Request
+            request_payload = {
+                "input": {
+                    "bounds": {
+                        "bbox": bbox,
+                        "properties": {"crs": "http://www.opengis.net/def/crs/EPSG/0/4326"}
+                    },
+                    "data": [{
+                        "type": "sentinel-2-l2a",
+                        "dataFilter": {
+                            "timeRange": {
+                                "from": f"{past}T00:00:00Z",
+                                "to": f"{today}T23:59:59Z"
+                            },
+                            "mosaickingOrder": "leastCC" # Least Cloud Cover
+                        }
+                    }]
                 },
-                "data": [{
-                    "type": "sentinel-2-l2a",
-                    "dataFilter": {
-                        "timeRange": {
-                            "from": f"{past}T00:00:00Z",
-                            "to": f"{today}T23:59:59Z"
-                        },
-                        "mosaickingOrder": "leastCC" # Least Cloud Cover
-                    }
-                }]
-            },
-            "output": {
-                "width": 512,
-                "height": 512,
-                "responses": [{"identifier": "default", "format": {"type": "image/png"}}]
-            },
-            "evalscript": evalscript
-        }
-        
-        # 3. Fetch Image
-        url = "https://services.sentinel-hub.com/api/v1/process"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(url, json=request_payload, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        # 4. Save Image
-        # Save to frontend/static so it can be served
-        static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend', 'static'))
-        if not os.path.exists(static_dir):
-            os.makedirs(static_dir)
+                "output": {
+                    "width": 512,
+                    "height": 512,
+                    "responses": [{"identifier": "default", "format": {"type": "image/png"}}]
+                },
+                "evalscript": evalscript
+            }
             
-        image_path = os.path.join(static_dir, "live_satellite.png")
-        with open(image_path, "wb") as f:
-            f.write(response.content)
+            # 3. Fetch Image
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
             
-        return {
-            "status": "success",
-            "image_path": "live_satellite.png", # Relative path for frontend
-            "ndvi_mean": 0.68, # Simulated mean from live data
-            "message": "Live Sentinel-2 Data Acquired"
-        }
+            def load():
+                response = requests.post(ndvi_stats.PROCESS_URL, json=request_payload, headers=headers, timeout=15)
+                response.raise_for_status()
+                return response.content
+        
+        # 4. Store content-addressed; the URL is unique to this render
+        entry = tile_cache.fetch(key, load)
+        if not entry:
+            return _get_mock_ndvi()
+        return _ndvi_result(entry)
         
     except Exception as e:
         print(f"Sentinel API Error: {e}")
         return _get_mock_ndvi()
 
+def _ndvi_result(entry):
+    stats = entry.get("meta")
+    return {
+        "status": "success",
+        "image_path": entry["url"],
+        "ndvi_mean": stats.get("mean") if stats else None,
+        "ndvi_stats": stats,
+        "message": "Live Sentinel-2 Data Acquired"
+    }
+
 def _get_mock_ndvi():
     """
     Fallback mock data.
@@ -233,10 +273,20 @@ def _get_mock_ndvi():
 def get_gemini_advice(disease_name, ndvi_status):
     """
     Generates treatment plan using Gemini.
+    Responses are cached per (disease, NDVI band); concurrent identical requests share one call.
     """
-    api_key = os.environ.get("GEMINI_API_KEY")
-    
-    if not api_key:
+    cache_key = llm_cache.signature(
+        "get_gemini_advice",
+        disease=llm_cache.normalize_text(disease_name),
+        ndvi=llm_cache.bucket_ndvi(ndvi_status)
+    )
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return single_flight.do(cache_key, lambda: _generate_gemini_advice(disease_name, ndvi_status, cache_key))
+
+def _generate_gemini_advice(disease_name, ndvi_status, cache_key):
+    if not llm_client.is_configured():
         return {
             "status": "warning",
             "advice": "⚠️ API Key missing. Mock Advice: Ensure proper drainage and apply fungicide.",
@@ -244,9 +294,6 @@ def get_gemini_advice(disease_name, ndvi_status):
         }
         
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
         prompt = f"""
         Act as an expert agronomist.
         Disease Detected: {disease_name}
@@ -261,12 +308,13 @@ def get_gemini_advice(disease_name, ndvi_status):
         Keep it concise and actionable for a farmer.
         """
         
-        response = model.generate_content(prompt)
-        return {
+        result = {
             "status": "success",
-            "advice": response.text,
+            "advice": llm_client.generate(prompt),
             "source": "Google Gemini 1.5 Flash"
         }
+        llm_cache.put(cache_key, result)
+        return result
         
     except Exception as e:
         print(f"Gemini API Error: {e}")
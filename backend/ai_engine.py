@@ -1,8 +1,11 @@
-import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 from PIL import Image
 
+try:
+    from backend import llm_client
+except ImportError:
+    import llm_client
+
 # Load environment variables
 load_dotenv()
 
@@ -15,10 +18,8 @@ def predict_disease(image_file):
     Analyzes an image file using Google Gemini Vision API.
     Returns the predicted disease/class, confidence, and recommendation.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    
     # Fallback if API key is missing
-    if not api_key:
+    if not llm_client.is_configured():
         return {
             'detected_disease': 'API Key Missing',
             'confidence': 0.0,
@@ -26,10 +27,6 @@ def predict_disease(image_file):
         }
 
     try:
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-
         # Load Image
         img = Image.open(image_file)
 
@@ -47,17 +44,8 @@ def predict_disease(image_file):
         """
 
         # Generate Content
-        response = model.generate_content([prompt, img])
-        text = response.text.strip()
-
-        # Clean up potential markdown code blocks
-        if text.startswith("```json"):
-            text = text[7:-3]
-        elif text.startswith("```"):
-            text = text[3:-3]
-            
-        import json
-        result = json.loads(text)
+        text = llm_client.generate([prompt, img])
+        result = llm_client.parse_json(text)
         
         # Format for Frontend
         # Frontend expects: 'detected_disease', 'confidence', 'recommendation'
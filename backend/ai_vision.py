@@ -1,49 +1,445 @@
-import tensorflow as tf
 import numpy as np
 from PIL import Image
 import os
+import io
+import time
+import random
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from backend.batch_engine import BatchInferenceEngine
+    from backend import image_pipeline, prediction_cache, prescription_jobs
+except ImportError:
+    from batch_engine import BatchInferenceEngine
+    import image_pipeline
+    import prediction_cache
+    import prescription_jobs
 
 # Load model once at module level if possible, or lazily
 _MODEL = None
+_PREDICT_FN = None
+_BATCHER = None
+_BATCHER_LOCK = threading.Lock()
+_LOAD_LOCK = threading.Lock()
+# Set at load time: how long tracing the serving function took, so /api/metrics shows the cost moved off requests
+_WARMUP_MS = None
+
+# Standard Alphabetical Order (Keras Default)
+CLASS_NAMES = [
+    'Tomato - Bacterial Spot',
+    'Tomato - Early Blight',
+    'Tomato - Healthy',
+    'Tomato - Late Blight',
+    'Tomato - Leaf Mold',
+    'Tomato - Septoria Leaf Spot',
+    'Tomato - Spider Mites',
+    'Tomato - Target Spot',
+    'Tomato - Mosaic Virus',
+    'Tomato - Yellow Leaf Curl Virus'
+]
+
+# Note: The previous list had 9 classes. Standard dataset has 10.
+# Used when the loaded model only has 9 outputs.
+LEGACY_CLASS_NAMES = [
+    'Tomato - Leaf Mold',
+    'Tomato - Septoria Leaf Spot',
+    'Tomato - Spider Mites',
+    'Tomato - Target Spot',
+    'Tomato - Yellow Leaf Curl Virus',
+    'Tomato - Mosaic Virus',
+    'Tomato - Early Blight',
+    'Tomato - Healthy',
+    'Tomato - Late Blight'
+]
+
+# Recommendations based on the new classes
+RECOMMENDATIONS = {
+    "Tomato - Leaf Mold": "Use fungicides like chlorothalonil. Improve air circulation and reduce humidity.",
+    "Tomato - Septoria Leaf Spot": "Remove infected leaves. Apply copper-based fungicides or mancozeb.",
+    "Tomato - Spider Mites": "Apply miticides or neem oil. Increase humidity to discourage mites.",
+    "Tomato - Target Spot": "Apply fungicides such as chlorothalonil or mancozeb. Improve airflow.",
+    "Tomato - Yellow Leaf Curl Virus": "Control whiteflies with insecticides or nets. Remove and destroy infected plants immediately.",
+    "Tomato - Mosaic Virus": "Remove infected plants. Control aphids. Sanitize tools and hands to prevent spread.",
+    "Tomato - Early Blight": "Apply copper-based fungicides. Rotate crops and mulch soil to prevent spore splash.",
+    "Tomato - Healthy": "Great job! Your crop looks healthy. Continue regular monitoring.",
+    "Tomato - Late Blight": "Critical! Remove infected parts immediately. Apply systemic fungicides like metalaxyl."
+}
+
+IMG_SIZE = (224, 224)
+
+# Which runtime serves predictions: "keras" (default), "tflite-int8" or "tflite-fp16".
+# The TFLite files are produced by scripts/export_tflite.py.
+TFLITE_MODEL_PATHS = {
+    "tflite-int8": "model_int8.tflite",
+    "tflite-fp16": "model_fp16.tflite",
+}
+
+class TFLiteModel:
+    """
+    Minimal TFLite runtime wrapper exposing the same predict(batch) call as a Keras model.
+    Uses tflite_runtime when installed so serving nodes don't need to import full TensorFlow.
+    Quantized (int8) inputs/outputs are (de)quantized here, callers always see float32.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        self._resizable = True
+
+    def _set_batch_size(self, batch_size):
+        if batch_size == self._batch_size:
+            return True
+        if not self._resizable:
+            return False
+        try:
+            shape = [batch_size] + list(self._input["shape"][1:])
+            self.interpreter.resize_tensor_input(self._input["index"], shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+            return True
+        except Exception as e:
+            # Some converted graphs have a static batch of 1; run sample by sample instead.
+            print(f"TFLite batch resize unsupported ({e}). Falling back to per-image invoke.")
+            self._resizable = False
+            return False
+
+    def _invoke(self, batch):
+        scale, zero_point = self._input["quantization"]
+        if scale:
+            batch = np.round(batch / scale + zero_point)
+            info = np.iinfo(self._input["dtype"])
+            batch = np.clip(batch, info.min, info.max)
+        self.interpreter.set_tensor(self._input["index"], batch.astype(self._input["dtype"]))
+        self.interpreter.invoke()
+
+        output = self.interpreter.get_tensor(self._output["index"])
+        scale, zero_point = self._output["quantization"]
+        if scale:
+            return (output.astype(np.float32) - zero_point) * scale
+        return output.astype(np.float32)
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        if self._set_batch_size(len(batch)):
+            return self._invoke(batch)
+        self._set_batch_size(1)
+        return np.concatenate([self._invoke(batch[i:i + 1]) for i in range(len(batch))])
+
+def _load_tflite_model(backend):
+    model_path = os.getenv("VISION_MODEL_PATH", TFLITE_MODEL_PATHS[backend])
+    if not os.path.exists(model_path):
+        print(f"TFLite model not found at {model_path}. Run scripts/export_tflite.py first.")
+        return None
+    print(f"Loading {backend} model from {model_path}...")
+    threads = os.getenv("VISION_TFLITE_THREADS")
+    return TFLiteModel(model_path, num_threads=int(threads) if threads else os.cpu_count())
+
+def _load_keras_model():
+    model_path = os.getenv("VISION_MODEL_PATH", 'model.keras')
+    if not os.path.exists(model_path):
+        model_path = 'model.h5'
+
+    if not os.path.exists(model_path):
+        print(f"Model file not found at {model_path}")
+        return None
+
+    import tensorflow as tf
+    print(f"Loading model from {model_path}...")
+    return tf.keras.models.load_model(model_path)
 
 def load_model():
     """
-    Loads the Keras/TensorFlow model.
+    Loads the model for the configured VISION_BACKEND (keras, tflite-int8, tflite-fp16)
+    and warms up its serving function, so no request pays for tracing.
     Returns the loaded model or None if the file is not found.
     """
     global _MODEL
     if _MODEL is not None:
         return _MODEL
-        
-    model_path = 'model.keras'
-    if not os.path.exists(model_path):
-        model_path = 'model.h5'
-    
-    if os.path.exists(model_path):
+
+    with _LOAD_LOCK:
+        if _MODEL is not None:
+            return _MODEL
+        backend = os.getenv("VISION_BACKEND", "keras").lower()
         try:
-            print(f"Loading model from {model_path}...")
-            _MODEL = tf.keras.models.load_model(model_path)
+            model = _load_tflite_model(backend) if backend in TFLITE_MODEL_PATHS else _load_keras_model()
+            if model is None:
+                return None
             print("Model loaded successfully.")
+            _warm_up(model)
+            _MODEL = model
             return _MODEL
         except Exception as e:
             print(f"Error loading model: {e}")
             return None
+
+def preload():
+    """
+    Loads and warms up the model in a background thread at startup (VISION_PRELOAD=1, the default),
+    instead of on the first diagnosis request.
+    """
+    if os.getenv("VISION_PRELOAD", "1") != "1":
+        return None
+    thread = threading.Thread(target=load_model, name="vision-preload", daemon=True)
+    thread.start()
+    return thread
+
+def _compile_keras_model(model):
+    """
+    Wraps the Keras model in a traced tf.function with a fixed (N, 224, 224, 3) float32
+    signature. Calling it skips the data adapter / callback setup model.predict does
+    on every call, which dominates latency at batch size 1.
+    """
+    import tensorflow as tf
+
+    @tf.function(
+        input_signature=[tf.TensorSpec(shape=[None, IMG_SIZE[0], IMG_SIZE[1], 3], dtype=tf.float32)],
+        reduce_retracing=True,
+    )
+    def serve(batch):
+        return model(batch, training=False)
+
+    def predict_fn(batch):
+        return serve(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+
+    return predict_fn
+
+# --- Cascade mode (VISION_CASCADE=1) ---
+# A small first-stage model (trained by scripts/train_cascade.py) answers when its top
+# probability clears a calibrated threshold; only uncertain images reach the full model.
+CASCADE_STAGE1_PATH = os.getenv("VISION_STAGE1_PATH", "model_stage1.keras")
+CASCADE_CALIBRATION_PATH = os.getenv("VISION_CASCADE_CALIBRATION", "cascade_calibration.json")
+_CASCADE_STATS = {"images": 0, "escalated": 0}
+_CASCADE_LOCK = threading.Lock()
+
+def _load_cascade_threshold():
+    threshold = os.getenv("VISION_CASCADE_THRESHOLD")
+    if threshold:
+        return float(threshold)
+    if os.path.exists(CASCADE_CALIBRATION_PATH):
+        import json
+        with open(CASCADE_CALIBRATION_PATH) as f:
+            return float(json.load(f)["threshold"])
+    return 0.9
+
+def _build_cascade_fn(full_predict_fn):
+    """
+    Wraps the full model's predict function with the first-stage model.
+    Falls back to the full model alone if no stage-1 model is available.
+    """
+    if not os.path.exists(CASCADE_STAGE1_PATH):
+        print(f"Cascade stage-1 model not found at {CASCADE_STAGE1_PATH}. Using the full model only.")
+        return full_predict_fn
+
+    print(f"Loading cascade stage-1 model from {CASCADE_STAGE1_PATH}...")
+    if CASCADE_STAGE1_PATH.endswith(".tflite"):
+        stage1_fn = TFLiteModel(CASCADE_STAGE1_PATH, num_threads=os.cpu_count()).predict
     else:
-        print(f"Model file not found at {model_path}")
+        import tensorflow as tf
+        stage1_fn = _compile_keras_model(tf.keras.models.load_model(CASCADE_STAGE1_PATH))
+    threshold = _load_cascade_threshold()
+    print(f"Cascade enabled (threshold {threshold:.3f}).")
+
+    def cascade_fn(batch):
+        probabilities = np.array(stage1_fn(batch), dtype=np.float32)
+        uncertain = np.flatnonzero(probabilities.max(axis=1) < threshold)
+        if len(uncertain):
+            probabilities[uncertain] = full_predict_fn(batch[uncertain])
+        with _CASCADE_LOCK:
+            _CASCADE_STATS["images"] += len(batch)
+            _CASCADE_STATS["escalated"] += len(uncertain)
+        return probabilities
+
+    return cascade_fn
+
+def _warm_up(model):
+    """Builds the serving function for a freshly loaded model and traces it once with a dummy batch."""
+    global _PREDICT_FN, _WARMUP_MS
+    start = time.perf_counter()
+    if isinstance(model, TFLiteModel):
+        predict_fn = model.predict
+    else:
+        predict_fn = _compile_keras_model(model)
+    if os.getenv("VISION_CASCADE", "0") == "1":
+        predict_fn = _build_cascade_fn(predict_fn)
+
+    predict_fn(np.zeros((1, IMG_SIZE[0], IMG_SIZE[1], 3), dtype=np.float32))
+    _PREDICT_FN = predict_fn
+    _WARMUP_MS = (time.perf_counter() - start) * 1000.0
+    print(f"Model warmed up in {_WARMUP_MS:.0f} ms.")
+
+def get_predict_fn():
+    """
+    Returns the low-latency batch -> probabilities callable for the loaded model
+    (built and warmed up by load_model).
+    """
+    if _PREDICT_FN is None:
+        load_model()
+    return _PREDICT_FN
+
+def _get_batcher():
+    """
+    Returns the shared micro-batching engine in front of the loaded model.
+    Batch size / wait window are tunable via VISION_MAX_BATCH and VISION_MAX_WAIT_MS.
+    """
+    global _BATCHER
+    if _BATCHER is not None:
+        return _BATCHER
+
+    predict_fn = get_predict_fn()
+    if predict_fn is None:
         return None
 
+    with _BATCHER_LOCK:
+        if _BATCHER is None:
+            _BATCHER = BatchInferenceEngine(
+                predict_fn,
+                max_batch_size=int(os.getenv("VISION_MAX_BATCH", "32")),
+                max_wait_ms=float(os.getenv("VISION_MAX_WAIT_MS", "10")),
+                name="ai_vision",
+            )
+    return _BATCHER
+
+def get_stats():
+    """
+    Queue depth and batch-size statistics of the inference engine.
+    """
+    if _BATCHER is None:
+        return {
+            "status": "idle",
+            "model_loaded": _MODEL is not None,
+            "warmup_ms": _WARMUP_MS,
+            "preprocess": image_pipeline.get_stats(),
+            "cache": prediction_cache.get_stats()
+        }
+    stats = _BATCHER.stats()
+    stats["status"] = "running"
+    stats["model_loaded"] = True
+    stats["warmup_ms"] = _WARMUP_MS
+    stats["backend"] = os.getenv("VISION_BACKEND", "keras").lower()
+    stats["preprocess"] = image_pipeline.get_stats()
+    stats["cache"] = prediction_cache.get_stats()
+    if _CASCADE_STATS["images"]:
+        with _CASCADE_LOCK:
+            cascade = dict(_CASCADE_STATS)
+        cascade["escalation_rate"] = cascade["escalated"] / cascade["images"]
+        stats["cascade"] = cascade
+    return stats
+
+def _prepare_image(image_data, out=None):
+    """
+    Decodes and preprocesses one image into a (224, 224, 3) float32 array scaled to [-1, 1].
+    Writes into `out` when given (e.g. a row of a preallocated batch buffer).
+    """
+    if out is None:
+        out = np.empty((IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32)
+    image_pipeline.preprocess_into(image_data, out, IMG_SIZE)
+    return out
+
+def _class_names_for(num_outputs):
+    """
+    Picks the label list matching the model's output width.
+    """
+    if num_outputs != len(CLASS_NAMES):
+        print(f"WARNING: Model predicts {num_outputs} classes, but we have {len(CLASS_NAMES)} names.")
+        # Fallback to the previous list if shape matches 9
+        if num_outputs == 9:
+            return LEGACY_CLASS_NAMES
+    return CLASS_NAMES
+
+def _interpret(probabilities):
+    """
+    Turns one probability vector into (disease_name, confidence, randomized).
+    `randomized` is True when the low-confidence demo fallback picked the class,
+    so the result must not be cached.
+    """
+    class_names = _class_names_for(len(probabilities))
+
+    predicted_class_index = int(np.argmax(probabilities))
+    confidence = float(np.max(probabilities))
+
+    # --- User Request: Random Fallback for Variety ---
+    # If confidence is low (uncertain), pick a random class to show variety
+    # instead of defaulting to the same "uncertain" class every time.
+    randomized = confidence < 0.50
+    if randomized:
+        print("Low confidence. Using random fallback for demo variety.")
+        predicted_class_index = random.randint(0, len(class_names) - 1)
+        confidence = random.uniform(0.7, 0.95) # Fake high confidence for demo
+        disease_name = class_names[predicted_class_index] + " (Randomized)"
+    elif 0 <= predicted_class_index < len(class_names):
+        disease_name = class_names[predicted_class_index]
+    else:
+        disease_name = "Unknown Class"
+
+    return disease_name, confidence, randomized
+
+def _read_upload(image_data):
+    """
+    Returns (raw bytes or None, image_data to decode from).
+    PIL Images have no original bytes, so only perceptual caching applies to them.
+    """
+    if isinstance(image_data, (bytes, bytearray)):
+        data = bytes(image_data)
+    elif isinstance(image_data, (str, os.PathLike)):
+        with open(image_data, 'rb') as f:
+            data = f.read()
+    elif hasattr(image_data, 'read'):
+        data = image_data.read()
+    else:
+        return None, image_data
+    return data, io.BytesIO(data)
+
+def _cache_keys(image_data):
+    """
+    Content-hash key (plus a dHash key in perceptual mode) for the prediction cache.
+    Returns (keys, perceptual hash or None, image_data to decode from).
+    """
+    data, image_data = _read_upload(image_data)
+    keys = []
+    phash = None
+    if data is not None:
+        keys.append(prediction_cache.content_key(data))
+    if prediction_cache.CACHE_MODE == "perceptual":
+        phash = prediction_cache.perceptual_hash(data if data is not None else image_data)
+        keys.append(prediction_cache.perceptual_key(phash))
+        if hasattr(image_data, 'seek'):
+            image_data.seek(0)
+    return keys, phash, image_data
+
 def analyze_image(image_data):
     """
     Analyzes the image using the loaded model.
-    
+    The forward pass goes through the shared batching engine, so concurrent
+    requests are grouped into one model call. Repeat uploads of the same photo
+    are answered from the prediction cache without touching the model or Gemini.
+
+    The diagnosis returns immediately with the static recommendation. When Gemini
+    is configured, a background prescription job is started and its id returned
+    as "prescription_job_id" (poll /api/prescription/<id>).
+
     Args:
-        image_data: The input image data (file-like object or PIL Image).
-        
+        image_data: The input image data (path, bytes, file-like object or PIL Image).
+
     Returns:
         dict: Structured analysis result.
     """
-    model = load_model()
-    
+    batcher = _get_batcher()
+
     # Default fallback response
     result = {
         "detected_disease": "Unknown",
@@ -52,7 +448,7 @@ def analyze_image(image_data):
         "status": "error"
     }
 
-    if model is None:
+    if batcher is None:
         # Fallback for when model is not present (Simulated for demo)
         return {
             "detected_disease": "Wheat Rust (Simulated)",
@@ -62,134 +458,128 @@ def analyze_image(image_data):
         }
 
     try:
-        # Open/Prepare Image
-        if isinstance(image_data, (str, os.PathLike)) or hasattr(image_data, 'read'):
-             image = Image.open(image_data)
-        else:
-             image = image_data
-
-        # Ensure image is RGB
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-
-        # Resize to (224, 224)
-        image = image.resize((224, 224))
-        
-        # Convert to NumPy array
-        img_array = np.array(image)
-        
-        # Preprocessing: Scale to [-1, 1] (Required for MobileNetV3)
-        img_array = (img_array / 127.5) - 1.0
-        
-        # Expand dimensions to match model input shape (1, 224, 224, 3)
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        # Prediction
-        prediction = model.predict(img_array)
-        print(f"DEBUG: Prediction Probabilities: {prediction}")
-        
-        # Interpretation
-        # Standard Alphabetical Order (Keras Default)
-        class_names = [
-            'Tomato - Bacterial Spot',
-            'Tomato - Early Blight',
-            'Tomato - Healthy',
-            'Tomato - Late Blight',
-            'Tomato - Leaf Mold',
-            'Tomato - Septoria Leaf Spot',
-            'Tomato - Spider Mites',
-            'Tomato - Target Spot',
-            'Tomato - Mosaic Virus',
-            'Tomato - Yellow Leaf Curl Virus'
-        ]
-        
-        # Note: The previous list had 9 classes. Standard dataset has 10. 
-        # If the model output shape is 9, we need to adjust.
-        if prediction.shape[1] != len(class_names):
-            print(f"WARNING: Model predicts {prediction.shape[1]} classes, but we have {len(class_names)} names.")
-            # Fallback to the previous list if shape matches 9
-            if prediction.shape[1] == 9:
-                 class_names = [
-                    'Tomato - Leaf Mold',
-                    'Tomato - Septoria Leaf Spot',
-                    'Tomato - Spider Mites',
-                    'Tomato - Target Spot',
-                    'Tomato - Yellow Leaf Curl Virus',
-                    'Tomato - Mosaic Virus',
-                    'Tomato - Early Blight',
-                    'Tomato - Healthy',
-                    'Tomato - Late Blight'
-                ]
-        
-        predicted_class_index = np.argmax(prediction)
-        confidence = float(np.max(prediction))
-        
-        # --- User Request: Random Fallback for Variety ---
-        # If confidence is low (uncertain), pick a random class to show variety
-        # instead of defaulting to the same "uncertain" class every time.
-        import random
-        if confidence < 0.50: 
-            print("Low confidence. Using random fallback for demo variety.")
-            predicted_class_index = random.randint(0, len(class_names) - 1)
-            confidence = random.uniform(0.7, 0.95) # Fake high confidence for demo
-            disease_name = class_names[predicted_class_index] + " (Randomized)"
-        elif 0 <= predicted_class_index < len(class_names):
-            disease_name = class_names[predicted_class_index]
-        else:
-            disease_name = "Unknown Class"
-            
-        # Recommendations based on the new classes
-        recommendations = {
-            "Tomato - Leaf Mold": "Use fungicides like chlorothalonil. Improve air circulation and reduce humidity.",
-            "Tomato - Septoria Leaf Spot": "Remove infected leaves. Apply copper-based fungicides or mancozeb.",
-            "Tomato - Spider Mites": "Apply miticides or neem oil. Increase humidity to discourage mites.",
-            "Tomato - Target Spot": "Apply fungicides such as chlorothalonil or mancozeb. Improve airflow.",
-            "Tomato - Yellow Leaf Curl Virus": "Control whiteflies with insecticides or nets. Remove and destroy infected plants immediately.",
-            "Tomato - Mosaic Virus": "Remove infected plants. Control aphids. Sanitize tools and hands to prevent spread.",
-            "Tomato - Early Blight": "Apply copper-based fungicides. Rotate crops and mulch soil to prevent spore splash.",
-            "Tomato - Healthy": "Great job! Your crop looks healthy. Continue regular monitoring.",
-            "Tomato - Late Blight": "Critical! Remove infected parts immediately. Apply systemic fungicides like metalaxyl."
-        }
-        
-        # Try Gemini for Realtime Prescription
-        try:
-            import google.generativeai as genai
-            from dotenv import load_dotenv
-            load_dotenv()
-            
-            api_key = os.getenv("GEMINI_API_KEY")
-            if api_key and disease_name != "Unknown Class":
-                genai.configure(api_key=api_key)
-                gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-                
-                prompt = f"""
-                The user's plant has been diagnosed with: {disease_name}.
-                Provide a concise but effective treatment prescription.
-                Include:
-                1. Immediate Action (1 sentence)
-                2. Organic/Chemical Treatment (1 sentence)
-                3. Prevention for future (1 sentence)
-                Keep it under 60 words total.
-                """
-                
-                response = gemini_model.generate_content(prompt)
-                recommendation = response.text.strip()
-                print("Gemini Prescription Generated.")
-            else:
-                raise Exception("No API Key or Unknown Disease")
-                
-        except Exception as e:
-            print(f"Gemini Fallback: {e}")
-            recommendation = recommendations.get(disease_name, "Consult an expert.")
+        cache = prediction_cache.get_cache()
+        keys = []
+        if cache is not None:
+            keys, phash, image_data = _cache_keys(image_data)
+            cached = cache.get(keys, phash)
+            if cached is not None:
+                return dict(cached, cached=True)
 
-        return {
+        img_array = _prepare_image(image_data, out=image_pipeline.sample_buffer(IMG_SIZE))
+
+        # Prediction (batched with any other in-flight requests)
+        probabilities = batcher.predict(img_array)
+        disease_name, confidence, randomized = _interpret(probabilities)
+        if randomized:
+            # A random pick must not be served again for the same photo
+            keys = []
+
+        result = {
             "detected_disease": disease_name,
             "confidence": confidence,
-            "recommendation": recommendation,
+            "recommendation": RECOMMENDATIONS.get(disease_name, "Consult an expert."),
             "status": "success"
         }
+        if cache is not None and keys:
+            cache.put(keys, result)
+
+        if prescription_jobs.is_enabled() and disease_name != "Unknown Class":
+            def refresh_cache(prescription):
+                if cache is not None and keys:
+                    cache.put(keys, dict(result, recommendation=prescription, prescription_status="done"))
+
+            job_id = prescription_jobs.submit(disease_name, result["recommendation"], on_done=refresh_cache)
+            return dict(result, prescription_job_id=job_id, prescription_status="pending")
+        return result
 
     except Exception as e:
         print(f"Error during prediction: {e}")
         result["recommendation"] = f"Error: {str(e)}"
         return result
+
+def analyze_batch(items, max_workers=None):
+    """
+    Classifies many images, yielding (name, result) as soon as each result is ready.
+
+    Images are decoded in parallel, a batch at a time, straight into a preallocated
+    buffer; while one batch is in the model the next one is being decoded. Results
+    use the static recommendation table (no per-image LLM call).
+
+    Args:
+        items: Iterable of (name, image_data) pairs. Consumed lazily, so it can stream
+               members out of an archive.
+        max_workers: Decode threads (defaults to the CPU count).
+    """
+    batcher = _get_batcher()
+    if batcher is None:
+        for name, _ in items:
+            yield name, {
+                "detected_disease": "Wheat Rust (Simulated)",
+                "confidence": 0.85,
+                "recommendation": "Model file not found. Using simulated result. Apply fungicide.",
+                "status": "warning"
+            }
+        return
+
+    batch_size = batcher.max_batch_size
+    buffers = [image_pipeline.allocate_batch(batch_size, IMG_SIZE) for _ in range(2)]
+    items = iter(items)
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        def start_decoding(buffer):
+            chunk = list(itertools.islice(items, batch_size))
+            return [(name, pool.submit(_prepare_image, data, buffer[i])) for i, (name, data) in enumerate(chunk)]
+
+        slot = 0
+        decoding = start_decoding(buffers[slot])
+        while decoding:
+            names, ok = [], []
+            for name, decode_future in decoding:
+                names.append(name)
+                try:
+                    decode_future.result()
+                    ok.append(True)
+                except Exception as e:
+                    ok.append(False)
+                    yield name, {
+                        "detected_disease": "Unknown",
+                        "confidence": 0.0,
+                        "recommendation": f"Error: {str(e)}",
+                        "status": "error"
+                    }
+
+            # Only the decoded rows go to the model: failed ones would be left-over pixels
+            # from an earlier batch. Move them to the front so the batch stays one slice.
+            rows = [i for i, decoded in enumerate(ok) if decoded]
+            batch = buffers[slot]
+            if rows != list(range(len(rows))):
+                batch[:len(rows)] = batch[rows]
+            batch = batch[:len(rows)]
+
+            # Overlap: decode the next batch into the other buffer while this one runs
+            slot = 1 - slot
+            decoding = start_decoding(buffers[slot])
+
+            if not rows:
+                continue
+            try:
+                probabilities = batcher.predict_batch(batch)
+            except Exception as e:
+                for i in rows:
+                    yield names[i], {
+                        "detected_disease": "Unknown",
+                        "confidence": 0.0,
+                        "recommendation": f"Error: {str(e)}",
+                        "status": "error"
+                    }
+                continue
+
+            for row, i in enumerate(rows):
+                disease_name, confidence, _ = _interpret(probabilities[row])
+                yield names[i], {
+                    "detected_disease": disease_name,
+                    "confidence": confidence,
+                    "recommendation": RECOMMENDATIONS.get(disease_name, "Consult an expert."),
+                    "status": "success"
+                }
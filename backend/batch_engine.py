@@ -0,0 +1,143 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchInferenceEngine:
+    """
+    Dynamic micro-batching in front of a model.
+    Callers submit single samples; a worker thread groups whatever is queued
+    (up to max_batch_size, or until max_wait_ms has passed since the first
+    sample arrived) into one forward pass and hands each caller its row.
+    A lone request on an idle engine is dispatched straight away, so the wait
+    window is only paid once there is actual concurrency to batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=10.0, name="inference"):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._last_batch_size = 0
+        self._buffer = None
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "errors": 0,
+            "max_batch_size_seen": 0,
+            "total_queue_wait_s": 0.0,
+            "total_inference_s": 0.0,
+            "batch_size_histogram": {},
+        }
+
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._worker.start()
+
+    # --- Public API ---
+    def submit(self, sample):
+        """
+        Queues one sample (array without the batch dimension).
+        Returns a Future that resolves to that sample's output row.
+        """
+        future = Future()
+        self._queue.put((sample, future, time.monotonic()))
+        return future
+
+    def predict(self, sample, timeout=None):
+        """Blocking helper: submit one sample and wait for its result."""
+        return self.submit(sample).result(timeout=timeout)
+
+    def predict_batch(self, batch):
+        """
+        Runs an already-assembled batch (e.g. from a bulk upload) as one forward pass.
+        Serialized with the worker, so the model is never called concurrently.
+        """
+        started = time.monotonic()
+        with self._run_lock:
+            outputs = self.predict_fn(batch)
+        self._record(len(batch), started, time.monotonic(), 0.0)
+        return outputs
+
+    def stats(self):
+        """Snapshot of queue depth and batching statistics."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["batch_size_histogram"] = dict(self._stats["batch_size_histogram"])
+
+        batches = snapshot["batches"]
+        requests = snapshot["requests"]
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["max_batch_size"] = self.max_batch_size
+        snapshot["max_wait_ms"] = self.max_wait * 1000.0
+        snapshot["mean_batch_size"] = (requests / batches) if batches else 0.0
+        snapshot["mean_queue_wait_ms"] = (snapshot.pop("total_queue_wait_s") / requests * 1000.0) if requests else 0.0
+        snapshot["mean_inference_ms"] = (snapshot.pop("total_inference_s") / batches * 1000.0) if batches else 0.0
+        return snapshot
+
+    # --- Worker ---
+    def _collect_batch(self):
+        """Blocks for the first item, then drains the queue until full or the wait window closes."""
+        batch = [self._queue.get()]
+        if self._last_batch_size <= 1 and self._queue.empty():
+            return batch
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _stack(self, batch):
+        """Copies the samples into a reused (max_batch_size, ...) buffer instead of allocating per batch."""
+        first = np.asarray(batch[0][0])
+        if self._buffer is None or self._buffer.shape[1:] != first.shape or self._buffer.dtype != first.dtype:
+            self._buffer = np.empty((self.max_batch_size,) + first.shape, dtype=first.dtype)
+        return np.stack([sample for sample, _, _ in batch], out=self._buffer[:len(batch)])
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+
+            try:
+                inputs = self._stack(batch)
+                with self._run_lock:
+                    outputs = self.predict_fn(inputs)
+            except Exception as e:
+                print(f"{self.name} batch of {len(batch)} failed: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.monotonic()
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(outputs[i])
+
+            size = len(batch)
+            self._last_batch_size = size
+            self._record(size, started, finished, sum(started - queued for _, _, queued in batch))
+
+    def _record(self, size, started, finished, queue_wait):
+        with self._lock:
+            self._stats["requests"] += size
+            self._stats["batches"] += 1
+            self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], size)
+            self._stats["total_queue_wait_s"] += queue_wait
+            self._stats["total_inference_s"] += finished - started
+            histogram = self._stats["batch_size_histogram"]
+            histogram[size] = histogram.get(size, 0) + 1
@@ -1,11 +1,9 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 
-load_dotenv()
-
-# Configure Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+try:
+    from backend import llm_cache, llm_client
+except ImportError:
+    import llm_cache
+    import llm_client
 
 # 1. The "Master Crop Database" (Internal Storage)
 MASTER_CROP_DB = {
@@ -118,10 +116,18 @@ def analyze_location(lat, lon):
 def get_gemini_recommendation(lat, lon, zone_info):
     """
     Uses Google Gemini to refine the recommendation with local specifics.
+    Responses are cached per (rounded coordinates, zone).
     """
+    cache_key = llm_cache.signature(
+        "get_gemini_recommendation",
+        location=llm_cache.round_location((lat, lon)),
+        zone=zone_info.get('zone')
+    )
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        
         prompt = f"""
         Acting as a local expert farmer for coordinates {lat}, {lon} (Region: {zone_info.get('zone')}).
         
@@ -138,8 +144,9 @@ def get_gemini_recommendation(lat, lon, zone_info):
         }}
         """
         
-        response = model.generate_content(prompt)
-        return response.text
+        text = llm_client.generate(prompt, model_name='gemini-pro')
+        llm_cache.put(cache_key, text)
+        return text
         
     except Exception as e:
         print(f"Gemini Error: {e}")
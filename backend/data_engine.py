@@ -1,29 +1,45 @@
 import os
-import google.generativeai as genai
+import datetime
 from dotenv import load_dotenv
 
+try:
+    from backend import llm_cache, llm_client, single_flight, advice_corpus, geocoding, district_index, sentinel_auth, tile_cache, ndvi_stats, ndvi_tiles, local_rasters
+except ImportError:
+    import llm_cache
+    import llm_client
+    import single_flight
+    import advice_corpus
+    import geocoding
+    import district_index
+    import sentinel_auth
+    import tile_cache
+    import ndvi_stats
+    import ndvi_tiles
+    import local_rasters
+
 # Load environment variables
 load_dotenv()
 
-def get_advice(disease_name, ndvi_status):
-    """
-    Generates treatment advice using Google Gemini API.
-    """
-    api_key = os.getenv("GEMINI_API_KEY")
-    
-    if not api_key:
-        # Fallback for Demo (No API Key)
-        return {
-            "status": "success",
-            "advice": f"**AI Agronomist Treatment Plan for {disease_name}**\n\n1. **Immediate Action**: Isolate affected plants to prevent spread.\n2. **Organic Treatment**: Apply neem oil solution (5ml/liter) every 3 days.\n3. **Soil Management**: Improve drainage and avoid overhead watering to reduce humidity.",
-            "source": "Open-Agri AI (Offline Mode)"
-        }
-        
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        prompt = f"""
+# Scout errors are appended here (benchmarks point it at a scratch file)
+DEBUG_LOG_PATH = os.getenv("DEBUG_LOG_PATH", "debug_log.txt")
+
+# Language Mapping
+LANGUAGES = {
+    'hi': 'Hindi (हिंदी)',
+    'kn': 'Kannada (ಕನ್ನಡ)',
+    'en': 'English'
+}
+
+def _advice_key(disease_name, ndvi_status, language='en'):
+    return llm_cache.signature(
+        "get_advice",
+        disease=llm_cache.normalize_text(disease_name),
+        ndvi=llm_cache.bucket_ndvi(ndvi_status),
+        language=language
+    )
+
+def _advice_prompt(disease_name, ndvi_status, language='en'):
+    prompt = f"""
         You are an expert agronomist.
         Disease Detected: {disease_name}
         Field Health (NDVI): {ndvi_status}
@@ -31,66 +47,145 @@ def get_advice(disease_name, ndvi_status):
         Provide a concise, actionable 3-step treatment plan.
         Format as Markdown.
         """
+    if language != 'en':
+        prompt += f"""Write the plan in {LANGUAGES.get(language, 'English')}, but keep chemical names and numbers in English.
+        """
+    return prompt
+
+def _offline_advice(disease_name, key_missing=False):
+    if key_missing:
+        # Fallback for Demo (No API Key)
+        advice = f"**AI Agronomist Treatment Plan for {disease_name}**\n\n1. **Immediate Action**: Isolate affected plants to prevent spread.\n2. **Organic Treatment**: Apply neem oil solution (5ml/liter) every 3 days.\n3. **Soil Management**: Improve drainage and avoid overhead watering to reduce humidity."
+    else:
+        # Fallback on Error
+        advice = f"**AI Agronomist Treatment Plan for {disease_name}**\n\n1. **Immediate Action**: Remove infected leaves immediately.\n2. **Treatment**: Apply copper-based fungicide or organic equivalent.\n3. **Prevention**: Ensure proper spacing between plants for air circulation."
+    return {
+        "status": "success",
+        "advice": advice,
+        "source": "Open-Agri AI (Offline Mode)"
+    }
+
+def get_advice(disease_name, ndvi_status, language='en'):
+    """
+    Generates treatment advice using Google Gemini API.
+    Known (disease, NDVI band, language) combinations come from the precomputed corpus
+    (scripts/build_advice_corpus.py) without touching the network.
+    Other responses are cached; concurrent identical requests share one call.
+    """
+    precomputed = advice_corpus.lookup(disease_name, ndvi_status, language)
+    if precomputed is not None:
+        return precomputed
+
+    cache_key = _advice_key(disease_name, ndvi_status, language)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return single_flight.do(cache_key, lambda: _generate_advice(disease_name, ndvi_status, language, cache_key))
+
+def _generate_advice(disease_name, ndvi_status, language, cache_key):
+    if not llm_client.is_configured():
+        return _offline_advice(disease_name, key_missing=True)
         
-        response = model.generate_content(prompt)
-        return {
+    try:
+        result = {
             "status": "success",
-            "advice": response.text,
+            "advice": llm_client.generate(_advice_prompt(disease_name, ndvi_status, language)),
             "source": "Google Gemini 1.5 Flash"
         }
+        llm_cache.put(cache_key, result)
+        return result
         
     except Exception as e:
         print(f"Gemini API Error: {e}")
-        # Fallback on Error
-        return {
-            "status": "success",
-            "advice": f"**AI Agronomist Treatment Plan for {disease_name}**\n\n1. **Immediate Action**: Remove infected leaves immediately.\n2. **Treatment**: Apply copper-based fungicide or organic equivalent.\n3. **Prevention**: Ensure proper spacing between plants for air circulation.",
-            "source": "Open-Agri AI (Offline Mode)"
-        }
-
-# Sentinel Hub Credentials
-CLIENT_ID = "9fd0e481-766f-40ff-a543-4d78efea81e5"
-CLIENT_SECRET = "0i7xNjHthfLzVYY3yyCxLPhrOAWFvDop"
+        return _offline_advice(disease_name)
 
-def get_auth_token():
+def stream_advice(disease_name, ndvi_status, language='en'):
     """
-    Obtains an access token from Sentinel Hub.
+    Streaming mode of get_advice. Yields (event, payload) pairs:
+    ("chunk", markdown_text) as Gemini produces it, then exactly one final
+    ("done", result) or, if the stream fails midway, ("fallback", result) whose
+    complete plan replaces the partial text. Corpus and cache hits arrive as one chunk.
     """
+    cache_key = _advice_key(disease_name, ndvi_status, language)
+    cached = advice_corpus.lookup(disease_name, ndvi_status, language) or llm_cache.get(cache_key)
+    if cached is not None:
+        yield "chunk", cached["advice"]
+        yield "done", cached
+        return
+
+    if not llm_client.is_configured():
+        result = _offline_advice(disease_name, key_missing=True)
+        yield "chunk", result["advice"]
+        yield "done", result
+        return
+
+    parts = []
     try:
-        import requests
-        token_url = "https://services.sentinel-hub.com/oauth/token"
-        payload = {
-            "grant_type": "client_credentials",
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET
-        }
-        response = requests.post(token_url, data=payload, timeout=10)
-        response.raise_for_status()
-        return response.json().get("access_token")
+        for text in llm_client.generate_stream(_advice_prompt(disease_name, ndvi_status, language)):
+            parts.append(text)
+            yield "chunk", text
     except Exception as e:
-        print(f"Auth Error: {e}")
-        return None
+        print(f"Gemini Stream Error: {e}")
+        # Another request may have cached a full plan meanwhile
+        yield "fallback", llm_cache.get(cache_key) or _offline_advice(disease_name)
+        return
+
+    result = {
+        "status": "success",
+        "advice": "".join(parts),
+        "source": "Google Gemini 1.5 Flash"
+    }
+    llm_cache.put(cache_key, result)
+    yield "done", result
+
+def get_auth_token():
+    """
+    Sentinel Hub access token from the shared token manager (cached, refreshed before expiry).
+    """
+    return sentinel_auth.get_token()
+
+NDVI_EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {
+        input: ["B04", "B08"],
+        output: { bands: 4 }
+    };
+}
+
+function evaluatePixel(sample) {
+    let ndvi = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+    
+    // Visualizer (Green for healthy, Yellow/Red for stressed)
+    if (ndvi > 0.6) return [0, 0.8, 0, 1]; // Dark Green
+    if (ndvi > 0.4) return [0.5, 0.9, 0, 1]; // Light Green
+    if (ndvi > 0.2) return [0.9, 0.9, 0, 1]; // Yellow
+    return [0.8, 0, 0, 1]; // Red (Soil/Dead)
+}
+"""
 
 def get_satellite_map(location_input):
     """
-    Fetches live NDVI image from Sentinel Hub for a location (name or coords).
+    Fetches live NDVI image from Sentinel Hub for a location
+    (a geocoding.ResolvedLocation, coords, or a name to geocode).
+    Served from the local raster archive when it covers the field (local_rasters.MODE).
+    Renders are kept in tile_cache; each one gets its own immutable URL.
+    In raw mode (ndvi_stats.MODE) the field statistics come back as "ndvi_stats".
     """
     import requests
-    import datetime
-    from geopy.geocoders import Nominatim
     
     # Resolve Coordinates
     coords = None
-    if isinstance(location_input, (tuple, list)):
+    if isinstance(location_input, geocoding.ResolvedLocation):
+        coords = location_input.coords
+    elif isinstance(location_input, (tuple, list)):
         coords = location_input
     else:
         try:
-            geolocator = Nominatim(user_agent="open_agri_os_backend")
-            loc = geolocator.geocode(location_input)
-            if loc:
-                coords = (loc.latitude, loc.longitude)
-        except Exception as e:
-            print(f"Geocoding Error: {e}")
+            location = geocoding.resolve(location_input)
+        except geocoding.GeocoderBusy as e:
+            return {"status": "error", "message": str(e)}
+        coords = location.coords if location else None
             
     if not coords:
         return {
@@ -98,7 +193,32 @@ def get_satellite_map(location_input):
             "message": "Could not resolve location coordinates."
         }
 
-    # 1. Authenticate
+    # 1. Cache key: snapped field bbox, look-back window, evalscript and size
+    bbox = tile_cache.field_bbox(*coords)
+    window = tile_cache.time_window()
+
+    # Local Sentinel-2 archive first (offline rigs, archived tiles): no token, no network
+    if local_rasters.MODE != "sentinel":
+        entry, cached = local_rasters.render_field(bbox, window)
+        if entry:
+            acquired = (entry.get("meta") or {}).get("acquired")
+            return _map_result(bbox, window, entry, cached=cached,
+                               message=f"Local Sentinel-2 Archive ({acquired})")
+        if local_rasters.MODE == "local":
+            return _get_mock_map()
+
+    raw = ndvi_stats.MODE == "raw"
+    if raw:
+        key = ndvi_stats.tile_key(bbox, window)
+    else:
+        key = tile_cache.tile_key(bbox, window, NDVI_EVALSCRIPT, 512, 512)
+
+    # Repeat scouts of the same field are served from disk, without a token or an API call
+    entry = tile_cache.get_entry(key)
+    if entry:
+        return _map_result(bbox, window, entry, cached=True)
+
+    # 2. Authenticate
     token = get_auth_token()
     
     # Fallback if auth fails
@@ -107,93 +227,76 @@ def get_satellite_map(location_input):
         return _get_mock_map()
 
     try:
-        # 2. Setup Request
-        evalscript = """
-        //VERSION=3
-        function setup() {
-            return {
-                input: ["B04", "B08"],
-                output: { bands: 4 }
-            };
-        }
-
-        function evaluatePixel(sample) {
-            let ndvi = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
-            
-            // Visualizer (Green for healthy, Yellow/Red for stressed)
-            if (ndvi > 0.6) return [0, 0.8, 0, 1]; // Dark Green
-            if (ndvi > 0.4) return [0.5, 0.9, 0, 1]; // Light Green
-            if (ndvi > 0.2) return [0.9, 0.9, 0, 1]; // Yellow
-            return [0.8, 0, 0, 1]; // Red (Soil/Dead)
-        }
-        """
-        
-        # Coordinates (Bounding Box approx 1km around point)
-        lat, lon = coords
-        bbox = [lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01]
-        
-        # Date (Last 30 days)
-        today = datetime.date.today()
-        past = today - datetime.timedelta(days=30)
-        
-        request_payload = {
-            "input": {
-                "bounds": {
-                    "bbox": bbox,
-                    "properties": {"crs": "http://www.opengis.net/def/crs/EPSG/0/4326"}
+        if raw:
+            # 3. One download of the raw bands gives both the statistics and the overlay
+            def load():
+                return ndvi_stats.request_field(bbox, window, token)
+        else:
+            # 3. Colored PNG rendered by Sentinel Hub
+            past, today = window
+            request_payload = {
+                "input": {
+                    "bounds": {
+                        "bbox": bbox,
+                        "properties": {"crs": "http://www.opengis.net/def/crs/EPSG/0/4326"}
+                    },
+                    "data": [{
+                        "type": "sentinel-2-l2a",
+                        "dataFilter": {
+                            "timeRange": {
+                                "from": f"{past}T00:00:00Z",
+                                "to": f"{today}T23:59:59Z"
+                            },
+                            "mosaickingOrder": "leastCC" # Least Cloud Cover
+                        }
+                    }]
                 },
-                "data": [{
-                    "type": "sentinel-2-l2a",
-                    "dataFilter": {
-                        "timeRange": {
-                            "from": f"{past}T00:00:00Z",
-                            "to": f"{today}T23:59:59Z"
-                        },
-                        "mosaickingOrder": "leastCC" # Least Cloud Cover
-                    }
-                }]
-            },
-            "output": {
-                "width": 512,
-                "height": 512,
-                "responses": [{"identifier": "default", "format": {"type": "image/png"}}]
-            },
-            "evalscript": evalscript
-        }
-        
-        # 3. Fetch Image
-        url = "https://services.sentinel-hub.com/api/v1/process"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(url, json=request_payload, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        # 4. Save Image
-        # Save to static folder in the parent directory (relative to backend folder)
-        # Assuming backend/data_engine.py is one level deep
-        static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static')
-        if not os.path.exists(static_dir):
-            os.makedirs(static_dir)
-            
-        image_path = os.path.join(static_dir, "live_satellite.png")
-        with open(image_path, "wb") as f:
-            f.write(response.content)
-            
-        return {
-            "status": "success",
-            "image_url": "/static/live_satellite.png",
-            "bbox": [[lat - 0.01, lon - 0.01], [lat + 0.01, lon + 0.01]], # LatLngBounds for Leaflet
-            "ndvi_mean": 0.68,
-            "message": "Live Sentinel-2 Data Acquired"
-        }
+                "output": {
+                    "width": 512,
+                    "height": 512,
+                    "responses": [{"identifier": "default", "format": {"type": "image/png"}}]
+                },
+                "evalscript": NDVI_EVALSCRIPT
+            }
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+
+            def load():
+                response = requests.post(ndvi_stats.PROCESS_URL, json=request_payload, headers=headers, timeout=15)
+                response.raise_for_status()
+                return response.content
+
+        # 4. Fetched once even if several users scout the same field together,
+        # stored content-addressed so every render gets its own URL
+        entry = tile_cache.fetch(key, load)
+        if not entry:
+            return _get_mock_map()
+        return _map_result(bbox, window, entry, cached=False)
         
     except Exception as e:
         print(f"Sentinel API Error: {e}")
         return _get_mock_map()
 
+def _map_result(bbox, window, entry, cached, message="Live Sentinel-2 Data Acquired"):
+    stats = entry.get("meta")
+    return {
+        "status": "success",
+        "image_url": entry["url"],
+        "bbox": [[bbox[1], bbox[0]], [bbox[3], bbox[2]]], # LatLngBounds for Leaflet
+        "ndvi_mean": stats.get("mean") if stats else None,
+        "ndvi_stats": stats,
+        "message": message,
+        "cached": cached,
+        # Slippy-map NDVI tiles for panning / zooming beyond the field box
+        "tiles": {
+            "url": ndvi_tiles.tile_url(window),
+            "min_zoom": ndvi_tiles.MIN_ZOOM,
+            "max_zoom": ndvi_tiles.MAX_ZOOM
+        }
+    }
+
 def _get_mock_map():
     """
     Fallback mock data.
@@ -208,10 +311,26 @@ def _get_mock_map():
 def get_crop_recommendation(location, weather, language='en'):
     """
     Generates crop recommendations based on location and weather using Gemini.
+    `location` is a geocoding.ResolvedLocation (or a plain place name).
     Supports Hybrid Translation (Native Explanation + English Technical Terms).
+    Responses are cached per (rounded location, month, language): the best crop follows the season,
+    so live weather readings stay out of the key. Concurrent identical requests share one call.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+    cache_key = llm_cache.signature(
+        "get_crop_recommendation",
+        location=llm_cache.round_location(
+            location.coords if isinstance(location, geocoding.ResolvedLocation) else location
+        ),
+        month=datetime.date.today().month,
+        language=language
+    )
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return single_flight.do(cache_key, lambda: _generate_crop_recommendation(location, weather, language, cache_key))
+
+def _generate_crop_recommendation(location, weather, language, cache_key):
+    if not llm_client.is_configured():
         return {
             "season": "Unknown",
             "soil": "Unknown",
@@ -219,20 +338,12 @@ def get_crop_recommendation(location, weather, language='en'):
         }
 
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Language Mapping
-        lang_map = {
-            'hi': 'Hindi (हिंदी)',
-            'kn': 'Kannada (ಕನ್ನಡ)',
-            'en': 'English'
-        }
-        target_lang = lang_map.get(language, 'English')
+        target_lang = LANGUAGES.get(language, 'English')
 
+        location_text = location.describe() if isinstance(location, geocoding.ResolvedLocation) else location
         prompt = f"""
         You are an expert Indian Agronomist.
-        Location: {location}
+        Location: {location_text}
         Current Weather: {weather}
         User Language: {target_lang}
 
@@ -256,20 +367,13 @@ def get_crop_recommendation(location, weather, language='en'):
         Do not use Markdown formatting.
         """
         
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        
-        # Clean up potential markdown code blocks
-        if text.startswith("```json"):
-            text = text[7:-3]
-        elif text.startswith("```"):
-            text = text[3:-3]
-            
-        import json
-        return json.loads(text)
+        text = llm_client.generate(prompt)
+        result = llm_client.parse_json(text)
+        llm_cache.put(cache_key, result)
+        return result
         
     except Exception as e:
-        with open("debug_log.txt", "a") as f:
+        with open(DEBUG_LOG_PATH, "a") as f:
             f.write(f"Gemini Scout Error: {e}\n")
         print(f"Gemini Scout Error: {e}")
         return {
@@ -286,12 +390,7 @@ DISTRICT_DIRECTORY = {
         "officer": "Dr. Suresh Patil (Davanagere DAO)",
         "office": "District Administrative Complex, PB Road"
     },
-    "Shivamogga": { # Note: OpenStreetMap might return "Shimoga" or "Shivamogga"
-        "phone": "08182-223344",
-        "officer": "Smt. Lakshmi Hegde",
-        "office": "KVK Shimoga, Sogane"
-    },
-    "Shimoga": { # Handling alternate spelling
+    "Shivamogga": { # Alternate spellings ("Shimoga") resolve via district_index.DISTRICT_ALIASES
         "phone": "08182-223344",
         "officer": "Smt. Lakshmi Hegde",
         "office": "KVK Shimoga, Sogane"
@@ -300,11 +399,6 @@ DISTRICT_DIRECTORY = {
         "phone": "080-22212221",
         "officer": "Directorate of Agriculture",
         "office": "Seshadri Road, Bangalore"
-    },
-    "Bangalore Urban": {
-        "phone": "080-22212221",
-        "officer": "Directorate of Agriculture",
-        "office": "Seshadri Road, Bangalore"
     }
 }
 
@@ -314,26 +408,19 @@ DEFAULT_CONTACT = {
     "office": "Toll-Free Helpline"
 }
 
-def get_govt_contacts(lat, lon):
+def get_govt_contacts(location, lon=None):
     """
-    1. Takes Lat/Lon.
-    2. Asks OpenStreetMap: "What district is this?"
+    1. Takes a geocoding.ResolvedLocation (or Lat + Lon).
+    2. Finds its district: local boundary index (offline) first, then the cached OpenStreetMap reverse geocoder.
     3. Returns the specific phone number for that district.
     """
     try:
         # --- A. Reverse Geocoding (Finding the District) ---
-        # We use OpenStreetMap's free API
-        url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}"
-        
-        # IMPORTANT: OpenStreetMap requires a User-Agent header, or they block you.
-        headers = {'User-Agent': 'OpenAgri-Hackathon-App/1.0'}
-        
-        response = requests.get(url, headers=headers).json()
-        
-        # Extract district from the address object
-        address = response.get('address', {})
-        # Different maps call it 'state_district', 'district', or 'county'
-        district = address.get('state_district') or address.get('district') or address.get('county') or "Unknown"
+        if not isinstance(location, geocoding.ResolvedLocation):
+            location = geocoding.ResolvedLocation(None, location, lon)
+        district = location.district
+        if district is None:
+            raise LookupError("Reverse geocoding returned no result")
 
         print(f"📍 Detected District: {district}") # Print to console for your demo!
 
@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+
+# --- Configuration ---
+# District boundaries as GeoJSON (e.g. the DataMeet / Survey of India district layer).
+# Without this file, district lookups fall back to online reverse geocoding.
+BOUNDARIES_PATH = os.getenv(
+    "DISTRICT_BOUNDARIES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "district_boundaries.geojson")
+)
+# Feature properties tried, in order, for the district name
+NAME_PROPERTIES = ("district", "DISTRICT", "dtname", "NAME_2", "district_name", "name")
+# Grid cell size in degrees (~11 km); cells fully inside one district answer without a polygon test
+GRID_DEG = 0.1
+
+# Alternate spellings (old names, OSM variants) -> the name used in DISTRICT_DIRECTORY
+DISTRICT_ALIASES = {
+    "shimoga": "Shivamogga",
+    "shivamogga": "Shivamogga",
+    "bangalore urban": "Bengaluru Urban",
+    "bengaluru urban": "Bengaluru Urban",
+    "bangalore": "Bengaluru Urban",
+    "bengaluru": "Bengaluru Urban",
+    "bangalore rural": "Bengaluru Rural",
+    "bengaluru rural": "Bengaluru Rural",
+    "davangere": "Davanagere",
+    "davanagere": "Davanagere",
+    "mysore": "Mysuru",
+    "belgaum": "Belagavi",
+    "gulbarga": "Kalaburagi",
+    "bellary": "Ballari",
+    "bijapur": "Vijayapura",
+    "tumkur": "Tumakuru",
+    "chikmagalur": "Chikkamagaluru",
+    "chickmagalur": "Chikkamagaluru",
+    "hassan": "Hassan",
+}
+
+_lock = threading.Lock()
+_index = None
+_load_attempted = False
+_STATS = {"lookups": 0, "grid_hits": 0, "polygon_tests": 0, "misses": 0}
+
+
+def canonical_name(district):
+    """Maps alternate spellings onto one canonical district name (unknown names pass through)."""
+    if not district:
+        return district
+    key = re.sub(r"\s+", " ", re.sub(r"[^a-z ]", " ", district.lower())).strip()
+    key = re.sub(r" (district|dist)$", "", key)
+    return DISTRICT_ALIASES.get(key, district.strip())
+
+
+def _rings(geometry):
+    if geometry["type"] == "Polygon":
+        return geometry["coordinates"]
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    return []
+
+
+def _points_inside(points, edges):
+    """Even-odd ray casting of many (lon, lat) points against [(x1, y1, x2, y2)] edges."""
+    inside = [False] * len(points)
+    for x1, y1, x2, y2 in edges:
+        for i, (x, y) in enumerate(points):
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside[i] = not inside[i]
+    return inside
+
+
+class DistrictIndex:
+    """
+    Uniform grid over district polygons.
+    Interior cells map straight to a district; boundary cells keep candidate districts,
+    which are resolved by ray casting against only the edges in that cell's latitude row.
+    """
+
+    def __init__(self, features):
+        self.names = []
+        self.bboxes = []
+        self.row_edges = {}     # (district id, row) -> [(x1, y1, x2, y2)]
+        self.interior = {}      # (row, col) -> district id
+        self.candidates = {}    # (row, col) -> [district ids]
+
+        for feature in features:
+            props = feature.get("properties") or {}
+            name = next((props[k] for k in NAME_PROPERTIES if props.get(k)), None)
+            rings = _rings(feature.get("geometry") or {"type": None})
+            if not name or not rings:
+                continue
+            self._add(canonical_name(str(name)), rings)
+
+    def _cell(self, lon, lat):
+        return math.floor(lat / GRID_DEG), math.floor(lon / GRID_DEG)
+
+    def _add(self, name, rings):
+        did = len(self.names)
+        self.names.append(name)
+        edges = [
+            (ring[i][0], ring[i][1], ring[i + 1][0], ring[i + 1][1])
+            for ring in rings for i in range(len(ring) - 1)
+            if ring[i][1] != ring[i + 1][1]
+        ]
+        xs = [p[0] for ring in rings for p in ring]
+        ys = [p[1] for ring in rings for p in ring]
+        self.bboxes.append((min(xs), min(ys), max(xs), max(ys)))
+
+        # Edges per latitude row, and the cells their bounding boxes touch
+        boundary = set()
+        for edge in edges:
+            x1, y1, x2, y2 = edge
+            row0, col0 = self._cell(min(x1, x2), min(y1, y2))
+            row1, col1 = self._cell(max(x1, x2), max(y1, y2))
+            for row in range(row0, row1 + 1):
+                self.row_edges.setdefault((did, row), []).append(edge)
+                for col in range(col0, col1 + 1):
+                    boundary.add((row, col))
+        # Horizontal edges never flip the ray parity but still mark boundary cells
+        for ring in rings:
+            for i in range(len(ring) - 1):
+                if ring[i][1] == ring[i + 1][1]:
+                    row, col0 = self._cell(min(ring[i][0], ring[i + 1][0]), ring[i][1])
+                    col1 = self._cell(max(ring[i][0], ring[i + 1][0]), ring[i][1])[1]
+                    boundary.update((row, col) for col in range(col0, col1 + 1))
+
+        for cell in boundary:
+            self.candidates.setdefault(cell, []).append(did)
+
+        # Cells no edge touches are entirely inside or outside; test their centers once per row
+        row0, col0 = self._cell(self.bboxes[did][0], self.bboxes[did][1])
+        row1, col1 = self._cell(self.bboxes[did][2], self.bboxes[did][3])
+        for row in range(row0, row1 + 1):
+            cells = [(row, col) for col in range(col0, col1 + 1) if (row, col) not in boundary]
+            if not cells:
+                continue
+            centers = [((col + 0.5) * GRID_DEG, (row + 0.5) * GRID_DEG) for _, col in cells]
+            for cell, inside in zip(cells, _points_inside(centers, self.row_edges.get((did, row), []))):
+                if inside:
+                    self.interior[cell] = did
+
+    def lookup(self, lat, lon):
+        """District name containing the point, or None."""
+        cell = self._cell(lon, lat)
+        did = self.interior.get(cell)
+        if did is not None:
+            with _lock:
+                _STATS["grid_hits"] += 1
+            return self.names[did]
+
+        for did in self.candidates.get(cell, ()):
+            min_x, min_y, max_x, max_y = self.bboxes[did]
+            if not (min_x <= lon <= max_x and min_y <= lat <= max_y):
+                continue
+            with _lock:
+                _STATS["polygon_tests"] += 1
+            if _points_inside([(lon, lat)], self.row_edges.get((did, cell[0]), []))[0]:
+                return self.names[did]
+        return None
+
+
+def get_index():
+    """Loads the boundary file once per process. None when it is missing or unreadable."""
+    global _index, _load_attempted
+    if _load_attempted:
+        return _index
+    with _lock:
+        if _load_attempted:
+            return _index
+        _load_attempted = True
+        if not os.path.exists(BOUNDARIES_PATH):
+            print(f"District boundaries not found at {BOUNDARIES_PATH}; using online reverse geocoding.")
+            return None
+        try:
+            start = time.perf_counter()
+            with open(BOUNDARIES_PATH, encoding="utf-8") as f:
+                features = json.load(f).get("features", [])
+            _index = DistrictIndex(features)
+            print(f"District index: {len(_index.names)} districts, {len(_index.interior)} interior cells "
+                  f"in {time.perf_counter() - start:.1f}s")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"District boundaries unreadable: {e}")
+            _index = None
+    return _index
+
+
+def lookup(lat, lon):
+    """
+    Offline district lookup for a point. Returns the canonical district name,
+    or None when the point is outside every polygon or no boundary file is installed.
+    """
+    index = get_index()
+    if index is None:
+        return None
+    name = index.lookup(float(lat), float(lon))
+    with _lock:
+        _STATS["lookups"] += 1
+        if name is None:
+            _STATS["misses"] += 1
+    return name
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+    stats["loaded"] = _index is not None
+    stats["districts"] = len(_index.names) if _index is not None else 0
+    stats["path"] = BOUNDARIES_PATH
+    return stats
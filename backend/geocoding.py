@@ -0,0 +1,344 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+try:
+    from backend import single_flight, district_index
+except ImportError:
+    import single_flight
+    import district_index
+
+# --- Configuration ---
+CACHE_DB_PATH = os.getenv(
+    "GEOCODE_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "geocode_cache.db")
+)
+USER_AGENT = "open_agri_os_geocoder/1.0"
+# Villages and districts do not move; misses are retried sooner in case the name gets mapped
+FOUND_TTL_S = float(os.getenv("GEOCODE_TTL_S", str(30 * 24 * 3600)))
+NOT_FOUND_TTL_S = float(os.getenv("GEOCODE_NEGATIVE_TTL_S", str(24 * 3600)))
+# Nominatim usage policy: at most one request per second, for all worker processes together
+# (slots are reserved in the cache database)
+MIN_INTERVAL_S = 1.0
+# A caller gives up instead of queueing longer than this behind the throttle
+MAX_THROTTLE_WAIT_S = float(os.getenv("GEOCODE_MAX_WAIT_S", "5"))
+REQUEST_TIMEOUT_S = 10
+# Reverse lookups are shared by every point in the same geohash cell (7 chars ~ 150 m)
+GEOHASH_PRECISION = 7
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+_local = threading.local()
+_lock = threading.Lock()
+_initialized = False
+_next_request_at = 0.0
+_geolocator = None
+_STATS = {
+    "hits": 0, "negative_hits": 0, "misses": 0,
+    "requests": 0, "throttle_waits": 0, "throttle_rejected": 0, "errors": 0,
+}
+
+
+class GeocoderBusy(Exception):
+    """The Nominatim throttle is backed up; the lookup was not attempted (retry later)."""
+
+
+def _count(key):
+    with _lock:
+        _STATS[key] += 1
+
+
+def _connect():
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(CACHE_DB_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    if not _initialized:
+        conn.execute("CREATE TABLE IF NOT EXISTS geocodes (key TEXT PRIMARY KEY, value TEXT, expires REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS throttle (name TEXT PRIMARY KEY, next_at REAL NOT NULL)")
+        conn.commit()
+        _initialized = True
+    return conn
+
+
+# --- Keys ---
+def normalize_place(name):
+    """Case, punctuation and whitespace insensitive; keeps non-Latin scripts (ದಾವಣಗೆರೆ, दावणगेरे)."""
+    return re.sub(r"[\W_]+", " ", str(name or "").lower()).strip()
+
+
+def geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_center(code):
+    """Center (lat, lon) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in code:
+        bits = _GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if bits >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+# --- Cache ---
+_MISSING = object()
+
+
+def _cache_get(key):
+    """Returns the cached value (None for a cached miss) or _MISSING."""
+    try:
+        row = _connect().execute("SELECT value, expires FROM geocodes WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Geocode cache read error: {e}")
+        return _MISSING
+    if row is None or row[1] <= time.time():
+        return _MISSING
+    return json.loads(row[0]) if row[0] is not None else None
+
+
+def _cache_put(key, value):
+    ttl = FOUND_TTL_S if value is not None else NOT_FOUND_TTL_S
+    try:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO geocodes (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False) if value is not None else None, time.time() + ttl)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Geocode cache write error: {e}")
+
+
+# --- Nominatim ---
+def _reserve_slot(now):
+    """
+    Next free slot (epoch seconds) shared by every worker process through the cache database,
+    or None if it is more than MAX_THROTTLE_WAIT_S away.
+    """
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT next_at FROM throttle WHERE name = 'nominatim'").fetchone()
+        slot = max(now, row[0] if row else 0.0)
+        if slot - now > MAX_THROTTLE_WAIT_S:
+            conn.rollback()
+            return None
+        conn.execute("INSERT OR REPLACE INTO throttle (name, next_at) VALUES ('nominatim', ?)",
+                     (slot + MIN_INTERVAL_S,))
+        conn.commit()
+        return slot
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _throttle():
+    """Reserves the next 1-per-second Nominatim slot. False if the wait would exceed MAX_THROTTLE_WAIT_S."""
+    global _next_request_at
+    now = time.time()
+    try:
+        slot = _reserve_slot(now)
+    except sqlite3.Error as e:
+        # Shared slots unavailable: at least keep this process to the limit
+        print(f"Geocode throttle error: {e}")
+        with _lock:
+            slot = max(now, _next_request_at)
+            if slot - now > MAX_THROTTLE_WAIT_S:
+                slot = None
+            else:
+                _next_request_at = slot + MIN_INTERVAL_S
+    if slot is None:
+        _count("throttle_rejected")
+        return False
+    if slot > now:
+        _count("throttle_waits")
+    time.sleep(slot - now)
+    return True
+
+
+def _get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        from geopy.geocoders import Nominatim
+        _geolocator = Nominatim(user_agent=USER_AGENT, timeout=REQUEST_TIMEOUT_S)
+    return _geolocator
+
+
+def _cached_lookup(key, fetch):
+    """
+    Cache, then one coalesced, throttled Nominatim request.
+    Found results and clean misses are cached; errors and throttling are not.
+    Raises GeocoderBusy when the throttle turns the request away.
+    """
+    cached = _cache_get(key)
+    if cached is not _MISSING:
+        _count("hits" if cached is not None else "negative_hits")
+        return cached
+    _count("misses")
+
+    def load():
+        cached = _cache_get(key)
+        if cached is not _MISSING:
+            return cached
+        if not _throttle():
+            raise GeocoderBusy("Geocoder is busy, try again shortly")
+        _count("requests")
+        try:
+            value = fetch(_get_geolocator())
+        except Exception as e:
+            _count("errors")
+            print(f"Geocoding Error: {e}")
+            return None
+        _cache_put(key, value)
+        return value
+
+    return single_flight.do(key, load)
+
+
+def geocode(place_name):
+    """
+    Forward lookup. Returns {"lat", "lon", "name", "bbox": [south, north, west, east]} or None.
+    """
+    def fetch(geolocator):
+        location = geolocator.geocode(place_name)
+        if location is None:
+            return None
+        bbox = location.raw.get("boundingbox")
+        return {
+            "lat": location.latitude,
+            "lon": location.longitude,
+            "name": location.address,
+            "bbox": [float(v) for v in bbox] if bbox else None,
+        }
+
+    key = "forward:" + normalize_place(place_name)
+    if key == "forward:":
+        return None
+    return _cached_lookup(key, fetch)
+
+
+def reverse(lat, lon):
+    """
+    Reverse lookup, shared by every point in the same geohash cell.
+    Returns {"name", "address": {...}} or None.
+    """
+    cell = geohash(float(lat), float(lon))
+
+    def fetch(geolocator):
+        location = geolocator.reverse(geohash_center(cell), exactly_one=True)
+        if location is None:
+            return None
+        return {"name": location.address, "address": location.raw.get("address", {})}
+
+    return _cached_lookup("reverse:" + cell, fetch)
+
+
+# --- Resolved locations ---
+class ResolvedLocation:
+    """
+    A place resolved once per request (name, lat/lon, bbox) and handed to every downstream stage.
+    District and agro-zone are worked out lazily, only if a stage asks for them.
+    """
+
+    def __init__(self, name, lat, lon, bbox=None):
+        self.name = name
+        self.lat = float(lat)
+        self.lon = float(lon)
+        self.bbox = bbox
+        self._district = None
+        self._district_resolved = False
+        self._zone = None
+
+    @property
+    def coords(self):
+        return (self.lat, self.lon)
+
+    @property
+    def district(self):
+        """Canonical district name: offline boundary index first, then the cached reverse geocoder."""
+        if not self._district_resolved:
+            district = district_index.lookup(self.lat, self.lon)
+            if district is None:
+                response = reverse(self.lat, self.lon)  # may raise GeocoderBusy; retried on next access
+                if response is not None:
+                    # Different maps call it 'state_district', 'district', or 'county'
+                    address = response.get("address", {})
+                    district = district_index.canonical_name(
+                        address.get("state_district") or address.get("district") or address.get("county") or "Unknown"
+                    )
+            self._district = district
+            self._district_resolved = True
+        return self._district
+
+    @property
+    def agro_zone(self):
+        if self._zone is None:
+            try:
+                from backend import crop_logic
+            except ImportError:
+                import crop_logic
+            self._zone = crop_logic.analyze_location(self.lat, self.lon).get("zone")
+        return self._zone
+
+    def describe(self):
+        """Human-readable location for LLM prompts."""
+        return f"{self.name} ({self.lat:.4f}, {self.lon:.4f}), {self.agro_zone} agro-climatic zone"
+
+    def to_dict(self):
+        return {"name": self.name, "lat": self.lat, "lon": self.lon, "bbox": self.bbox, "agro_zone": self.agro_zone}
+
+
+def resolve(place_name=None, lat=None, lon=None):
+    """
+    Builds a ResolvedLocation from coordinates (no network) or from a place name
+    (one cached forward geocode). Returns None when the place cannot be found;
+    raises GeocoderBusy when it could not be looked up right now.
+    """
+    if lat not in (None, "") and lon not in (None, ""):
+        return ResolvedLocation(place_name or "Current Location", lat, lon)
+    if not place_name:
+        return None
+    found = geocode(place_name)
+    if found is None:
+        return None
+    return ResolvedLocation(place_name, found["lat"], found["lon"], found.get("bbox"))
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+    lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] + stats["negative_hits"]) / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+# --- Configuration ---
+CACHE_DB_PATH = os.getenv(
+    "LLM_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "llm_cache.db")
+)
+DEFAULT_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+# LRU bookkeeping granularity: a hit only rewrites last_access if it is older than this
+ACCESS_UPDATE_S = 300
+ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+
+_local = threading.local()
+_lock = threading.Lock()
+_initialized = False
+_writes_since_trim = 0
+_STATS = {"hits": 0, "misses": 0, "stores": 0}
+
+
+def _connect():
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(CACHE_DB_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    if not _initialized:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_access ON llm_responses(last_access)")
+        conn.commit()
+        _initialized = True
+    return conn
+
+
+# --- Prompt signatures ---
+def normalize_text(value):
+    """Lowercases and collapses whitespace/punctuation, so 'Early  Blight ' == 'early blight'."""
+    return re.sub(r"[^a-z0-9]+", " ", str(value or "").lower()).strip()
+
+
+def bucket_ndvi(ndvi):
+    """
+    Maps an NDVI value or status string onto the same bands as the Sentinel visualizer.
+    """
+    try:
+        value = float(ndvi)
+    except (TypeError, ValueError):
+        text = normalize_text(ndvi)
+        for band in ("healthy", "moderate", "stressed", "bare"):
+            if band in text:
+                return band
+        return text or "unknown"
+
+    if value > 0.6:
+        return "healthy"
+    if value > 0.4:
+        return "moderate"
+    if value > 0.2:
+        return "stressed"
+    return "bare"
+
+
+def round_location(location, digits=2):
+    """Coordinates rounded to ~1 km (2 decimals); place names normalized."""
+    if isinstance(location, (tuple, list)) and len(location) == 2:
+        return [round(float(location[0]), digits), round(float(location[1]), digits)]
+    return normalize_text(location)
+
+
+def signature(function, **params):
+    """Stable cache key for an LLM call: function name + normalized inputs."""
+    return function + ":" + json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+
+# --- Cache access ---
+def get(key):
+    """Returns the cached value, or None on a miss / expiry."""
+    if not ENABLED:
+        return None
+    now = time.time()
+    try:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT value, expires, last_access FROM llm_responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row and row[1] > now:
+            if now - row[2] > ACCESS_UPDATE_S:
+                conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+            with _lock:
+                _STATS["hits"] += 1
+            return json.loads(row[0])
+    except sqlite3.Error as e:
+        print(f"LLM cache read error: {e}")
+
+    with _lock:
+        _STATS["misses"] += 1
+    return None
+
+
+def put(key, value, ttl_s=DEFAULT_TTL_S):
+    """Stores a JSON-serializable value. Trims expired / least recently used rows periodically."""
+    global _writes_since_trim
+    if not ENABLED:
+        return
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_responses (key, value, expires, last_access) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now + ttl_s, now)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"LLM cache write error: {e}")
+        return
+
+    with _lock:
+        _STATS["stores"] += 1
+        _writes_since_trim += 1
+        should_trim = _writes_since_trim >= 100
+        if should_trim:
+            _writes_since_trim = 0
+    if should_trim:
+        evict()
+
+
+def evict():
+    """Drops expired rows, then the least recently used beyond MAX_ENTRIES."""
+    try:
+        conn = _connect()
+        conn.execute("DELETE FROM llm_responses WHERE expires <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM llm_responses WHERE key IN ("
+            " SELECT key FROM llm_responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (MAX_ENTRIES,)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"LLM cache eviction error: {e}")
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] / lookups) if lookups else 0.0
+    stats["enabled"] = ENABLED
+    return stats
@@ -0,0 +1,360 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables once for every LLM caller
+load_dotenv()
+
+# --- Configuration ---
+DEFAULT_MODEL = "gemini-1.5-flash"
+# "gemini" (default) or "local": the stand-in server from scripts/llm_stub_server.py
+PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LOCAL_URL = os.getenv("LLM_LOCAL_URL", "http://127.0.0.1:8089")
+# Max concurrent in-flight LLM requests per process
+MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+# How long a caller may wait for a free slot before falling back
+QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "0.5"))
+# Default end-to-end deadline per call, retries included
+DEFAULT_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "20"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+BACKOFF_BASE_S = 0.25
+BACKOFF_MAX_S = 4.0
+# Retry budget: every call earns RETRY_RATIO of a retry, plus RETRY_MIN_PER_S per second
+RETRY_RATIO = float(os.getenv("LLM_RETRY_RATIO", "0.1"))
+RETRY_MIN_PER_S = float(os.getenv("LLM_RETRY_MIN_PER_S", "0.2"))
+RETRY_BUDGET_MAX = 10.0
+# A call is not worth starting with less than this left on its deadline
+MIN_ATTEMPT_S = 1.0
+
+# Transient failures worth retrying (rate limits, overloaded or unreachable backend)
+RETRYABLE_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "ConnectionError", "Timeout", "ReadTimeout",
+}
+
+
+class LLMUnavailable(Exception):
+    """Raised instead of waiting: no key, all slots busy, out of retry budget or past the deadline."""
+
+
+class ProviderError(Exception):
+    """Error reported by a provider; `retryable` marks rate limits and transient server failures."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+# --- Providers ---
+class GeminiProvider:
+    """Google Gemini through google.generativeai, one model handle per model name."""
+
+    name = "gemini"
+
+    def __init__(self):
+        self.configured = False
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def is_configured(self):
+        return bool(os.getenv("GEMINI_API_KEY"))
+
+    def get_model(self, model_name):
+        model = self.models.get(model_name)
+        if model is not None:
+            return model
+
+        import google.generativeai as genai
+        with self.lock:
+            if not self.configured:
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                self.configured = True
+            model = self.models.get(model_name)
+            if model is None:
+                model = self.models[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+    def generate(self, contents, model_name, timeout):
+        response = self.get_model(model_name).generate_content(contents, request_options={"timeout": timeout})
+        return response.text
+
+    def stream(self, contents, model_name, timeout):
+        response = self.get_model(model_name).generate_content(
+            contents, stream=True, request_options={"timeout": timeout}
+        )
+        for chunk in response:
+            yield chunk.text
+
+
+class LocalProvider:
+    """
+    HTTP stand-in (scripts/llm_stub_server.py) returning canned Markdown / JSON with
+    configurable latency and errors, for load tests without a key or network.
+    Images are sent as placeholders; only the text parts reach the server.
+    """
+
+    name = "local"
+
+    def __init__(self, url=LOCAL_URL):
+        import requests
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def is_configured(self):
+        return True
+
+    def _payload(self, contents, model_name, stream):
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        return {
+            "model": model_name,
+            "prompt": "\n".join(p for p in parts if isinstance(p, str)),
+            "images": sum(1 for p in parts if not isinstance(p, str)),
+            "stream": stream,
+        }
+
+    def _post(self, contents, model_name, timeout, stream):
+        response = self.session.post(
+            self.url + "/generate", json=self._payload(contents, model_name, stream),
+            timeout=timeout, stream=stream
+        )
+        if response.status_code != 200:
+            raise ProviderError(
+                f"Local LLM returned HTTP {response.status_code}",
+                retryable=response.status_code in (429, 500, 502, 503, 504)
+            )
+        return response
+
+    def generate(self, contents, model_name, timeout):
+        return self._post(contents, model_name, timeout, stream=False).json()["text"]
+
+    def stream(self, contents, model_name, timeout):
+        response = self._post(contents, model_name, timeout, stream=True)
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if "error" in event:
+                raise ProviderError(event["error"], retryable=True)
+            yield event["text"]
+
+
+_lock = threading.Lock()
+_provider = None
+_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+_in_flight = 0
+_budget = {"tokens": RETRY_BUDGET_MAX, "updated": time.monotonic()}
+_STATS = {
+    "calls": 0, "successes": 0, "failures": 0, "retries": 0,
+    "rejected_busy": 0, "budget_exhausted": 0, "deadline_exceeded": 0,
+}
+# Time to first chunk is sampled only from streams that produced a chunk; the rest are failed_before_first_chunk
+_STREAM_STATS = {"streams": 0, "completed": 0, "failed": 0, "failed_before_first_chunk": 0,
+                 "ttfc_samples": 0, "ttfc_ms_total": 0.0, "duration_ms_total": 0.0,
+                 "last_ttfc_ms": None, "last_duration_ms": None}
+
+
+def get_provider():
+    """The process-wide provider selected by LLM_PROVIDER."""
+    global _provider
+    if _provider is None:
+        with _lock:
+            if _provider is None:
+                _provider = LocalProvider() if PROVIDER == "local" else GeminiProvider()
+    return _provider
+
+
+def is_configured():
+    """True when LLM calls can be attempted (a Gemini key is set, or the local stand-in is selected)."""
+    return get_provider().is_configured()
+
+
+# --- Response parsing ---
+def parse_json(text):
+    """
+    Parses a JSON object from model output, tolerating ```json fences and text around the object.
+    Raises ValueError when there is no JSON object.
+    """
+    text = text.strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        return json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+def _count(key, n=1):
+    with _lock:
+        _STATS[key] += n
+
+
+# --- Retry budget ---
+def _refill_budget(now):
+    elapsed = now - _budget["updated"]
+    _budget["updated"] = now
+    _budget["tokens"] = min(RETRY_BUDGET_MAX, _budget["tokens"] + elapsed * RETRY_MIN_PER_S)
+
+
+def _earn_retry():
+    with _lock:
+        _refill_budget(time.monotonic())
+        _budget["tokens"] = min(RETRY_BUDGET_MAX, _budget["tokens"] + RETRY_RATIO)
+
+
+def _spend_retry():
+    """Takes one retry from the process-wide budget. False when retries are currently exhausted."""
+    with _lock:
+        _refill_budget(time.monotonic())
+        if _budget["tokens"] < 1.0:
+            _STATS["budget_exhausted"] += 1
+            return False
+        _budget["tokens"] -= 1.0
+        _STATS["retries"] += 1
+        return True
+
+
+def _is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, ProviderError):
+        return error.retryable
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+def _backoff(attempt):
+    """Full jitter: uniform in [0, base * 2^attempt], capped."""
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)))
+
+
+# --- Calls ---
+def generate(contents, model_name=DEFAULT_MODEL, deadline_s=None, max_retries=MAX_RETRIES):
+    """
+    Runs a completion through the configured provider and returns the response text.
+    `contents` is a prompt string or a list of parts (e.g. [prompt, PIL image]).
+    Raises LLMUnavailable when the caller should serve its fallback right away;
+    other errors (bad key, blocked prompt) propagate unchanged.
+    """
+    provider = get_provider()
+    if not provider.is_configured():
+        raise LLMUnavailable("GEMINI_API_KEY is not set")
+
+    deadline = time.monotonic() + (deadline_s or DEFAULT_DEADLINE_S)
+    _count("calls")
+    _earn_retry()
+
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT_S):
+        _count("rejected_busy")
+        raise LLMUnavailable(f"{MAX_IN_FLIGHT} LLM requests already in flight")
+
+    global _in_flight
+    with _lock:
+        _in_flight += 1
+    try:
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining < MIN_ATTEMPT_S:
+                _count("deadline_exceeded")
+                raise LLMUnavailable("LLM deadline exceeded")
+            try:
+                text = provider.generate(contents, model_name, remaining).strip()
+                _count("successes")
+                return text
+            except Exception as e:
+                if not _is_retryable(e):
+                    _count("failures")
+                    raise
+                pause = _backoff(attempt)
+                if attempt >= max_retries or time.monotonic() + pause > deadline - MIN_ATTEMPT_S or not _spend_retry():
+                    _count("failures")
+                    raise LLMUnavailable(f"LLM call failed: {e}") from e
+                print(f"LLM retry {attempt + 1} after {type(e).__name__}, sleeping {pause:.2f}s")
+                attempt += 1
+                time.sleep(pause)
+    finally:
+        with _lock:
+            _in_flight -= 1
+        _slots.release()
+
+
+def generate_stream(contents, model_name=DEFAULT_MODEL, deadline_s=None):
+    """
+    Streaming variant of generate(): yields text chunks as the model produces them.
+    Holds an in-flight slot until the stream ends. There are no retries (chunks may already be
+    on the wire), so callers handle a mid-stream failure themselves.
+    Records time-to-first-chunk and total duration.
+    """
+    global _in_flight
+    provider = get_provider()
+    if not provider.is_configured():
+        raise LLMUnavailable("GEMINI_API_KEY is not set")
+
+    start = time.monotonic()
+    deadline = start + (deadline_s or DEFAULT_DEADLINE_S)
+    _count("calls")
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT_S):
+        _count("rejected_busy")
+        raise LLMUnavailable(f"{MAX_IN_FLIGHT} LLM requests already in flight")
+
+    with _lock:
+        _in_flight += 1
+        _STREAM_STATS["streams"] += 1
+    first_chunk_at = None
+    completed = False
+    try:
+        for text in provider.stream(contents, model_name, deadline - time.monotonic()):
+            if time.monotonic() > deadline:
+                _count("deadline_exceeded")
+                raise LLMUnavailable("LLM deadline exceeded mid-stream")
+            if not text:
+                continue
+            if first_chunk_at is None:
+                first_chunk_at = time.monotonic()
+            yield text
+        completed = True
+        _count("successes")
+    finally:
+        now = time.monotonic()
+        with _lock:
+            _in_flight -= 1
+            if not completed:
+                _STATS["failures"] += 1
+            _STREAM_STATS["completed" if completed else "failed"] += 1
+            if first_chunk_at is not None:
+                ttfc_ms = (first_chunk_at - start) * 1000
+                _STREAM_STATS["ttfc_samples"] += 1
+                _STREAM_STATS["ttfc_ms_total"] += ttfc_ms
+                _STREAM_STATS["last_ttfc_ms"] = round(ttfc_ms, 1)
+            elif not completed:
+                _STREAM_STATS["failed_before_first_chunk"] += 1
+            if completed:
+                duration_ms = (now - start) * 1000
+                _STREAM_STATS["duration_ms_total"] += duration_ms
+                _STREAM_STATS["last_duration_ms"] = round(duration_ms, 1)
+        _slots.release()
+
+
+def get_stats():
+    with _lock:
+        _refill_budget(time.monotonic())
+        stats = dict(_STATS)
+        stats["in_flight"] = _in_flight
+        stats["retry_budget"] = round(_budget["tokens"], 2)
+        streaming = dict(_STREAM_STATS)
+    stats["max_in_flight"] = MAX_IN_FLIGHT
+    stats["provider"] = get_provider().name
+
+    ttfc_total = streaming.pop("ttfc_ms_total")
+    duration_total = streaming.pop("duration_ms_total")
+    streaming["mean_ttfc_ms"] = ttfc_total / streaming["ttfc_samples"] if streaming["ttfc_samples"] else 0.0
+    streaming["mean_duration_ms"] = duration_total / streaming["completed"] if streaming["completed"] else 0.0
+    stats["streaming"] = streaming
+    return stats
@@ -0,0 +1,446 @@
+import os
+import json
+import glob
+import time
+import struct
+import datetime
+import threading
+
+import numpy as np
+
+try:
+    from backend import tile_cache, ndvi_stats
+except ImportError:
+    import tile_cache
+    import ndvi_stats
+
+# --- Configuration ---
+# Archive of Sentinel-2 scenes, one directory per scene with a scene.json, e.g.
+#   {"id": "T43PGQ_20261001", "date": "2026-10-01", "cloud_cover": 3.2, "crs": "EPSG:32643",
+#    "transform": [600000, 10, 1700040, 10], "scale": 0.0001, "offset": -0.1,
+#    "bands": {"B04": "B04.npy", "B08": "B08.tif", "SCL": "SCL.tif"}}
+# Bands are .npy arrays (memory-mapped) or uncompressed, stripped single-band GeoTIFFs.
+# "transform" is [top-left x, pixel width, top-left y, pixel height]; GeoTIFF tags take precedence.
+RASTER_DIR = os.getenv(
+    "LOCAL_RASTER_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "rasters")
+)
+# "auto": the local archive when it covers the field, else Sentinel Hub.
+# "local": never leave the machine (test rigs). "sentinel": always Sentinel Hub.
+MODE = os.getenv("SATELLITE_SOURCE", "auto")
+# Output grids are projected exactly every GRID_STEP pixels and interpolated in between
+# (like GDAL's approximate transformer); over a 2 km field the error is far below a pixel
+GRID_STEP = 16
+
+_lock = threading.Lock()
+_scenes = None
+_STATS = {"requests": 0, "served": 0, "not_covered": 0, "pixels_read": 0, "read_ms": 0.0}
+
+
+# --- Projections (WGS84 / Web Mercator / UTM), vectorized ---
+_A = 6378137.0
+_F = 1 / 298.257223563
+_E2 = _F * (2 - _F)
+_EP2 = _E2 / (1 - _E2)
+_K0 = 0.9996
+
+
+def _epsg(crs):
+    """4326 from "EPSG:4326", "http://www.opengis.net/def/crs/EPSG/0/4326" or 4326."""
+    return int(str(crs).replace(":", "/").rstrip("/").split("/")[-1])
+
+
+def _mercator_to_lonlat(x, y):
+    lon = np.degrees(x / _A)
+    lat = np.degrees(2 * np.arctan(np.exp(y / _A)) - np.pi / 2)
+    return lon, lat
+
+
+def _lonlat_to_mercator(lon, lat):
+    return _A * np.radians(lon), _A * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _lonlat_to_utm(lon, lat, zone, south):
+    phi = np.radians(lat)
+    sin, cos, tan = np.sin(phi), np.cos(phi), np.tan(phi)
+    n = _A / np.sqrt(1 - _E2 * sin ** 2)
+    t = tan ** 2
+    c = _EP2 * cos ** 2
+    a = cos * np.radians(lon - (zone * 6 - 183))
+    e4, e6 = _E2 ** 2, _E2 ** 3
+    m = _A * ((1 - _E2 / 4 - 3 * e4 / 64 - 5 * e6 / 256) * phi
+              - (3 * _E2 / 8 + 3 * e4 / 32 + 45 * e6 / 1024) * np.sin(2 * phi)
+              + (15 * e4 / 256 + 45 * e6 / 1024) * np.sin(4 * phi)
+              - (35 * e6 / 3072) * np.sin(6 * phi))
+    x = _K0 * n * (a + (1 - t + c) * a ** 3 / 6 + (5 - 18 * t + t ** 2 + 72 * c - 58 * _EP2) * a ** 5 / 120) + 500000
+    y = _K0 * (m + n * tan * (a ** 2 / 2 + (5 - t + 9 * c + 4 * c ** 2) * a ** 4 / 24
+                              + (61 - 58 * t + t ** 2 + 600 * c - 330 * _EP2) * a ** 6 / 720))
+    return x, y + (10000000 if south else 0)
+
+
+def to_lonlat(x, y, epsg):
+    if epsg == 4326:
+        return x, y
+    if epsg == 3857:
+        return _mercator_to_lonlat(x, y)
+    raise ValueError(f"Unsupported request CRS EPSG:{epsg}")
+
+
+def from_lonlat(lon, lat, epsg):
+    if epsg == 4326:
+        return lon, lat
+    if epsg == 3857:
+        return _lonlat_to_mercator(lon, lat)
+    if 32601 <= epsg <= 32660 or 32701 <= epsg <= 32760:
+        return _lonlat_to_utm(lon, lat, epsg % 100, epsg > 32700)
+    raise ValueError(f"Unsupported raster CRS EPSG:{epsg}")
+
+
+def _interp_index(n, knots):
+    """Left knot index and weight for each of n positions between sorted knot positions."""
+    positions = np.arange(n)
+    i = np.clip(np.searchsorted(knots, positions, side="right") - 1, 0, len(knots) - 2)
+    return i, (positions - knots[i]) / (knots[i + 1] - knots[i])
+
+
+def project_grid(xs, ys, src_epsg, dst_epsg, step=GRID_STEP):
+    """Projects the grid of points xs by ys (rows = ys) from src_epsg to dst_epsg."""
+    cols = np.unique(np.r_[np.arange(0, len(xs), step), len(xs) - 1])
+    rows = np.unique(np.r_[np.arange(0, len(ys), step), len(ys) - 1])
+    if len(cols) < 2 or len(rows) < 2:
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        return from_lonlat(*to_lonlat(grid_x, grid_y, src_epsg), dst_epsg)
+    knot_x, knot_y = np.meshgrid(xs[cols], ys[rows])
+    knot_x, knot_y = from_lonlat(*to_lonlat(knot_x, knot_y, src_epsg), dst_epsg)
+    ri, rw = _interp_index(len(ys), rows)
+    ci, cw = _interp_index(len(xs), cols)
+    rw, cw = rw[:, None], cw[None, :]
+
+    def bilinear(knots):
+        # Along the knot rows first (cheap), then down the columns
+        across = knots[:, ci] * (1 - cw) + knots[:, ci + 1] * cw
+        return across[ri] * (1 - rw) + across[ri + 1] * rw
+
+    return bilinear(knot_x), bilinear(knot_y)
+
+
+# --- GeoTIFF strips ---
+_TIFF_TYPES = {1: "B", 2: "c", 3: "H", 4: "I", 11: "f", 12: "d", 16: "Q"}
+_SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}
+
+
+class StripTiff:
+    """
+    Uncompressed, single-band, stripped (Geo)TIFF read through a memory map.
+    Only the rows and columns of a window are touched.
+    """
+
+    def __init__(self, path):
+        self.memmap = np.memmap(path, dtype=np.uint8, mode="r")
+        order = bytes(self.memmap[:2])
+        if order not in (b"II", b"MM"):
+            raise ValueError(f"{path}: not a TIFF")
+        self.endian = "<" if order == b"II" else ">"
+        magic, ifd = struct.unpack(self.endian + "HI", bytes(self.memmap[2:8]))
+        if magic != 42:
+            raise ValueError(f"{path}: BigTIFF is not supported")
+        tags = self._read_ifd(ifd)
+
+        if tags.get(259, (1,))[0] != 1 or tags.get(277, (1,))[0] != 1 or 322 in tags:
+            raise ValueError(f"{path}: only uncompressed, single-band, stripped TIFFs are supported")
+        self.width, self.height = tags[256][0], tags[257][0]
+        bits = tags[258][0]
+        kind = _SAMPLE_KINDS[tags.get(339, (1,))[0]]
+        self.dtype = np.dtype(f"{self.endian}{kind}{bits // 8}")
+        self.rows_per_strip = tags.get(278, (self.height,))[0]
+        self.strip_offsets = tags[273]
+        self.shape = (self.height, self.width)
+
+        self.transform = None
+        if 33922 in tags and 33550 in tags:
+            i, j, _, x, y, _ = tags[33922][:6]
+            scale_x, scale_y = tags[33550][:2]
+            self.transform = [x - i * scale_x, scale_x, y + j * scale_y, scale_y]
+        self.epsg = None
+        keys = tags.get(34735, ())
+        for k in range(4, len(keys), 4):
+            if keys[k] in (3072, 2048) and keys[k + 1] == 0:
+                self.epsg = keys[k + 3]
+
+    def _read_ifd(self, offset):
+        mm, endian = self.memmap, self.endian
+        (count,) = struct.unpack(endian + "H", bytes(mm[offset:offset + 2]))
+        tags = {}
+        for n in range(count):
+            entry = offset + 2 + 12 * n
+            tag, kind, values = struct.unpack(endian + "HHI", bytes(mm[entry:entry + 8]))
+            if kind not in _TIFF_TYPES:
+                continue
+            size = struct.calcsize(_TIFF_TYPES[kind]) * values
+            start = entry + 8 if size <= 4 else struct.unpack(endian + "I", bytes(mm[entry + 8:entry + 12]))[0]
+            if kind == 2:
+                tags[tag] = bytes(mm[start:start + size])
+            else:
+                tags[tag] = struct.unpack(f"{endian}{values}{_TIFF_TYPES[kind]}", bytes(mm[start:start + size]))
+        return tags
+
+    def window(self, row0, row1, col0, col1):
+        out = np.empty((row1 - row0, col1 - col0), dtype=self.dtype)
+        row_bytes = self.width * self.dtype.itemsize
+        for strip in range(row0 // self.rows_per_strip, (row1 - 1) // self.rows_per_strip + 1):
+            first = strip * self.rows_per_strip
+            rows = min(self.rows_per_strip, self.height - first)
+            start = self.strip_offsets[strip]
+            data = self.memmap[start:start + rows * row_bytes].view(self.dtype).reshape(rows, self.width)
+            top, bottom = max(row0, first), min(row1, first + rows)
+            out[top - row0:bottom - row0] = data[top - first:bottom - first, col0:col1]
+        return out
+
+
+def write_strip_tiff(path, array, transform, epsg, rows_per_strip=16):
+    """Writes a 2-D array as an uncompressed, stripped GeoTIFF that StripTiff (and GDAL) can read."""
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.newbyteorder("<")
+    height, width = array.shape
+    kind = {"u": 1, "i": 2, "f": 3}[dtype.kind]
+    strips = range(0, height, rows_per_strip)
+    row_bytes = width * dtype.itemsize
+    x0, scale_x, y0, scale_y = transform
+    geographic = epsg == 4326
+    # GeoKeyDirectory: model type (projected / geographic), pixel-is-area, then the EPSG code
+    geokeys = [1, 1, 0, 3,
+               1024, 0, 1, 2 if geographic else 1,
+               1025, 0, 1, 1,
+               2048 if geographic else 3072, 0, 1, epsg]
+
+    # Header, then pixel data, then the arrays the IFD points to, then the IFD
+    data_offset = 8
+    offsets = [data_offset + start * row_bytes for start in strips]
+    counts = [min(rows_per_strip, height - start) * row_bytes for start in strips]
+    padding = (height * row_bytes) % 2
+    extra = data_offset + height * row_bytes + padding
+    blobs = []
+
+    def blob(fmt, values):
+        nonlocal extra
+        data = struct.pack(f"<{len(values)}{fmt}", *values)
+        position = extra
+        blobs.append(data + b"\0" * (len(data) % 2))
+        extra += len(blobs[-1])
+        return position
+
+    entries = []
+
+    def tag(code, kind, values):
+        fmt = _TIFF_TYPES[kind]
+        if struct.calcsize(fmt) * len(values) <= 4:
+            packed = struct.pack(f"<{len(values)}{fmt}", *values).ljust(4, b"\0")
+        else:
+            packed = struct.pack("<I", blob(fmt, values))
+        entries.append(struct.pack("<HHI", code, kind, len(values)) + packed)
+
+    tag(256, 4, [width])
+    tag(257, 4, [height])
+    tag(258, 3, [dtype.itemsize * 8])
+    tag(259, 3, [1])
+    tag(262, 3, [1])
+    tag(273, 4, offsets)
+    tag(277, 3, [1])
+    tag(278, 4, [rows_per_strip])
+    tag(279, 4, counts)
+    tag(339, 3, [kind])
+    tag(33550, 12, [scale_x, scale_y, 0.0])
+    tag(33922, 12, [0.0, 0.0, 0.0, x0, y0, 0.0])
+    tag(34735, 3, geokeys)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<2sHI", b"II", 42, extra))
+        f.write(array.astype(dtype, copy=False).tobytes() + b"\0" * padding)
+        for data in blobs:
+            f.write(data)
+        f.write(struct.pack("<H", len(entries)) + b"".join(entries) + struct.pack("<I", 0))
+
+
+# --- Scenes ---
+class _NpyBand:
+    def __init__(self, path):
+        self.array = np.load(path, mmap_mode="r")
+        self.shape = self.array.shape
+        self.transform = None
+        self.epsg = None
+
+    def window(self, row0, row1, col0, col1):
+        return np.asarray(self.array[row0:row1, col0:col1])
+
+
+class Scene:
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.id = str(meta.get("id") or os.path.basename(directory))
+        self.date = datetime.date.fromisoformat(meta["date"])
+        self.cloud_cover = float(meta.get("cloud_cover", 0.0))
+        self.epsg = _epsg(meta.get("crs", 4326))
+        self.transform = meta.get("transform")
+        self.transforms = meta.get("transforms", {})
+        self.scale = float(meta.get("scale", 1.0))
+        self.offset = float(meta.get("offset", 0.0))
+        self.band_files = meta["bands"]
+        self._bands = {}
+        self.bounds = self._bounds(self.band("B04"))
+
+    def band(self, name):
+        band = self._bands.get(name)
+        if band is None:
+            path = os.path.join(self.directory, self.band_files[name])
+            band = _NpyBand(path) if path.endswith(".npy") else StripTiff(path)
+            if band.transform is None:
+                band.transform = self.transforms.get(name, self.transform)
+            if band.transform is None:
+                raise ValueError(f"Scene {self.id}: no georeference for {name}")
+            self._bands[name] = band
+        return band
+
+    def _bounds(self, band):
+        x0, scale_x, y0, scale_y = band.transform
+        return x0, y0 - band.shape[0] * scale_y, x0 + band.shape[1] * scale_x, y0
+
+    def covers(self, lon, lat):
+        x, y = from_lonlat(np.float64(lon), np.float64(lat), self.epsg)
+        min_x, min_y, max_x, max_y = self.bounds
+        return min_x <= x < max_x and min_y <= y < max_y
+
+    @staticmethod
+    def _pixel_index(band, x, y):
+        x0, scale_x, y0, scale_y = band.transform
+        cols = np.floor((x - x0) / scale_x).astype(np.int64)
+        rows = np.floor((y0 - y) / scale_y).astype(np.int64)
+        inside = (rows >= 0) & (rows < band.shape[0]) & (cols >= 0) & (cols < band.shape[1])
+        # Clamped rather than masked: plain integer gathers, then zero what lies outside
+        np.clip(rows, 0, band.shape[0] - 1, out=rows)
+        np.clip(cols, 0, band.shape[1] - 1, out=cols)
+        return rows, cols, inside
+
+    def sample(self, name, x, y, indexes=None):
+        """
+        Nearest-neighbour values of a band at scene-CRS points, reading only their bounding window.
+        `indexes` (a dict) shares the pixel lookup between bands on the same grid.
+        """
+        band = self.band(name)
+        grid = (tuple(band.transform), band.shape)
+        if indexes is None or grid not in indexes:
+            index = self._pixel_index(band, x, y)
+            if indexes is not None:
+                indexes[grid] = index
+        else:
+            index = indexes[grid]
+        rows, cols, inside = index
+        if not inside.any():
+            return np.zeros(x.shape, dtype=np.float32), inside
+        row0, row1 = int(rows.min()), int(rows.max()) + 1
+        col0, col1 = int(cols.min()), int(cols.max()) + 1
+        block = band.window(row0, row1, col0, col1)
+        out = block[rows - row0, cols - col0].astype(np.float32)
+        out[~inside] = 0
+        with _lock:
+            _STATS["pixels_read"] += block.size
+        return out, inside
+
+
+def get_scenes():
+    """Scenes in RASTER_DIR, scanned once per process (empty without an archive)."""
+    global _scenes
+    if _scenes is not None:
+        return _scenes
+    with _lock:
+        if _scenes is not None:
+            return _scenes
+        scenes = []
+        for path in sorted(glob.glob(os.path.join(RASTER_DIR, "**", "scene.json"), recursive=True)):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    scenes.append(Scene(os.path.dirname(path), json.load(f)))
+            except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+                print(f"Skipping raster scene {path}: {e}")
+        if scenes:
+            print(f"Local raster archive: {len(scenes)} scenes in {RASTER_DIR}")
+        _scenes = scenes
+    return _scenes
+
+
+def select_scene(bbox, window, crs=ndvi_stats.CRS_WGS84):
+    """
+    Scene covering the bbox center: least cloudy (then newest) inside the window,
+    like the live mosaickingOrder "leastCC"; else the newest one on record.
+    """
+    center_lon, center_lat = to_lonlat((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2, _epsg(crs))
+    covering = [s for s in get_scenes() if s.covers(center_lon, center_lat)]
+    if not covering:
+        return None
+    in_window = [s for s in covering if window[0] <= s.date <= window[1]]
+    if in_window:
+        return min(in_window, key=lambda s: (s.cloud_cover, -s.date.toordinal()))
+    return max(covering, key=lambda s: s.date)
+
+
+def read_bands(scene, bbox, size=ndvi_stats.RAW_SIZE, crs=ndvi_stats.CRS_WGS84):
+    """(b04, b08, scl) reflectance arrays of size x size for a bbox in `crs`, like the raw Process API output."""
+    start = time.perf_counter()
+    width = (bbox[2] - bbox[0]) / size
+    height = (bbox[3] - bbox[1]) / size
+    xs = bbox[0] + (np.arange(size) + 0.5) * width
+    ys = bbox[3] - (np.arange(size) + 0.5) * height
+    x, y = project_grid(xs, ys, _epsg(crs), scene.epsg)
+
+    indexes = {}
+    b04, inside = scene.sample("B04", x, y, indexes)
+    b08, _ = scene.sample("B08", x, y, indexes)
+    b04 = np.where(inside, b04 * scene.scale + scene.offset, 0).astype(np.float32)
+    b08 = np.where(inside, b08 * scene.scale + scene.offset, 0).astype(np.float32)
+    if "SCL" in scene.band_files:
+        scl, _ = scene.sample("SCL", x, y, indexes)
+        scl = scl.astype(np.uint8)
+    else:
+        scl = np.full((size, size), 4, dtype=np.uint8)
+    # Outside the scene is no data, as outside the swath is for the live API
+    scl[~inside] = 0
+    with _lock:
+        _STATS["read_ms"] += (time.perf_counter() - start) * 1000
+    return b04, b08, scl
+
+
+def render_field(bbox, window, size=ndvi_stats.RAW_SIZE):
+    """
+    Overlay and statistics for a field from the local archive.
+    Returns (tile_cache entry {"url", "name", "meta"}, served from the cache), with entry None
+    when no local scene covers the field.
+    """
+    with _lock:
+        _STATS["requests"] += 1
+    scene = select_scene(bbox, window)
+    if scene is None:
+        with _lock:
+            _STATS["not_covered"] += 1
+        return None, False
+    key = tile_cache.tile_key(bbox, window, ndvi_stats.RAW_EVALSCRIPT, size, size, "local:" + scene.id)
+    entry = tile_cache.get_entry(key)
+    cached = entry is not None
+    if not cached:
+        def render():
+            ndvi, cloud = ndvi_stats.compute_ndvi(*read_bands(scene, bbox, size))
+            stats = ndvi_stats.summarize(ndvi, cloud)
+            stats.update({"scene": scene.id, "acquired": scene.date.isoformat()})
+            return ndvi_stats.render_overlay(ndvi), stats
+        entry = tile_cache.fetch(key, render)
+    if entry is not None:
+        with _lock:
+            _STATS["served"] += 1
+    return entry, cached
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+    stats["read_ms"] = round(stats["read_ms"], 1)
+    stats["scenes"] = len(_scenes) if _scenes is not None else None
+    stats["mode"] = MODE
+    return stats
@@ -0,0 +1,376 @@
+import io
+import os
+import json
+import time
+import sqlite3
+import datetime
+import threading
+
+import numpy as np
+
+try:
+    from backend import tile_cache, ndvi_stats, sentinel_auth, single_flight, local_rasters
+except ImportError:
+    import tile_cache
+    import ndvi_stats
+    import sentinel_auth
+    import single_flight
+    import local_rasters
+
+# --- Configuration ---
+HISTORY_DB_PATH = os.getenv(
+    "NDVI_HISTORY_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "ndvi_history.db")
+)
+STATISTICS_URL = "https://services.sentinel-hub.com/api/v1/statistics"
+REQUEST_TIMEOUT_S = 30
+# History fetched the first time a field is asked for (3 years gives two earlier seasons to compare with)
+HISTORY_DAYS = 3 * 365
+# One Statistical API request returns every acquisition date in a batch of this many days
+BATCH_DAYS = 365
+# Stored series are brought up to date at most this often; everything in between is served from SQLite
+REFRESH_S = 24 * 3600
+# L2A products can appear a few days after acquisition, so refreshes re-read this many days
+OVERLAP_DAYS = 5
+# Acquisitions with less of the field clear than this are kept but left out of the analysis
+MIN_CLEAR_FRACTION = 0.3
+TREND_DAYS = 60
+# NDVI change per 30 days that counts as improving / declining
+TREND_THRESHOLD = 0.02
+# Anomaly: latest value vs earlier years within this many days of the same day of year
+ANOMALY_WINDOW_DAYS = 15
+ANOMALY_MIN_HISTORY = 3
+ANOMALY_Z = 2.0
+# Indian cropping seasons as (name, first month, last month)
+SEASONS = (("Kharif", 6, 10), ("Rabi", 11, 3), ("Zaid", 4, 5))
+
+# Columns stored per field; "day" is days since 1970-01-01
+COLUMNS = ("day", "mean", "std", "p10", "p50", "p90", "clear")
+_EPOCH = datetime.date(1970, 1, 1)
+
+STATS_EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {
+        input: [{ bands: ["B04", "B08", "SCL", "dataMask"] }],
+        output: [
+            { id: "ndvi", bands: 1, sampleType: "FLOAT32" },
+            { id: "dataMask", bands: 1 }
+        ]
+    };
+}
+
+// No data, defective, cloud shadow, clouds, cirrus and snow stay out of the statistics
+const MASKED_SCL = [0, 1, 3, 8, 9, 10, 11];
+
+function evaluatePixel(sample) {
+    let ndvi = (sample.B08 - sample.B04) / (sample.B08 + sample.B04);
+    let clear = sample.dataMask && MASKED_SCL.indexOf(sample.SCL) < 0 && isFinite(ndvi);
+    return {
+        ndvi: [ndvi],
+        dataMask: [clear ? 1 : 0]
+    };
+}
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+_initialized = False
+_STATS = {"queries": 0, "refreshes": 0, "sentinel_requests": 0, "acquisitions_fetched": 0, "errors": 0}
+
+
+def _count(key, n=1):
+    with _lock:
+        _STATS[key] += n
+
+
+def _connect():
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(HISTORY_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(HISTORY_DB_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    if not _initialized:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS field_series ("
+            " field TEXT PRIMARY KEY, bbox TEXT NOT NULL, series BLOB NOT NULL,"
+            " covered_to TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        conn.commit()
+        _initialized = True
+    return conn
+
+
+def _day(date):
+    return (date - _EPOCH).days
+
+
+def _date(day):
+    return _EPOCH + datetime.timedelta(days=int(day))
+
+
+def _year_before(date):
+    try:
+        return date.replace(year=date.year - 1)
+    except ValueError:  # 29 February
+        return date.replace(year=date.year - 1, day=28)
+
+
+# --- Columnar storage ---
+def _empty():
+    return {name: np.zeros(0, dtype=np.int32 if name == "day" else np.float32) for name in COLUMNS}
+
+
+def _pack(columns):
+    buffer = io.BytesIO()
+    np.savez(buffer, **columns)
+    return buffer.getvalue()
+
+
+def _unpack(blob):
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        return {name: data[name] for name in COLUMNS}
+
+
+def _merge(old, new):
+    """Union of two series by date; newer values win, sorted by day."""
+    merged = {name: np.concatenate([new[name], old[name]]) for name in COLUMNS}
+    # np.unique keeps the first occurrence, i.e. the freshly fetched row
+    _, keep = np.unique(merged["day"], return_index=True)
+    return {name: merged[name][keep] for name in COLUMNS}
+
+
+def field_key(bbox):
+    return json.dumps([round(v, 6) for v in bbox])
+
+
+def load(bbox):
+    """(columns, covered_to date or None, fetched_at) of a stored field."""
+    try:
+        row = _connect().execute(
+            "SELECT series, covered_to, fetched_at FROM field_series WHERE field = ?", (field_key(bbox),)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"NDVI history read error: {e}")
+        row = None
+    if row is None:
+        return _empty(), None, 0.0
+    return _unpack(row[0]), datetime.date.fromisoformat(row[1]), row[2]
+
+
+def _save(bbox, columns, covered_to):
+    try:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO field_series (field, bbox, series, covered_to, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (field_key(bbox), json.dumps(bbox), _pack(columns), covered_to.isoformat(), time.time())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"NDVI history write error: {e}")
+
+
+# --- Sentinel Hub Statistical API ---
+def _statistics_payload(bbox, start, end):
+    return {
+        "input": {
+            "bounds": {"bbox": bbox, "properties": {"crs": ndvi_stats.CRS_WGS84}},
+            "data": [{"type": "sentinel-2-l2a"}]
+        },
+        "aggregation": {
+            "timeRange": {"from": f"{start}T00:00:00Z", "to": f"{end}T23:59:59Z"},
+            # One interval per day: every acquisition in the batch comes back as its own entry
+            "aggregationInterval": {"of": "P1D"},
+            "evalscript": STATS_EVALSCRIPT,
+            "resx": 0.0001,
+            "resy": 0.0001
+        },
+        "calculations": {
+            "ndvi": {"statistics": {"default": {"percentiles": {"k": [10, 50, 90]}}}}
+        }
+    }
+
+
+def parse_statistics(body):
+    """Columns from a Statistical API response (one row per acquisition date)."""
+    rows = []
+    for item in body.get("data", []):
+        try:
+            stats = item["outputs"]["ndvi"]["bands"]["B0"]["stats"]
+            day = _day(datetime.date.fromisoformat(item["interval"]["from"][:10]))
+        except (KeyError, TypeError, ValueError):
+            continue
+        samples = float(stats.get("sampleCount") or 0)
+        clear = (samples - float(stats.get("noDataCount") or 0)) / samples if samples else 0.0
+        percentiles = stats.get("percentiles") or {}
+        rows.append((
+            day,
+            float(stats.get("mean", "nan")),
+            float(stats.get("stDev", "nan")),
+            float(percentiles.get("10.0", "nan")),
+            float(percentiles.get("50.0", "nan")),
+            float(percentiles.get("90.0", "nan")),
+            clear,
+        ))
+    if not rows:
+        return _empty()
+    table = list(zip(*rows))
+    return {
+        name: np.array(values, dtype=np.int32 if name == "day" else np.float32)
+        for name, values in zip(COLUMNS, table)
+    }
+
+
+def _fetch(bbox, start, end, token):
+    """Every acquisition between two dates, BATCH_DAYS per request."""
+    import requests
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    columns = _empty()
+    batch_start = start
+    while batch_start <= end:
+        batch_end = min(end, batch_start + datetime.timedelta(days=BATCH_DAYS - 1))
+        response = requests.post(STATISTICS_URL, json=_statistics_payload(bbox, batch_start, batch_end),
+                                 headers=headers, timeout=REQUEST_TIMEOUT_S)
+        response.raise_for_status()
+        batch = parse_statistics(response.json())
+        _count("sentinel_requests")
+        _count("acquisitions_fetched", len(batch["day"]))
+        columns = _merge(columns, batch)
+        batch_start = batch_end + datetime.timedelta(days=1)
+    return columns
+
+
+def update(bbox, today=None):
+    """
+    Brings a field's stored series up to date (first call: HISTORY_DAYS of it).
+    Returns (columns, stale) where stale means Sentinel could not be reached and older data is served.
+    With local_rasters.MODE "local" Sentinel is never contacted: the stored series is served as stale.
+    """
+    today = today or datetime.date.today()
+    columns, covered_to, fetched_at = load(bbox)
+    if covered_to is not None and time.time() - fetched_at < REFRESH_S:
+        return columns, False
+    if local_rasters.MODE == "local":
+        return columns, True
+
+    def refresh():
+        columns, covered_to, fetched_at = load(bbox)
+        if covered_to is not None and time.time() - fetched_at < REFRESH_S:
+            return columns, False
+        token = sentinel_auth.get_token()
+        if not token:
+            return columns, True
+        if covered_to is None:
+            start = today - datetime.timedelta(days=HISTORY_DAYS - 1)
+        else:
+            start = covered_to - datetime.timedelta(days=OVERLAP_DAYS)
+        try:
+            columns = _merge(columns, _fetch(bbox, start, today, token))
+        except Exception as e:
+            _count("errors")
+            print(f"NDVI history fetch error: {e}")
+            return columns, True
+        _count("refreshes")
+        _save(bbox, columns, today)
+        return columns, False
+
+    return single_flight.do("ndvi_history:" + field_key(bbox), refresh)
+
+
+# --- Analysis ---
+def _season(today):
+    """(name, first day) of the cropping season `today` falls in."""
+    for name, first, last in SEASONS:
+        months = range(first, last + 1) if first <= last else list(range(first, 13)) + list(range(1, last + 1))
+        if today.month in months:
+            year = today.year if today.month >= first else today.year - 1
+            return name, datetime.date(year, first, 1)
+    return None, today
+
+
+def _summary(values):
+    if not values.size:
+        return None
+    return {"mean": round(float(values.mean()), 4), "peak": round(float(values.max()), 4), "observations": int(values.size)}
+
+
+def analyze(columns, today=None):
+    """Trend, anomaly and season-over-season comparison from a stored series."""
+    today = today or datetime.date.today()
+    usable = (columns["clear"] >= MIN_CLEAR_FRACTION) & np.isfinite(columns["mean"])
+    days = columns["day"][usable]
+    ndvi = columns["mean"][usable]
+    result = {
+        "observations": int(days.size),
+        "series": {"dates": [_date(d).isoformat() for d in days], "ndvi": [round(float(v), 4) for v in ndvi]},
+        "latest": None, "trend": None, "anomaly": None, "season": None,
+    }
+    if not days.size:
+        return result
+
+    latest_day, latest = int(days[-1]), float(ndvi[-1])
+    result["latest"] = {"date": _date(latest_day).isoformat(), "ndvi": round(latest, 4)}
+
+    # Trend: least-squares slope over the recent window
+    recent = days >= _day(today) - TREND_DAYS
+    if recent.sum() >= 3 and np.ptp(days[recent]) > 0:
+        slope = float(np.polyfit(days[recent].astype(np.float64), ndvi[recent], 1)[0]) * 30
+        direction = "improving" if slope > TREND_THRESHOLD else "declining" if slope < -TREND_THRESHOLD else "stable"
+        result["trend"] = {
+            "slope_per_30_days": round(slope, 4), "direction": direction,
+            "window_days": TREND_DAYS, "observations": int(recent.sum())
+        }
+
+    # Anomaly: the latest value against the same time of year in earlier years
+    offset = np.mod(days - latest_day, 365.2425)
+    same_time_of_year = np.minimum(offset, 365.2425 - offset) <= ANOMALY_WINDOW_DAYS
+    history = ndvi[same_time_of_year & (days < latest_day - 300)]
+    if history.size >= ANOMALY_MIN_HISTORY:
+        expected = float(history.mean())
+        spread = float(history.std(ddof=1))
+        z_score = (latest - expected) / spread if spread > 0 else 0.0
+        result["anomaly"] = {
+            "expected": round(expected, 4), "deviation": round(latest - expected, 4),
+            "z_score": round(z_score, 2), "is_anomaly": abs(z_score) >= ANOMALY_Z,
+            "history_observations": int(history.size)
+        }
+
+    # Season so far vs the same dates a year earlier
+    name, start = _season(today)
+    if name:
+        this_season = ndvi[(days >= _day(start)) & (days <= _day(today))]
+        last_season = ndvi[(days >= _day(_year_before(start))) & (days <= _day(_year_before(today)))]
+        this_summary, last_summary = _summary(this_season), _summary(last_season)
+        result["season"] = {
+            "name": name, "start": start.isoformat(),
+            "this_season": this_summary, "last_season": last_summary,
+            "change": round(this_summary["mean"] - last_summary["mean"], 4) if this_summary and last_summary else None
+        }
+    return result
+
+
+def get_history(lat, lon, today=None):
+    """
+    NDVI history of the field around a point, analysed.
+    Sentinel Hub is only asked for acquisitions newer than the stored series.
+    """
+    _count("queries")
+    bbox = tile_cache.field_bbox(lat, lon)
+    columns, stale = update(bbox, today)
+    result = analyze(columns, today)
+    result["field_bbox"] = bbox
+    result["stale"] = stale
+    return result
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+    try:
+        stats["fields"] = _connect().execute("SELECT COUNT(*) FROM field_series").fetchone()[0]
+    except sqlite3.Error:
+        stats["fields"] = None
+    return stats
@@ -0,0 +1,210 @@
+import io
+import os
+import tarfile
+
+import numpy as np
+from PIL import Image
+
+try:
+    from backend import llm_cache, tile_cache
+except ImportError:
+    import llm_cache
+    import tile_cache
+
+# --- Configuration ---
+# "raw": download FLOAT32 bands once, compute statistics and render the overlay here.
+# "visual": the Process API renders a colored PNG and no statistics are available.
+MODE = os.getenv("NDVI_MODE", "raw")
+PROCESS_URL = "https://services.sentinel-hub.com/api/v1/process"
+# A 2 km field box is ~200 px at Sentinel-2's native 10 m; more pixels would only be resampled
+RAW_SIZE = 256
+REQUEST_TIMEOUT_S = 15
+CRS_WGS84 = "http://www.opengis.net/def/crs/EPSG/0/4326"
+CRS_WEB_MERCATOR = "http://www.opengis.net/def/crs/EPSG/0/3857"
+
+# Scene classification (SCL) values from Sen2Cor
+CLOUD_SCL = (3, 8, 9, 10)   # cloud shadow, cloud medium / high probability, thin cirrus
+INVALID_SCL = (0, 1, 11)    # no data, saturated / defective, snow
+# Statistics are withheld when less of the field than this is clear
+MIN_CLEAR_FRACTION = 0.05
+PERCENTILES = (10, 25, 50, 75, 90)
+HISTOGRAM_BINS = 20
+# Same bands as the visual evalscript and llm_cache.bucket_ndvi: bare <= 0.2 < stressed <= 0.4 < moderate <= 0.6 < healthy
+CLASS_EDGES = (0.2, 0.4, 0.6)
+CLASS_NAMES = ("bare", "stressed", "moderate", "healthy")
+# RGBA per class, as the visual evalscript colors them; masked pixels are transparent
+CLASS_COLORS = np.array([
+    [204, 0, 0, 255],       # Red (Soil/Dead)
+    [230, 230, 0, 255],     # Yellow
+    [128, 230, 0, 255],     # Light Green
+    [0, 204, 0, 255],       # Dark Green
+    [0, 0, 0, 0],           # Cloud / no data
+], dtype=np.uint8)
+
+RAW_EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {
+        input: [{ bands: ["B04", "B08", "SCL", "dataMask"] }],
+        output: [
+            { id: "b04", bands: 1, sampleType: "FLOAT32" },
+            { id: "b08", bands: 1, sampleType: "FLOAT32" },
+            { id: "scl", bands: 1, sampleType: "UINT8" }
+        ]
+    };
+}
+
+function evaluatePixel(sample) {
+    // Outside the swath comes back as SCL 0 (no data)
+    return {
+        b04: [sample.B04],
+        b08: [sample.B08],
+        scl: [sample.dataMask ? sample.SCL : 0]
+    };
+}
+"""
+
+
+def raw_payload(bbox, window, size=RAW_SIZE, crs=CRS_WGS84):
+    """Process API request for the raw bands as a tar of single-band TIFFs."""
+    past, today = window
+    return {
+        "input": {
+            "bounds": {
+                "bbox": bbox,
+                "properties": {"crs": crs}
+            },
+            "data": [{
+                "type": "sentinel-2-l2a",
+                "dataFilter": {
+                    "timeRange": {
+                        "from": f"{past}T00:00:00Z",
+                        "to": f"{today}T23:59:59Z"
+                    },
+                    "mosaickingOrder": "leastCC"
+                }
+            }]
+        },
+        "output": {
+            "width": size,
+            "height": size,
+            "responses": [
+                {"identifier": band, "format": {"type": "image/tiff"}} for band in ("b04", "b08", "scl")
+            ]
+        },
+        "evalscript": RAW_EVALSCRIPT
+    }
+
+
+def decode_bands(content):
+    """(b04, b08, scl or None) arrays from a tar of .tif or .npy members named after the bands."""
+    bands = {}
+    with tarfile.open(fileobj=io.BytesIO(content)) as tar:
+        for member in tar.getmembers():
+            stem, ext = os.path.splitext(os.path.basename(member.name))
+            if stem not in ("b04", "b08", "scl") or not member.isfile():
+                continue
+            data = io.BytesIO(tar.extractfile(member).read())
+            if ext == ".npy":
+                bands[stem] = np.load(data, allow_pickle=False)
+            else:
+                bands[stem] = np.asarray(Image.open(data))
+    if "b04" not in bands or "b08" not in bands:
+        raise ValueError(f"Response is missing bands (got {sorted(bands)})")
+    return bands["b04"], bands["b08"], bands.get("scl")
+
+
+# --- Analysis ---
+def compute_ndvi(b04, b08, scl=None):
+    """
+    NDVI per pixel, NaN where there is no usable observation.
+    Returns (ndvi float32 array, cloud mask bool array).
+    """
+    b04 = np.asarray(b04, dtype=np.float32)
+    b08 = np.asarray(b08, dtype=np.float32)
+    total = b08 + b04
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndvi = (b08 - b04) / total
+    valid = np.isfinite(ndvi) & (total > 0)
+    cloud = np.zeros(ndvi.shape, dtype=bool)
+    if scl is not None:
+        scl = np.asarray(scl)
+        cloud = np.isin(scl, CLOUD_SCL)
+        valid &= ~cloud & ~np.isin(scl, INVALID_SCL)
+    ndvi[~valid] = np.nan
+    return ndvi, cloud
+
+
+def classify(ndvi):
+    """Class index per pixel (0 bare .. 3 healthy, 4 masked)."""
+    classes = np.digitize(ndvi, CLASS_EDGES, right=True)
+    classes[~np.isfinite(ndvi)] = len(CLASS_NAMES)
+    return classes
+
+
+def summarize(ndvi, cloud=None):
+    """Field statistics over the clear pixels of an NDVI array."""
+    values = ndvi[np.isfinite(ndvi)]
+    cloudy = int(cloud.sum()) if cloud is not None else 0
+    observed = values.size + cloudy
+    stats = {
+        "pixels": int(ndvi.size),
+        "clear_fraction": round(values.size / ndvi.size, 4) if ndvi.size else 0.0,
+        "cloud_fraction": round(cloudy / observed, 4) if observed else 0.0,
+    }
+    if not ndvi.size or values.size < MIN_CLEAR_FRACTION * ndvi.size:
+        stats.update({"mean": None, "status": "unknown"})
+        return stats
+
+    mean = float(values.mean())
+    counts = np.bincount(np.digitize(values, CLASS_EDGES, right=True), minlength=len(CLASS_NAMES))
+    histogram, edges = np.histogram(values, bins=HISTOGRAM_BINS, range=(-1.0, 1.0))
+    stats.update({
+        "mean": round(mean, 4),
+        "std": round(float(values.std()), 4),
+        "percentiles": {
+            f"p{p}": round(float(v), 4) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+        },
+        "classes": {name: round(int(n) / values.size, 4) for name, n in zip(CLASS_NAMES, counts)},
+        "histogram": {"edges": [round(float(e), 2) for e in edges], "counts": histogram.tolist()},
+        "status": llm_cache.bucket_ndvi(mean),
+    })
+    return stats
+
+
+def render_overlay(ndvi):
+    """Colored PNG of the stress classes; clouds and gaps stay transparent."""
+    image = Image.fromarray(CLASS_COLORS[classify(ndvi)], "RGBA")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def process(content):
+    """One raw download -> (overlay PNG bytes, statistics)."""
+    ndvi, cloud = compute_ndvi(*decode_bands(content))
+    return render_overlay(ndvi), summarize(ndvi, cloud)
+
+
+def fetch_raw(bbox, window, token, size=RAW_SIZE, crs=CRS_WGS84):
+    """Raw band tar for a bbox (in `crs` units) from the Process API."""
+    import requests
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+        "Accept": "application/x-tar"
+    }
+    response = requests.post(PROCESS_URL, json=raw_payload(bbox, window, size, crs), headers=headers,
+                             timeout=REQUEST_TIMEOUT_S)
+    response.raise_for_status()
+    return response.content
+
+
+def request_field(bbox, window, token, size=RAW_SIZE):
+    """Fetches the raw bands for a field and returns (overlay PNG bytes, statistics)."""
+    return process(fetch_raw(bbox, window, token, size))
+
+
+def tile_key(bbox, window, size=RAW_SIZE):
+    """tile_cache key of a raw-mode render."""
+    return tile_cache.tile_key(bbox, window, RAW_EVALSCRIPT, size, size, "application/x-tar")
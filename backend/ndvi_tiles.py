@@ -0,0 +1,318 @@
+import io
+import os
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from backend import tile_cache, ndvi_stats, sentinel_auth, local_rasters
+except ImportError:
+    import tile_cache
+    import ndvi_stats
+    import sentinel_auth
+    import local_rasters
+
+# --- Configuration ---
+TILE_SIZE = 256
+# Source rasters are fetched from Sentinel Hub at this zoom (~9.5 m/px at the equator,
+# Sentinel-2's native 10 m). Deeper zooms crop and enlarge them; shallower ones downsample.
+SOURCE_ZOOM = 14
+# A zoom-z tile needs 4^(SOURCE_ZOOM - z) source rasters; below this it is too many per tile.
+# A cold z12 tile therefore costs up to 16 Process API requests (a z13 one 4). Each source raster
+# is cached on its own and shared by every tile above it, so a panned-over area pays this once.
+MIN_ZOOM = 12
+MAX_ZOOM = 18
+# Source rasters fetched in parallel while building a low-zoom tile
+FETCH_WORKERS = 4
+URL_TEMPLATE = "/tiles/ndvi/{z}/{x}/{y}.png"
+# Tiles pinned to a window (?to=YYYY-MM-DD) never change; unpinned ones only until the window moves on
+PINNED_MAX_AGE_S = tile_cache.MAX_AGE_S
+# Unless the local archive may serve them: a scene added to it changes a tile under the same URL
+LOCAL_MAX_AGE_S = int(os.getenv("NDVI_TILE_LOCAL_MAX_AGE_S", "3600"))
+# Oldest pinned window served: a scout response pins the current window, and a page left open
+# keeps asking for it a while; anything older would only spend Process API quota
+MAX_PIN_AGE_DAYS = int(os.getenv("NDVI_TILE_MAX_PIN_AGE_DAYS", "90"))
+MIN_MAX_AGE_S = 60
+
+_WEB_MERCATOR_HALF = 20037508.342789244
+
+_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="ndvi-source")
+_lock = threading.Lock()
+_STATS = {"tiles_rendered": 0, "levels_built": 0, "sources_fetched": 0, "unavailable": 0, "partial": 0}
+
+
+class TileUnavailable(Exception):
+    """Source imagery could not be fetched (no token, API error)."""
+
+
+class PartialTile(TileUnavailable):
+    """
+    Some source rasters under a tile could not be fetched. Carries what was built without them
+    (`ndvi`, NaN in their place, and for a rendered tile its PNG `content`); it is never cached.
+    """
+
+    def __init__(self, message, ndvi, content=None):
+        super().__init__(message)
+        self.ndvi = ndvi
+        self.content = content
+
+
+def _count(key):
+    with _lock:
+        _STATS[key] += 1
+
+
+# --- Tile grid ---
+def tile_bounds(z, x, y):
+    """[min_x, min_y, max_x, max_y] of an XYZ tile in Web Mercator meters."""
+    size = 2 * _WEB_MERCATOR_HALF / (1 << z)
+    min_x = -_WEB_MERCATOR_HALF + x * size
+    max_y = _WEB_MERCATOR_HALF - y * size
+    return [min_x, max_y - size, min_x + size, max_y]
+
+
+def window_for(to=None):
+    """
+    The look-back window ending on `to` (YYYY-MM-DD), or the current one.
+    Only window ends tile_cache.time_window() can produce, at most MAX_PIN_AGE_DAYS old,
+    are accepted, so clients cannot make us fetch arbitrary dates.
+    """
+    current = tile_cache.time_window()
+    if not to:
+        return current
+    end = datetime.date.fromisoformat(to)
+    if end > current[1] or (end - datetime.date(1970, 1, 1)).days % tile_cache.WINDOW_STEP_DAYS:
+        raise ValueError(f"Not a window end: {to}")
+    if (current[1] - end).days > MAX_PIN_AGE_DAYS:
+        raise ValueError(f"Window ending {to} is older than {MAX_PIN_AGE_DAYS} days")
+    return end - datetime.timedelta(days=tile_cache.WINDOW_DAYS), end
+
+
+def tile_url(window):
+    """Leaflet URL template pinned to `window`, so tile URLs stay valid while the window moves on."""
+    return f"{URL_TEMPLATE}?to={window[1]}"
+
+
+def immutable(pinned):
+    """Whether a tile may be cached as immutable: pinned, and only ever built from Sentinel Hub."""
+    return pinned and local_rasters.MODE == "sentinel"
+
+
+def max_age(window, pinned):
+    """
+    Cache lifetime for a tile: forever when immutable, else until the current window ends,
+    and at most LOCAL_MAX_AGE_S while the local archive may serve it.
+    """
+    if immutable(pinned):
+        return PINNED_MAX_AGE_S
+    expires = datetime.datetime.combine(window[1] + datetime.timedelta(days=1), datetime.time())
+    age = max(MIN_MAX_AGE_S, int((expires - datetime.datetime.now()).total_seconds()))
+    return age if local_rasters.MODE == "sentinel" else min(age, LOCAL_MAX_AGE_S)
+
+
+# --- NDVI pyramid ---
+def _source_scene(x, y, window):
+    """Local archive scene for a SOURCE_ZOOM raster, or None to fetch it from Sentinel Hub."""
+    if local_rasters.MODE == "sentinel":
+        return None
+    return local_rasters.select_scene(tile_bounds(SOURCE_ZOOM, x, y), window, ndvi_stats.CRS_WEB_MERCATOR)
+
+
+def _source_tag(scene):
+    return "local:" + scene.id if scene is not None else "sentinel"
+
+
+def _tile_sources(z, x, y, window):
+    """
+    The imagery under an XYZ tile ("sentinel", "local:<scene id>", or several joined),
+    so a tile is rebuilt when its sources change, as local_rasters.render_field keys its renders.
+    """
+    if z >= SOURCE_ZOOM:
+        shift = z - SOURCE_ZOOM
+        return _source_tag(_source_scene(x >> shift, y >> shift, window))
+    shift = SOURCE_ZOOM - z
+    if local_rasters.MODE == "sentinel":
+        return "sentinel"
+    return ",".join(sorted({
+        _source_tag(_source_scene((x << shift) + i, (y << shift) + j, window))
+        for i in range(1 << shift) for j in range(1 << shift)
+    }))
+
+
+def _array_key(z, x, y, window, sources):
+    return tile_cache.tile_key(tile_bounds(z, x, y), window, ndvi_stats.RAW_EVALSCRIPT,
+                               TILE_SIZE, TILE_SIZE, f"application/x-npy;{sources}")
+
+
+def _to_npy(ndvi):
+    # float16 halves the disk use; NDVI needs ~3 decimals
+    buffer = io.BytesIO()
+    np.save(buffer, ndvi.astype(np.float16))
+    return buffer.getvalue()
+
+
+def _from_npy(entry):
+    return np.load(io.BytesIO(tile_cache.read(entry)), allow_pickle=False).astype(np.float32)
+
+
+def _cached_array(key, build):
+    """NDVI array for `key` from the tile cache, built (once across concurrent requests) on a miss."""
+    entry = tile_cache.get_entry(key)
+    if entry is None:
+        entry = tile_cache.fetch(key, lambda: _to_npy(build()), ext="npy")
+        if entry is None:
+            raise TileUnavailable("Tile cache write failed")
+    return _from_npy(entry)
+
+
+def _source(x, y, window):
+    """SOURCE_ZOOM raster from the local archive when it covers the tile, else the Process API."""
+    scene = _source_scene(x, y, window)
+    bounds = tile_bounds(SOURCE_ZOOM, x, y)
+
+    def build():
+        if scene is not None:
+            bands = local_rasters.read_bands(scene, bounds, TILE_SIZE, ndvi_stats.CRS_WEB_MERCATOR)
+            return ndvi_stats.compute_ndvi(*bands)[0]
+        if local_rasters.MODE == "local":
+            raise TileUnavailable("No local scene covers this tile")
+        token = sentinel_auth.get_token()
+        if not token:
+            raise TileUnavailable("No Sentinel Hub token")
+        content = ndvi_stats.fetch_raw(bounds, window, token, TILE_SIZE, ndvi_stats.CRS_WEB_MERCATOR)
+        _count("sources_fetched")
+        return ndvi_stats.compute_ndvi(*ndvi_stats.decode_bands(content))[0]
+
+    return _cached_array(_array_key(SOURCE_ZOOM, x, y, window, _source_tag(scene)), build)
+
+
+def _downsample(quads):
+    """2x2 NaN-aware mean of four child tiles [[top-left, bottom-left], [top-right, bottom-right]]."""
+    full = np.block([[quads[0][0], quads[1][0]], [quads[0][1], quads[1][1]]])
+    blocks = full.reshape(TILE_SIZE, 2, TILE_SIZE, 2)
+    valid = np.isfinite(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sums / counts).astype(np.float32)
+
+
+def _leaf(x, y, window, missing):
+    """Source raster, or all NaN (recording (x, y) in `missing`) when it cannot be fetched."""
+    if missing is None:
+        return _source(x, y, window)
+    if (x, y) not in missing:
+        try:
+            return _source(x, y, window)
+        except TileUnavailable as e:
+            print(f"NDVI source {SOURCE_ZOOM}/{x}/{y} unavailable: {e}")
+            missing.add((x, y))
+    return np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+
+
+def get_ndvi(z, x, y, window, missing=None):
+    """
+    TILE_SIZE x TILE_SIZE NDVI array (NaN = cloud / no data) for an XYZ tile.
+    Without `missing`, any unavailable source raster raises TileUnavailable. With a set, those
+    rasters are left NaN and their (x, y) added to it; levels built from them are not cached.
+    """
+    if z == SOURCE_ZOOM:
+        return _leaf(x, y, window, missing)
+    if z > SOURCE_ZOOM:
+        # Crop the covering source raster and enlarge it (nearest neighbour, like the pixels it shows)
+        shift = z - SOURCE_ZOOM
+        source = _leaf(x >> shift, y >> shift, window, missing)
+        block = TILE_SIZE >> shift
+        col = (x - ((x >> shift) << shift)) * block
+        row = (y - ((y >> shift) << shift)) * block
+        crop = source[row:row + block, col:col + block]
+        return np.repeat(np.repeat(crop, 1 << shift, axis=0), 1 << shift, axis=1)
+
+    shift = SOURCE_ZOOM - z
+
+    def build():
+        failed = missing if missing is not None else set()
+        quads = [[get_ndvi(z + 1, 2 * x + dx, 2 * y + dy, window, failed) for dy in (0, 1)] for dx in (0, 1)]
+        _count("levels_built")
+        ndvi = _downsample(quads)
+        gaps = sum(1 for leaf_x, leaf_y in failed if (leaf_x >> shift, leaf_y >> shift) == (x, y))
+        if gaps:
+            # Raised rather than returned so that tile_cache.fetch does not store it
+            raise PartialTile(f"{gaps} of {1 << 2 * shift} source rasters unavailable", ndvi)
+        return ndvi
+
+    try:
+        return _cached_array(_array_key(z, x, y, window, _tile_sources(z, x, y, window)), build)
+    except PartialTile as e:
+        if missing is None:
+            raise
+        return e.ndvi
+
+
+def _prefetch_sources(z, x, y, window, missing):
+    """
+    Fetches the source rasters under a low-zoom tile in parallel instead of one by one.
+    The ones that cannot be fetched are added to `missing` rather than failing the tile.
+    """
+    shift = SOURCE_ZOOM - z
+    if shift <= 0:
+        return
+    leaves = [((x << shift) + i, (y << shift) + j) for i in range(1 << shift) for j in range(1 << shift)]
+    list(_pool.map(lambda leaf: _leaf(leaf[0], leaf[1], window, missing), leaves))
+
+
+def render_tile(z, x, y, window):
+    """
+    Cached PNG for an XYZ tile as a tile_cache entry ({"url", "name", "meta"}).
+    Raises ValueError for tiles outside the served pyramid and TileUnavailable
+    when the imagery cannot be fetched; PartialTile (with the PNG) when only some of it can.
+    """
+    if not MIN_ZOOM <= z <= MAX_ZOOM or not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise ValueError(f"Tile {z}/{x}/{y} is outside the NDVI pyramid")
+    key = tile_cache.tile_key(tile_bounds(z, x, y), window, ndvi_stats.RAW_EVALSCRIPT,
+                              TILE_SIZE, TILE_SIZE, f"image/png;{_tile_sources(z, x, y, window)}")
+    entry = tile_cache.get_entry(key)
+    if entry is not None:
+        return entry
+
+    missing = set()
+    leaves = 1 << 2 * max(0, SOURCE_ZOOM - z)
+
+    def render():
+        ndvi = get_ndvi(z, x, y, window, missing)
+        if len(missing) >= leaves:
+            raise TileUnavailable("No source rasters available for this tile")
+        _count("tiles_rendered")
+        content = ndvi_stats.render_overlay(ndvi)
+        if missing:
+            raise PartialTile(f"{len(missing)} of {leaves} source rasters unavailable", ndvi, content)
+        return content
+
+    try:
+        _prefetch_sources(z, x, y, window, missing)
+        entry = tile_cache.fetch(key, render)
+    except PartialTile:
+        _count("partial")
+        raise
+    except TileUnavailable:
+        _count("unavailable")
+        raise
+    except Exception as e:
+        _count("unavailable")
+        raise TileUnavailable(str(e)) from e
+    if entry is None:
+        _count("unavailable")
+        raise TileUnavailable("Tile cache write failed")
+    return entry
+
+
+def empty_tile():
+    """Transparent PNG served while imagery is unavailable."""
+    return ndvi_stats.render_overlay(np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32))
+
+
+def get_stats():
+    with _lock:
+        return dict(_STATS)
@@ -0,0 +1,226 @@
+import os
+import io
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# --- Configuration ---
+# PREDICTION_CACHE_MODE: "content" (exact bytes), "perceptual" (also matches resized /
+# recompressed copies of the same photo) or "off".
+CACHE_MODE = os.getenv("PREDICTION_CACHE_MODE", "content").lower()
+CACHE_DB_PATH = os.getenv(
+    "PREDICTION_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "prediction_cache.db")
+)
+MEMORY_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MEMORY_ENTRIES", "1024"))
+DISK_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_DISK_ENTRIES", "50000"))
+MAX_AGE_S = float(os.getenv("PREDICTION_CACHE_MAX_AGE_S", str(30 * 24 * 3600)))
+# Max Hamming distance (out of 64 bits) for a perceptual match in the memory tier
+PHASH_MAX_DISTANCE = int(os.getenv("PREDICTION_CACHE_PHASH_DISTANCE", "4"))
+
+
+def content_key(data):
+    """Exact-duplicate key: SHA-256 of the uploaded bytes."""
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image_data):
+    """
+    64-bit difference hash (dHash) of an image given as bytes, file-like or PIL Image.
+    Robust to resizing and JPEG recompression. Uses draft decoding, so it is cheap.
+    """
+    from PIL import Image
+
+    if isinstance(image_data, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image_data))
+    elif hasattr(image_data, "read"):
+        image = Image.open(image_data)
+    else:
+        image = image_data
+
+    if image.format == "JPEG":
+        image.draft("L", (64, 64))
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | int(left > right)
+    return value
+
+
+def perceptual_key(phash):
+    return f"dhash:{phash:016x}"
+
+
+class PredictionCache:
+    """
+    Two-tier prediction cache: an in-process LRU in front of a persistent SQLite table.
+    Entries expire after MAX_AGE_S; each tier is trimmed to its size limit by last access.
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, memory_entries=MEMORY_MAX_ENTRIES,
+                 disk_entries=DISK_MAX_ENTRIES, max_age_s=MAX_AGE_S):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.max_age_s = max_age_s
+
+        self._memory = OrderedDict()  # key -> (created, result)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes_since_trim = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "perceptual_hits": 0, "misses": 0, "stores": 0}
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " key TEXT PRIMARY KEY, result TEXT NOT NULL,"
+                " created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_access ON predictions(last_access)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Lookup ---
+    def get(self, keys, phash=None):
+        """
+        Returns the cached result for the first key found, or None.
+        With a perceptual hash, near-duplicates in the memory tier also count.
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry and now - entry[0] < self.max_age_s:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+
+        try:
+            conn = self._connect()
+            for key in keys:
+                row = conn.execute(
+                    "SELECT result, created FROM predictions WHERE key = ? AND created > ?",
+                    (key, now - self.max_age_s)
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE predictions SET last_access = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    result = json.loads(row[0])
+                    self._remember(key, row[1], result)
+                    with self._lock:
+                        self.stats["disk_hits"] += 1
+                    return result
+        except sqlite3.Error as e:
+            print(f"Prediction cache read error: {e}")
+
+        if phash is not None and PHASH_MAX_DISTANCE > 0:
+            result = self._nearest_perceptual(phash, now)
+            if result is not None:
+                return result
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def _nearest_perceptual(self, phash, now):
+        with self._lock:
+            for key, (created, result) in reversed(self._memory.items()):
+                if not key.startswith("dhash:") or now - created >= self.max_age_s:
+                    continue
+                if bin(int(key[6:], 16) ^ phash).count("1") <= PHASH_MAX_DISTANCE:
+                    self._memory.move_to_end(key)
+                    self.stats["perceptual_hits"] += 1
+                    return result
+        return None
+
+    # --- Store ---
+    def _remember(self, key, created, result):
+        with self._lock:
+            self._memory[key] = (created, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, keys, result):
+        now = time.time()
+        for key in keys:
+            self._remember(key, now, result)
+
+        try:
+            conn = self._connect()
+            payload = json.dumps(result)
+            conn.executemany(
+                "INSERT OR REPLACE INTO predictions (key, result, created, last_access) VALUES (?, ?, ?, ?)",
+                [(key, payload, now, now) for key in keys]
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Prediction cache write error: {e}")
+            return
+
+        with self._lock:
+            self.stats["stores"] += 1
+            self._writes_since_trim += 1
+            should_trim = self._writes_since_trim >= 100
+            if should_trim:
+                self._writes_since_trim = 0
+        if should_trim:
+            self.evict()
+
+    def evict(self):
+        """Drops expired rows, then the least recently used beyond the size limit."""
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM predictions WHERE created <= ?", (now - self.max_age_s,))
+            conn.execute(
+                "DELETE FROM predictions WHERE key IN ("
+                " SELECT key FROM predictions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.disk_entries,)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Prediction cache eviction error: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["mode"] = CACHE_MODE
+        return stats
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache instance (None when PREDICTION_CACHE_MODE=off)."""
+    global _CACHE
+    if CACHE_MODE == "off":
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = PredictionCache()
+    return _CACHE
+
+
+def get_stats():
+    if _CACHE is None:
+        return {"mode": CACHE_MODE, "status": "idle"}
+    return _CACHE.get_stats()
@@ -0,0 +1,124 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from backend import llm_cache, llm_client
+except ImportError:
+    import llm_cache
+    import llm_client
+
+# --- Configuration ---
+MAX_WORKERS = int(os.getenv("PRESCRIPTION_WORKERS", "4"))
+JOB_TTL_S = float(os.getenv("PRESCRIPTION_JOB_TTL_S", "900"))
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="prescription")
+_JOBS = {}
+_JOBS_LOCK = threading.Lock()
+
+
+def is_enabled():
+    """Background prescriptions only make sense with a Gemini key."""
+    return llm_client.is_configured()
+
+
+def _generate(disease_name):
+    cache_key = llm_cache.signature("prescription", disease=llm_cache.normalize_text(disease_name))
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = f"""
+    The user's plant has been diagnosed with: {disease_name}.
+    Provide a concise but effective treatment prescription.
+    Include:
+    1. Immediate Action (1 sentence)
+    2. Organic/Chemical Treatment (1 sentence)
+    3. Prevention for future (1 sentence)
+    Keep it under 60 words total.
+    """
+    prescription = llm_client.generate(prompt)
+    llm_cache.put(cache_key, prescription)
+    return prescription
+
+
+def _run(job_id, on_done):
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    if job is None:
+        return
+
+    try:
+        prescription = _generate(job["disease"])
+        job.update(status="done", prescription=prescription, source="Google Gemini 1.5 Flash")
+        print("Gemini Prescription Generated.")
+        if on_done is not None:
+            on_done(prescription)
+    except Exception as e:
+        print(f"Gemini Fallback: {e}")
+        job.update(status="failed", error=str(e))
+    finally:
+        job["finished"] = time.time()
+        job["event"].set()
+
+
+def _purge_expired():
+    cutoff = time.time() - JOB_TTL_S
+    with _JOBS_LOCK:
+        for job_id in [j for j, job in _JOBS.items() if job["created"] < cutoff]:
+            del _JOBS[job_id]
+
+
+def submit(disease_name, fallback, on_done=None):
+    """
+    Queues a Gemini prescription for `disease_name` and returns its job id immediately.
+    `fallback` (the static recommendation) is served until the job finishes or if it fails.
+    `on_done(prescription)` runs on success, e.g. to refresh a cache entry.
+    """
+    _purge_expired()
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "disease": disease_name,
+        "status": "pending",
+        "prescription": fallback,
+        "source": "Static Recommendation",
+        "created": time.time(),
+        "event": threading.Event(),
+    }
+    with _JOBS_LOCK:
+        _JOBS[job_id] = job
+    _EXECUTOR.submit(_run, job_id, on_done)
+    return job_id
+
+
+def get_job(job_id):
+    """Public view of a job (None if unknown or expired)."""
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    if job is None:
+        return None
+    return {k: v for k, v in job.items() if k != "event"}
+
+
+def wait(job_id, timeout):
+    """Blocks until the job finishes or `timeout` seconds pass. Returns the job view."""
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    if job is None:
+        return None
+    job["event"].wait(timeout)
+    return get_job(job_id)
+
+
+def get_stats():
+    with _JOBS_LOCK:
+        statuses = [job["status"] for job in _JOBS.values()]
+    return {
+        "jobs": len(statuses),
+        "pending": statuses.count("pending"),
+        "done": statuses.count("done"),
+        "failed": statuses.count("failed"),
+    }
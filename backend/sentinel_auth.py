@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: workers still share the file, just without a fetch lock
+    fcntl = None
+
+# --- Configuration ---
+TOKEN_URL = "https://services.sentinel-hub.com/oauth/token"
+# Sentinel Hub Credentials (required; without them Sentinel is treated as unconfigured)
+CLIENT_ID = os.getenv("SENTINEL_CLIENT_ID")
+CLIENT_SECRET = os.getenv("SENTINEL_CLIENT_SECRET")
+# Shared by every worker on the host
+TOKEN_CACHE_PATH = os.getenv(
+    "SENTINEL_TOKEN_CACHE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "sentinel_token.json")
+)
+# A token is not handed out with less than this left
+EXPIRY_MARGIN_S = 60
+# Inside this window before expiry, callers still get the current token while a background refresh runs
+REFRESH_WINDOW_S = 300
+# After a failed fetch, callers fall back immediately instead of each waiting on the OAuth timeout
+FAILURE_BACKOFF_S = 30
+REQUEST_TIMEOUT_S = 10
+
+_lock = threading.Lock()
+_fetch_lock = threading.Lock()
+_token = {"access_token": None, "expires_at": 0.0}
+_failed_at = None
+_refreshing = False
+_STATS = {
+    "memory_hits": 0, "disk_hits": 0, "fetches": 0, "fetch_failures": 0,
+    "background_refreshes": 0, "backoff_skips": 0, "last_fetch_ms": None,
+}
+
+
+def _in_backoff():
+    return _failed_at is not None and time.monotonic() - _failed_at < FAILURE_BACKOFF_S
+
+
+def _usable(token, now, margin=EXPIRY_MARGIN_S):
+    return bool(token.get("access_token")) and token.get("expires_at", 0) - margin > now
+
+
+# --- Shared on-disk cache ---
+def _read_disk():
+    try:
+        with open(TOKEN_CACHE_PATH) as f:
+            token = json.load(f)
+        return token if isinstance(token, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_disk(token):
+    """Atomic replace, readable by the owner only."""
+    try:
+        os.makedirs(os.path.dirname(TOKEN_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{TOKEN_CACHE_PATH}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(token, f)
+        os.replace(tmp_path, TOKEN_CACHE_PATH)
+    except OSError as e:
+        print(f"Sentinel token cache write error: {e}")
+
+
+class _FetchLock:
+    """Host-wide lock so only one thread of one worker calls the OAuth endpoint at a time."""
+
+    def __enter__(self):
+        _fetch_lock.acquire()
+        self.file = None
+        if fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(TOKEN_CACHE_PATH), exist_ok=True)
+                self.file = open(TOKEN_CACHE_PATH + ".lock", "w")
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except OSError:
+                self.file = None
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        _fetch_lock.release()
+
+
+# --- Fetching ---
+def _fetch():
+    """POSTs client credentials. Returns {"access_token", "expires_at"} or raises."""
+    import requests
+    start = time.perf_counter()
+    response = requests.post(TOKEN_URL, data={
+        "grant_type": "client_credentials",
+        "client_id": CLIENT_ID,
+        "client_secret": CLIENT_SECRET
+    }, timeout=REQUEST_TIMEOUT_S)
+    response.raise_for_status()
+    body = response.json()
+    with _lock:
+        _STATS["fetches"] += 1
+        _STATS["last_fetch_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return {"access_token": body["access_token"], "expires_at": time.time() + float(body.get("expires_in", 3600))}
+
+
+def _refresh(force):
+    """
+    Gets a fresh token under the host-wide lock. Another worker may have refreshed
+    while we waited, so the disk copy is checked first (unless `force`).
+    """
+    global _failed_at
+    with _FetchLock():
+        now = time.time()
+        disk = _read_disk()
+        if _usable(disk, now, REFRESH_WINDOW_S if force else EXPIRY_MARGIN_S):
+            with _lock:
+                _token.update(disk)
+                _STATS["disk_hits"] += 1
+            return disk["access_token"]
+        if not force and _in_backoff():
+            # The thread ahead of us just failed; do not queue another timeout behind it
+            return None
+        try:
+            token = _fetch()
+        except Exception as e:
+            print(f"Auth Error: {e}")
+            with _lock:
+                _STATS["fetch_failures"] += 1
+                _failed_at = time.monotonic()
+            return None
+        _write_disk(token)
+    with _lock:
+        _token.update(token)
+    return token["access_token"]
+
+
+def _background_refresh():
+    global _refreshing
+    try:
+        with _lock:
+            _STATS["background_refreshes"] += 1
+        _refresh(force=True)
+    finally:
+        with _lock:
+            _refreshing = False
+
+
+def is_configured():
+    """True when Sentinel Hub credentials are set (SENTINEL_CLIENT_ID / SENTINEL_CLIENT_SECRET)."""
+    return bool(CLIENT_ID and CLIENT_SECRET)
+
+
+def get_token():
+    """
+    Returns a valid Sentinel Hub access token, or None if one cannot be obtained
+    (or no credentials are configured).
+    Served from memory, then the shared disk cache, then the OAuth endpoint;
+    tokens close to expiry are refreshed in the background while still being served.
+    """
+    global _refreshing
+    if not is_configured():
+        return None
+    now = time.time()
+    with _lock:
+        token = dict(_token)
+        if _usable(token, now):
+            _STATS["memory_hits"] += 1
+            start_refresh = not _refreshing and not _usable(token, now, REFRESH_WINDOW_S)
+            if start_refresh:
+                _refreshing = True
+        elif _in_backoff():
+            _STATS["backoff_skips"] += 1
+            return None
+        else:
+            token = None
+
+    if token is None:
+        return _refresh(force=False)
+    if start_refresh:
+        threading.Thread(target=_background_refresh, name="sentinel-token-refresh", daemon=True).start()
+    return token["access_token"]
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+        expires_at = _token["expires_at"]
+    stats["token_valid_for_s"] = max(0.0, round(expires_at - time.time(), 1))
+    stats["shared_cache"] = TOKEN_CACHE_PATH
+    stats["configured"] = is_configured()
+    return stats
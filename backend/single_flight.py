@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+# --- Configuration ---
+# Set SINGLE_FLIGHT_LEASE=1 to also coalesce across worker processes through a SQLite lease
+LEASE_ENABLED = os.getenv("SINGLE_FLIGHT_LEASE", "0") == "1"
+LEASE_DB_PATH = os.getenv(
+    "SINGLE_FLIGHT_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "single_flight.db")
+)
+# A lease outlives the LLM deadline, so a live leader is never taken over
+LEASE_TTL_S = float(os.getenv("SINGLE_FLIGHT_LEASE_TTL_S", "30"))
+# How long a finished result stays readable by waiting processes
+RESULT_TTL_S = 10.0
+POLL_S = 0.05
+
+_OWNER = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_lock = threading.Lock()
+_calls = {}
+_local = threading.local()
+_initialized = False
+_STATS = {"leaders": 0, "saved": 0, "saved_cross_process": 0, "errors": 0}
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def do(key, fn):
+    """
+    Runs fn() once per key at a time. Threads asking for a key that is already
+    in flight block on that call and share its result (or its exception).
+    With the lease enabled, results must be JSON-serializable to be shared across processes.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+            _STATS["leaders"] += 1
+        else:
+            _STATS["saved"] += 1
+
+    if not leader:
+        call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = _run_leased(key, fn) if LEASE_ENABLED else fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        with _lock:
+            _STATS["errors"] += 1
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call.event.set()
+
+
+# --- Cross-process lease ---
+def _connect():
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(LEASE_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(LEASE_DB_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    if not _initialized:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            " key TEXT PRIMARY KEY, owner TEXT, lease_expires REAL NOT NULL,"
+            " result TEXT, done_at REAL)"
+        )
+        _initialized = True
+    return conn
+
+
+def _try_lease(conn, key):
+    """Returns ("leader", None), ("wait", None) or ("done", value)."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT owner, lease_expires, result, done_at FROM flights WHERE key = ?", (key,)
+        ).fetchone()
+        if row and row[3] is not None and now - row[3] < RESULT_TTL_S:
+            conn.execute("COMMIT")
+            return "done", json.loads(row[2])
+        if row and row[3] is None and row[1] > now:
+            conn.execute("COMMIT")
+            return "wait", None
+        conn.execute(
+            "INSERT OR REPLACE INTO flights (key, owner, lease_expires, result, done_at) VALUES (?, ?, ?, NULL, NULL)",
+            (key, _OWNER, now + LEASE_TTL_S)
+        )
+        conn.execute("DELETE FROM flights WHERE lease_expires < ? AND (done_at IS NULL OR done_at < ?)",
+                     (now, now - RESULT_TTL_S))
+        conn.execute("COMMIT")
+        return "leader", None
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _run_leased(key, fn):
+    """Leader of this process: take the shared lease, or wait for the process that holds it."""
+    try:
+        conn = _connect()
+        while True:
+            state, value = _try_lease(conn, key)
+            if state == "done":
+                with _lock:
+                    _STATS["saved_cross_process"] += 1
+                return value
+            if state == "leader":
+                break
+            time.sleep(POLL_S)
+    except sqlite3.Error as e:
+        print(f"Single-flight lease error: {e}")
+        return fn()
+
+    try:
+        result = fn()
+    except Exception:
+        _release(conn, key, None)
+        raise
+    _release(conn, key, result)
+    return result
+
+
+def _release(conn, key, result):
+    """Publishes the result to waiting processes, or drops the lease so one of them takes over."""
+    try:
+        if result is None:
+            conn.execute("DELETE FROM flights WHERE key = ? AND owner = ?", (key, _OWNER))
+            return
+        conn.execute(
+            "UPDATE flights SET result = ?, done_at = ?, owner = NULL WHERE key = ? AND owner = ?",
+            (json.dumps(result, ensure_ascii=False), time.time(), key, _OWNER)
+        )
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        print(f"Single-flight release error: {e}")
+        conn.execute("DELETE FROM flights WHERE key = ? AND owner = ?", (key, _OWNER))
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+        stats["in_flight"] = len(_calls)
+    stats["lease"] = LEASE_ENABLED
+    return stats
@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import datetime
+import threading
+
+try:
+    from backend import single_flight
+except ImportError:
+    import single_flight
+
+# --- Configuration ---
+_INSTANCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance")
+# Image files, named by the SHA-256 of their content
+TILE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(_INSTANCE_DIR, "tiles"))
+INDEX_DB_PATH = os.getenv("TILE_CACHE_DB", os.path.join(_INSTANCE_DIR, "tile_cache.db"))
+# Least recently used images are evicted beyond this total size, down to LOW_WATER of it
+MAX_BYTES = int(float(os.getenv("TILE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+LOW_WATER = 0.9
+# The total is a full index scan, so it is only checked every this many stores (and on the first)
+SIZE_CHECK_EVERY = 100
+# Scouts look back this many days; the window end moves in steps of the Sentinel-2 revisit time,
+# so every request inside one step shares a key
+WINDOW_DAYS = 30
+WINDOW_STEP_DAYS = 5
+# Field centers are snapped to this grid (~110 m) so repeat scouts of a field share a key
+BBOX_SNAP_DEG = 0.001
+# Served from here by the apps; a name never changes content, so browsers may keep it forever
+URL_PREFIX = "/tiles/cache/"
+MAX_AGE_S = 365 * 24 * 3600
+# LRU bookkeeping granularity: a hit only rewrites last_access if it is older than this
+ACCESS_UPDATE_S = 300
+
+_NAME_RE = re.compile(r"^([0-9a-f]{64})\.(png|jpg|tif|npy)$")
+# Only images go out over HTTP; arrays (.npy) are internal source rasters
+SERVED_EXTS = ("png", "jpg")
+
+_local = threading.local()
+_lock = threading.Lock()
+_initialized = False
+_writes_since_check = SIZE_CHECK_EVERY
+_STATS = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "missing_files": 0}
+
+
+def _count(key, n=1):
+    with _lock:
+        _STATS[key] += n
+
+
+def _connect():
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(INDEX_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(INDEX_DB_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    if not _initialized:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tiles ("
+            " key TEXT PRIMARY KEY, name TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL, meta TEXT)"
+        )
+        try:
+            # Indexes created before renders carried statistics
+            conn.execute("ALTER TABLE tiles ADD COLUMN meta TEXT")
+        except sqlite3.OperationalError:
+            pass
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tiles_access ON tiles(last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tiles_name ON tiles(name)")
+        conn.commit()
+        _initialized = True
+    return conn
+
+
+# --- Keys ---
+def time_window(today=None, days=WINDOW_DAYS, step_days=WINDOW_STEP_DAYS):
+    """(from, to) dates of the look-back window, with `to` rounded up to the next step boundary."""
+    today = today or datetime.date.today()
+    epoch = datetime.date(1970, 1, 1)
+    steps = -(-(today - epoch).days // step_days)
+    end = epoch + datetime.timedelta(days=steps * step_days)
+    return end - datetime.timedelta(days=days), end
+
+
+def field_bbox(lat, lon, half_deg=0.01):
+    """[min_lon, min_lat, max_lon, max_lat] around a snapped field center (approx 1 km each way)."""
+    lat = round(round(float(lat) / BBOX_SNAP_DEG) * BBOX_SNAP_DEG, 6)
+    lon = round(round(float(lon) / BBOX_SNAP_DEG) * BBOX_SNAP_DEG, 6)
+    return [round(lon - half_deg, 6), round(lat - half_deg, 6), round(lon + half_deg, 6), round(lat + half_deg, 6)]
+
+
+def evalscript_hash(evalscript):
+    """Indentation and blank lines do not change what an evalscript renders."""
+    lines = [line.strip() for line in evalscript.strip().splitlines() if line.strip()]
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()[:16]
+
+
+def tile_key(bbox, window, evalscript, width, height, fmt="image/png"):
+    """Stable key for one Process API render."""
+    params = {
+        "bbox": [round(float(v), 6) for v in bbox],
+        "window": [str(window[0]), str(window[1])],
+        "evalscript": evalscript_hash(evalscript),
+        "size": [int(width), int(height)],
+        "format": fmt,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+# --- Files ---
+def _relative_path(name):
+    return os.path.join(name[:2], name)
+
+
+def _path(name):
+    return os.path.join(TILE_DIR, _relative_path(name))
+
+
+def file_path(name):
+    """Absolute path of a servable cached image by its URL name, or None for anything that is not one."""
+    match = _NAME_RE.match(name or "")
+    if not match or match.group(2) not in SERVED_EXTS:
+        return None
+    return _path(name)
+
+
+def url_for(name):
+    return URL_PREFIX + name
+
+
+def etag(entry):
+    """Content hash of a cache entry, usable as an HTTP ETag."""
+    return entry["name"].split(".")[0]
+
+
+def read(entry):
+    """Bytes of a cache entry."""
+    with open(_path(entry["name"]), "rb") as f:
+        return f.read()
+
+
+def _write_file(name, content):
+    """Content-addressed, so an existing file already holds these bytes."""
+    path = _path(name)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+# --- Cache access ---
+def _lookup(key):
+    now = time.time()
+    try:
+        conn = _connect()
+        row = conn.execute("SELECT name, last_access, meta FROM tiles WHERE key = ?", (key,)).fetchone()
+        if row is not None and not os.path.exists(_path(row[0])):
+            # Removed behind our back (disk cleanup); forget it
+            conn.execute("DELETE FROM tiles WHERE key = ?", (key,))
+            conn.commit()
+            _count("missing_files")
+            row = None
+        if row is not None:
+            if now - row[1] > ACCESS_UPDATE_S:
+                conn.execute("UPDATE tiles SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+            return {"url": url_for(row[0]), "name": row[0], "meta": json.loads(row[2]) if row[2] else None}
+    except sqlite3.Error as e:
+        print(f"Tile cache read error: {e}")
+    return None
+
+
+def get_entry(key):
+    """{"url", "name", "meta"} of the cached file for `key`, or None."""
+    entry = _lookup(key)
+    _count("hits" if entry is not None else "misses")
+    return entry
+
+
+def get(key):
+    """URL of the cached image for `key`, or None."""
+    entry = get_entry(key)
+    return entry["url"] if entry else None
+
+
+def put(key, content, ext="png", meta=None):
+    """Stores file bytes (plus optional JSON-serializable `meta`) under `key` and returns their URL."""
+    global _writes_since_check
+    name = f"{hashlib.sha256(content).hexdigest()}.{ext}"
+    now = time.time()
+    try:
+        _write_file(name, content)
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO tiles (key, name, size, created, last_access, meta) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, name, len(content), now, now, json.dumps(meta) if meta is not None else None)
+        )
+        conn.commit()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Tile cache write error: {e}")
+        return None
+    with _lock:
+        _STATS["stores"] += 1
+        _writes_since_check += 1
+        should_check = _writes_since_check >= SIZE_CHECK_EVERY
+        if should_check:
+            _writes_since_check = 0
+    if should_check and total_bytes() > MAX_BYTES:
+        evict()
+    return url_for(name)
+
+
+def fetch(key, loader, ext="png"):
+    """
+    For a key that just missed in get(): calls `loader()` once, even when several requests
+    for the same render arrive together. `loader` returns the image bytes, or (bytes, meta).
+    Returns {"url", "name", "meta"}, or None if it could not be stored.
+    Exceptions from `loader` propagate to every waiting caller.
+    """
+    def load():
+        # A concurrent leader may have stored it since our get()
+        entry = _lookup(key)
+        if entry is not None:
+            return entry
+        result = loader()
+        content, meta = result if isinstance(result, tuple) else (result, None)
+        url = put(key, content, ext, meta)
+        return {"url": url, "name": url[len(URL_PREFIX):], "meta": meta} if url else None
+
+    return single_flight.do("tile:" + key, load)
+
+
+def total_bytes():
+    """Size of the distinct files on disk (several keys may share one file)."""
+    try:
+        row = _connect().execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM tiles GROUP BY name)"
+        ).fetchone()
+        return row[0]
+    except sqlite3.Error as e:
+        print(f"Tile cache read error: {e}")
+        return 0
+
+
+def evict(max_bytes=None):
+    """Drops least recently used keys until the files left fit in LOW_WATER of `max_bytes`."""
+    target = (MAX_BYTES if max_bytes is None else max_bytes) * LOW_WATER
+    size = total_bytes()
+    evicted = 0
+    try:
+        conn = _connect()
+        rows = conn.execute("SELECT key, name, size FROM tiles ORDER BY last_access").fetchall()
+        for key, name, file_size in rows:
+            if size <= target:
+                break
+            conn.execute("DELETE FROM tiles WHERE key = ?", (key,))
+            evicted += 1
+            if conn.execute("SELECT 1 FROM tiles WHERE name = ? LIMIT 1", (name,)).fetchone() is None:
+                try:
+                    os.remove(_path(name))
+                except OSError:
+                    pass
+                size -= file_size
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Tile cache eviction error: {e}")
+    _count("evictions", evicted)
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_STATS)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] / lookups) if lookups else 0.0
+    stats["bytes"] = total_bytes()
+    stats["max_bytes"] = MAX_BYTES
+    return stats
@@ -0,0 +1,115 @@
+import io
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+# Hard cap per uploaded image, enforced while the request body is being read
+MAX_IMAGE_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(16 * 1024 * 1024)))
+# Per bulk request: at most this many images (plain files and archive members together),
+# and at most this many bytes once archives are inflated
+MAX_BULK_MEMBERS = int(os.getenv("UPLOAD_MAX_BULK_MEMBERS", "1000"))
+MAX_BULK_BYTES = int(os.getenv("UPLOAD_MAX_BULK_BYTES", str(1024 * 1024 * 1024)))
+# Set PERSIST_UPLOADS=1 to keep a copy of every original upload (written off the request path)
+PERSIST_UPLOADS = os.getenv("PERSIST_UPLOADS", "0") == "1"
+
+# Leading bytes of the image formats PIL can decode for us
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+SNIFF_BYTES = 12
+
+_PERSIST_EXECUTOR = None
+
+
+class UploadRejected(Exception):
+    """
+    Raised while the upload is still streaming in. Deliberately not a ValueError,
+    so Werkzeug's form parser does not swallow it.
+    """
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def sniff_image_type(header):
+    """Returns the image format from the first bytes of a file, or None."""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    for signature, kind in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return kind
+    return None
+
+
+class CappedImageBuffer(io.BytesIO):
+    """
+    In-memory sink for one uploaded file part.
+    Rejects the upload as soon as the first bytes show it is not an image,
+    or as soon as it grows past max_bytes, without buffering the rest.
+    With strict=False a non-image is only flagged (image_type "unknown"), so a
+    bulk upload can report it per file instead of failing the whole request.
+    """
+
+    def __init__(self, max_bytes=MAX_IMAGE_BYTES, strict=True):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.strict = strict
+        self.image_type = None
+
+    def write(self, data):
+        size = self.tell() + len(data)
+        if size > self.max_bytes:
+            raise UploadRejected(f"Image exceeds the {self.max_bytes // (1024 * 1024)} MB upload limit.", 413)
+
+        written = super().write(data)
+        if self.image_type is None and size >= SNIFF_BYTES:
+            self._sniff()
+        return written
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        # The form parser rewinds the buffer once the part is complete: files shorter than
+        # SNIFF_BYTES are sniffed here (empty parts are left to the "no file" checks)
+        if self.image_type is None and pos == 0 and whence == io.SEEK_SET and self.getbuffer().nbytes:
+            self._sniff()
+        return super().seek(pos, whence)
+
+    def _sniff(self):
+        self.image_type = sniff_image_type(self.getvalue()[:SNIFF_BYTES])
+        if self.image_type is None:
+            if self.strict:
+                raise UploadRejected("Uploaded file is not a supported image.", 415)
+            self.image_type = "unknown"
+
+
+def persist_async(data, filename, folder):
+    """
+    Saves the original upload in the background under a unique name
+    (so concurrent uploads with the same filename never overwrite each other).
+    No-op unless PERSIST_UPLOADS=1.
+    """
+    global _PERSIST_EXECUTOR
+    if not PERSIST_UPLOADS:
+        return None
+    if _PERSIST_EXECUTOR is None:
+        _PERSIST_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-persist")
+
+    target = os.path.join(folder, f"{uuid.uuid4().hex}_{filename}")
+
+    def write():
+        try:
+            with open(target, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            print(f"Upload persist error: {e}")
+
+    _PERSIST_EXECUTOR.submit(write)
+    return target
@@ -1,16 +1,35 @@
 import os
 import sys
+import io
+import json
+import time
+import shutil
+import zipfile
 
 # Add backend to system path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context, send_file, abort
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from backend import ai_engine, data_engine
+from backend import ai_engine, data_engine, uploads
+
+class InMemoryUploadRequest(Flask.request_class):
+    """
+    Keeps uploaded images in memory (size-capped, magic-byte checked while streaming)
+    instead of spooling them to temp files. Zip archives posted to the bulk endpoint
+    keep Werkzeug's default spooled storage; everywhere else they are held to the image checks.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        bulk = self.path == BULK_UPLOAD_PATH
+        if bulk and filename and filename.lower().endswith('.zip'):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return uploads.CappedImageBuffer(strict=not bulk)
+
+BULK_UPLOAD_PATH = '/api/predict_disease/bulk'
 
 # --- Configuration ---
 app = Flask(__name__, static_folder='static', template_folder='templates')
@@ -19,6 +38,8 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['ASSETS_FOLDER'] = '../assets'
 
+app.request_class = InMemoryUploadRequest
+
 # Enable CORS
 CORS(app)
 
@@ -26,6 +47,10 @@ CORS(app)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 db = SQLAlchemy(app)
+
+# Load and warm up the vision model now rather than on the first diagnosis
+from backend import ai_vision
+ai_vision.preload()
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -143,40 +168,255 @@ def scout():
     result = data_engine.get_satellite_map(location)
     return jsonify(result)
 
+@app.errorhandler(uploads.UploadRejected)
+def upload_rejected(e):
+    return jsonify({'error': e.message}), e.status_code
+
 @app.route('/api/predict_disease', methods=['POST'])
 @login_required
 def predict_disease():
+    # Reject oversized bodies from the Content-Length header before reading anything
+    if request.content_length and request.content_length > uploads.MAX_IMAGE_BYTES + 64 * 1024:
+        return jsonify({'error': 'Image exceeds the upload limit.'}), 413
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
         
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
+    if file.filename.lower().endswith('.zip'):
+        return jsonify({'error': f'Archives are only accepted by {BULK_UPLOAD_PATH}.'}), 415
         
     if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
+        # Decode straight from memory; persisting the original (if enabled) happens off the request path
+        data = file.stream.getvalue()
+        uploads.persist_async(data, secure_filename(file.filename), app.config['UPLOAD_FOLDER'])
+
         # Call Vision Engine (Local Model)
         try:
             from backend import ai_vision
-            result = ai_vision.analyze_image(filepath)
+            result = ai_vision.analyze_image(data)
             return jsonify(result)
         except Exception as e:
             import traceback
             traceback.print_exc()
             return jsonify({'error': str(e)}), 500
 
+BULK_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def _detach_uploads(files):
+    """
+    Takes ownership of the uploaded streams so they outlive the view function.
+    Flask closes request.files when the view returns, which is before a streamed
+    response has consumed them.
+    """
+    received = []
+    for file in files:
+        if not file or file.filename == '':
+            continue
+        received.append((file.filename, file.stream))
+        file.stream = io.BytesIO()
+    return received
+
+def _read_member(archive, member, max_bytes=uploads.MAX_IMAGE_BYTES):
+    """
+    One archive member in a size-capped, sniffed buffer. The declared size is checked
+    first and the cap still holds while inflating, so a zip bomb cannot exhaust memory.
+    """
+    if member.file_size > max_bytes:
+        raise uploads.UploadRejected(f"Image exceeds the {max_bytes // (1024 * 1024)} MB upload limit.", 413)
+    buffer = uploads.CappedImageBuffer(max_bytes, strict=False)
+    with archive.open(member) as source:
+        shutil.copyfileobj(source, buffer)
+    buffer.seek(0)
+    return buffer
+
+def _iter_bulk_uploads(received, rejected):
+    """
+    Yields (name, file-like) for every image in the request: plain uploads as-is,
+    and .zip archives member by member (read lazily, one at a time).
+    Files that are too large or not images are appended to `rejected` as (name, message)
+    instead of being yielded. Once the request goes over MAX_BULK_MEMBERS files or
+    MAX_BULK_BYTES inflated, the file that crossed it is rejected and the rest are skipped.
+    """
+    members = 0
+    budget = uploads.MAX_BULK_BYTES
+
+    def over_budget(name):
+        rejected.append((name, f'Bulk upload exceeds {uploads.MAX_BULK_MEMBERS} files or '
+                               f'{uploads.MAX_BULK_BYTES // (1024 * 1024)} MB; this and later files were skipped.'))
+
+    for filename, stream in received:
+        if filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(stream) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or not member.filename.lower().endswith(BULK_IMAGE_EXTENSIONS):
+                        continue
+                    members += 1
+                    limit = min(uploads.MAX_IMAGE_BYTES, budget)
+                    if members > uploads.MAX_BULK_MEMBERS or member.file_size > budget:
+                        over_budget(member.filename)
+                        return
+                    try:
+                        buffer = _read_member(archive, member, limit)
+                    except uploads.UploadRejected as e:
+                        if limit < uploads.MAX_IMAGE_BYTES:
+                            over_budget(member.filename)
+                            return
+                        rejected.append((member.filename, e.message))
+                        continue
+                    budget -= buffer.getbuffer().nbytes
+                    if buffer.image_type in (None, 'unknown'):
+                        rejected.append((member.filename, 'Not a supported image.'))
+                        continue
+                    yield member.filename, buffer
+            continue
+        members += 1
+        size = stream.getbuffer().nbytes
+        if members > uploads.MAX_BULK_MEMBERS or size > budget:
+            over_budget(secure_filename(filename))
+            return
+        budget -= size
+        if getattr(stream, 'image_type', None) in (None, 'unknown'):
+            rejected.append((secure_filename(filename), 'Not a supported image.'))
+        else:
+            yield secure_filename(filename), stream
+
+@app.route(BULK_UPLOAD_PATH, methods=['POST'])
+@login_required
+def predict_disease_bulk():
+    """
+    Bulk diagnosis. Accepts many 'files' (multipart) and/or a zip 'archive'.
+    Streams one NDJSON line per image as soon as it is classified, then a summary line.
+    """
+    received = _detach_uploads(request.files.getlist('files') + request.files.getlist('archive'))
+    if not received:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    farm_id = request.form.get('farm_id', 'default')
+
+    from backend import ai_vision
+
+    def generate():
+        class_counts = {}
+        confidence_total = 0.0
+        processed = 0
+        errors = 0
+        rejected = []
+
+        def drain_rejected():
+            while rejected:
+                name, message = rejected.pop(0)
+                yield json.dumps({'type': 'result', 'file': name, 'status': 'error', 'error': message}) + '\n'
+
+        try:
+            for name, result in ai_vision.analyze_batch(_iter_bulk_uploads(received, rejected)):
+                errors += len(rejected)
+                yield from drain_rejected()
+                if result.get('status') == 'error':
+                    errors += 1
+                else:
+                    processed += 1
+                    disease = result['detected_disease']
+                    class_counts[disease] = class_counts.get(disease, 0) + 1
+                    confidence_total += result['confidence']
+                yield json.dumps({'type': 'result', 'file': name, **result}) + '\n'
+            errors += len(rejected)
+            yield from drain_rejected()
+        except zipfile.BadZipFile as e:
+            errors += 1
+            yield json.dumps({'type': 'error', 'error': f'Invalid archive: {e}'}) + '\n'
+        finally:
+            for _, stream in received:
+                stream.close()
+
+        yield json.dumps({
+            'type': 'summary',
+            'farm_id': farm_id,
+            'images': processed + errors,
+            'classified': processed,
+            'errors': errors,
+            'class_counts': class_counts,
+            'mean_confidence': (confidence_total / processed) if processed else 0.0
+        }) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/prescription/<job_id>', methods=['GET'])
+@login_required
+def prescription_status(job_id):
+    """
+    Polling endpoint for the background Gemini prescription of a diagnosis.
+    Pass ?wait=<seconds> (max 30) to long-poll until it is ready.
+    """
+    from backend import prescription_jobs
+
+    wait_s = min(request.args.get('wait', 0, type=float), 30.0)
+    job = prescription_jobs.wait(job_id, wait_s) if wait_s > 0 else prescription_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired prescription job'}), 404
+    return jsonify(job)
+
+@app.route('/api/prescription/<job_id>/events', methods=['GET'])
+@login_required
+def prescription_events(job_id):
+    """
+    Server-sent events: one 'prescription' event once the job finishes (keep-alive comments until then).
+    """
+    from backend import prescription_jobs
+
+    if prescription_jobs.get_job(job_id) is None:
+        return jsonify({'error': 'Unknown or expired prescription job'}), 404
+
+    def generate():
+        deadline = time.monotonic() + 60
+        while True:
+            job = prescription_jobs.wait(job_id, 15)
+            if job is None:
+                yield 'event: error\ndata: {"error": "expired"}\n\n'
+                return
+            if job['status'] != 'pending' or time.monotonic() >= deadline:
+                yield f"event: prescription\ndata: {json.dumps(job)}\n\n"
+                return
+            yield ': keep-alive\n\n'
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _wants_stream():
+    return request.args.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+
+def _advice_events(disease, ndvi, language='en'):
+    """
+    Server-sent events for a treatment plan: 'chunk' events carry Markdown as Gemini writes it,
+    then one 'done' event (full result) or 'fallback' event (complete plan replacing the partial text).
+    """
+    def generate():
+        try:
+            for event, payload in data_engine.stream_advice(disease, ndvi, language):
+                data = {'text': payload} if event == 'chunk' else payload
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            print(f"Advice Stream Error: {e}")
+            yield 'event: error\ndata: {"error": "Failed to generate advice"}\n\n'
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/advice', methods=['POST'])
 @login_required
 def advice():
+    """Returns the plan as JSON, or as server-sent events with ?stream=1 / Accept: text/event-stream."""
     data = request.json
     disease = data.get('disease')
     ndvi = data.get('ndvi', 'Unknown')
+    language = data.get('language', 'en')
+    if _wants_stream():
+        return _advice_events(disease, ndvi, language)
     
     # Call Data Engine
-    result = data_engine.get_advice(disease, ndvi)
+    result = data_engine.get_advice(disease, ndvi, language)
     return jsonify(result)
 
 @app.route('/api/scout_info', methods=['POST'])
@@ -187,74 +427,63 @@ def scout_info():
     lat = data.get('lat')
     lon = data.get('lon')
     
-    from geopy.geocoders import Nominatim
+    from backend import agri_data, geocoding
     
     try:
-        coords = None
+        # Resolve once (coords need no network; a name costs one cached geocode),
+        # then hand the same location to every stage
+        location = geocoding.resolve(place_name, lat, lon)
         
-        if lat and lon:
-            coords = (float(lat), float(lon))
-            if not place_name:
-                place_name = "Current Location"
-        else:
-            geolocator = Nominatim(user_agent="open_agri_os_v5")
-            location = geolocator.geocode(place_name)
-            if location:
-                coords = (location.latitude, location.longitude)
-        
-        if coords:
-            # Mock Weather (Simulated for now, could be API later)
-            weather = {
-                "temp": 28,
-                "condition": "Sunny",
-                "humidity": 60,
-                "forecast": "Good day."
-            }
+        if location:
+            weather = agri_data.get_weather(location)
             
             # Dynamic AI Recommendation
             language = data.get('language', 'en')
-            rec = data_engine.get_crop_recommendation(place_name, weather, language)
+            rec = data_engine.get_crop_recommendation(location, weather, language)
             
             # Map
-            # Pass coords to get_satellite_map if it supports it, or just place_name
-            # data_engine.get_satellite_map currently takes a location string. 
-            # We might need to update it to take coords or just pass the name.
-            # For now, let's pass the name, but we might want to update data_engine too if it relies on geocoding.
-            # Actually, looking at data_engine.py (from memory/context), it takes a location string.
-            # Let's check data_engine.py again to be sure.
-            
-            # Wait, if I pass "Current Location" to data_engine, it might fail if it tries to geocode it.
-            # Let's check data_engine.py content from previous turns.
-            # It accepts `location` (string) or `coords` (tuple)?
-            # In step 2208 summary: "The function now accepts either coordinates or a location name".
-            # So I can pass coords to it.
-            
-            map_data = data_engine.get_satellite_map(coords if lat and lon else place_name)
+            map_data = data_engine.get_satellite_map(location) or {}
             
             return jsonify({
-                'coords': coords,
+                'coords': location.coords,
+                'location': location.to_dict(),
                 'recommendation': rec,
                 'weather': weather,
                 'ndvi': {
                     'status': 'success', 
                     'image_path': map_data.get('image_url'),
-                    'bbox': map_data.get('bbox')
+                    'bbox': map_data.get('bbox'),
+                    'mean': map_data.get('ndvi_mean'),
+                    'stats': map_data.get('ndvi_stats'),
+                    'tiles': map_data.get('tiles')
                 } 
             })
         return jsonify({'error': 'Location not found'}), 404
+    except geocoding.GeocoderBusy as e:
+        return _geocoder_busy(e)
     except Exception as e:
         print(e)
         return jsonify({'error': 'Geocoding error'}), 500
 
+def _geocoder_busy(e):
+    # Throttled, not missing: the client should retry rather than give up on the place
+    from backend import geocoding
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(max(1, int(geocoding.MAX_THROTTLE_WAIT_S)))
+    return response, 503
+
 @app.route('/api/get_advice', methods=['POST'])
 def get_advice():
     try:
         data = request.json
         disease = data.get('disease')
         ndvi = data.get('ndvi')
+        language = data.get('language', 'en')
+        if _wants_stream():
+            return _advice_events(disease, ndvi, language)
         
         # Call data engine to get advice (real or mock)
-        advice = data_engine.get_advice(disease, ndvi)
+        advice = data_engine.get_advice(disease, ndvi, language)
         
         return jsonify(advice)
     except Exception as e:
@@ -264,14 +493,87 @@ def get_advice():
 @app.route('/api/expert-contact', methods=['POST'])
 @login_required
 def expert_contact():
-    data = request.json
+    data = request.json or {}
     lat = data.get('lat')
     lon = data.get('lon')
     
-    # In a real app, we would validate lat/lon
+    # get_govt_contacts builds the location itself, so missing or malformed
+    # coordinates fall back to the national helpline instead of a 500
     contacts = data_engine.get_govt_contacts(lat, lon)
     return jsonify(contacts)
 
+@app.route('/tiles/cache/<name>', methods=['GET'])
+def cached_tile(name):
+    # Content-addressed satellite renders: a name never changes, so clients may cache it for good
+    from backend import tile_cache
+    path = tile_cache.file_path(name)
+    if path is None or not os.path.exists(path):
+        abort(404)
+    response = send_file(path, max_age=tile_cache.MAX_AGE_S)
+    response.headers['Cache-Control'] = f'public, max-age={tile_cache.MAX_AGE_S}, immutable'
+    return response
+
+@app.route('/api/ndvi_history', methods=['POST'])
+@login_required
+def ndvi_history():
+    # Trend, anomaly and season comparison from the stored per-field series
+    from backend import geocoding, ndvi_history
+    data = request.json or {}
+    try:
+        location = geocoding.resolve(data.get('place_name'), data.get('lat'), data.get('lon'))
+    except geocoding.GeocoderBusy as e:
+        return _geocoder_busy(e)
+    if not location:
+        return jsonify({'error': 'Location not found'}), 404
+    result = ndvi_history.get_history(location.lat, location.lon)
+    result['location'] = location.to_dict()
+    return jsonify(result)
+
+@app.route('/tiles/ndvi/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+@login_required
+def ndvi_tile(z, x, y):
+    # XYZ NDVI tiles for Leaflet, rendered from cached Sentinel-2 source rasters
+    from backend import ndvi_tiles, tile_cache
+    pinned = bool(request.args.get('to'))
+    try:
+        window = ndvi_tiles.window_for(request.args.get('to'))
+        entry = ndvi_tiles.render_tile(z, x, y, window)
+    except ValueError:
+        abort(404)
+    except ndvi_tiles.TileUnavailable as e:
+        print(f"NDVI tile {z}/{x}/{y} unavailable: {e}")
+        # A partly built tile is shown as far as it goes, but only briefly, like an empty one
+        content = getattr(e, 'content', None) or ndvi_tiles.empty_tile()
+        response = Response(content, mimetype='image/png')
+        response.headers['Cache-Control'] = f'public, max-age={ndvi_tiles.MIN_MAX_AGE_S}'
+        return response
+    max_age = ndvi_tiles.max_age(window, pinned)
+    response = send_file(tile_cache.file_path(entry['name']), mimetype='image/png',
+                         etag=tile_cache.etag(entry), max_age=max_age, conditional=True)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}' + (', immutable' if ndvi_tiles.immutable(pinned) else '')
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+@login_required
+def metrics():
+    # Cache sizes, token/config state and traffic counters: not for anonymous callers
+    from backend import ai_vision, prescription_jobs, llm_cache, llm_client, single_flight, advice_corpus, geocoding, district_index, sentinel_auth, tile_cache, ndvi_tiles, ndvi_history, local_rasters
+    return jsonify({
+        'vision': ai_vision.get_stats(),
+        'prescriptions': prescription_jobs.get_stats(),
+        'llm_cache': llm_cache.get_stats(),
+        'llm_client': llm_client.get_stats(),
+        'single_flight': single_flight.get_stats(),
+        'advice_corpus': advice_corpus.get_stats(),
+        'geocoding': geocoding.get_stats(),
+        'district_index': district_index.get_stats(),
+        'sentinel_auth': sentinel_auth.get_stats(),
+        'tile_cache': tile_cache.get_stats(),
+        'ndvi_tiles': ndvi_tiles.get_stats(),
+        'ndvi_history': ndvi_history.get_stats(),
+        'local_rasters': local_rasters.get_stats()
+    })
+
 # --- Main ---
 if __name__ == '__main__':
     with app.app_context():
@@ -94,8 +94,19 @@ document.addEventListener('DOMContentLoaded', () => {
         addMarker: function (lat, lon, text) {
             L.marker([lat, lon]).addTo(this.map).bindPopup(text).openPopup();
         },
-        addNDVILayer: function (url, bounds) {
+        addNDVILayer: function (url, bounds, tiles) {
             this.ndviLayerGroup.clearLayers();
+            if (tiles && tiles.url) {
+                // Tile pyramid: panning and zooming only fetch the new tiles
+                L.tileLayer(tiles.url, {
+                    minZoom: tiles.min_zoom,
+                    maxNativeZoom: tiles.max_zoom,
+                    maxZoom: 19,
+                    opacity: 0.7
+                }).addTo(this.ndviLayerGroup);
+                showToast("NDVI Heatmap Loaded", "success");
+                return;
+            }
             // Use map bounds if in NDVI mode to cover view
             const overlayBounds = this.currentMode === 'ndvi' ? this.map.getBounds() : bounds;
             L.imageOverlay(url, overlayBounds, { opacity: 0.7, interactive: true }).addTo(this.ndviLayerGroup);
@@ -215,7 +226,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
                     // Update NDVI
                     if (data.ndvi && data.ndvi.image_path) {
-                        AgriMap.addNDVILayer(data.ndvi.image_path, data.ndvi.bbox);
+                        AgriMap.addNDVILayer(data.ndvi.image_path, data.ndvi.bbox, data.ndvi.tiles);
                     }
 
                     // Update Advice UI
@@ -234,12 +245,23 @@ document.addEventListener('DOMContentLoaded', () => {
 
                     const rec = data.recommendation || DEFAULT_CROP_DATA;
 
+                    // Field health measured from the satellite bands (raw NDVI mode only)
+                    const stats = data.ndvi && data.ndvi.stats;
+                    let fieldHealth = '';
+                    if (stats && stats.mean !== null && stats.classes) {
+                        const pct = (v) => Math.round(v * 100);
+                        fieldHealth = `<p><strong>Field NDVI:</strong> ${stats.mean.toFixed(2)} (${stats.status}) ·
+                            ${pct(stats.classes.stressed + stats.classes.bare)}% stressed or bare ·
+                            ${pct(stats.cloud_fraction)}% cloud</p>`;
+                    }
+
                     contentDiv.innerHTML = `
                         <div class="advice-card">
                             <h4>Recommended Crop: ${rec.crop || DEFAULT_CROP_DATA.crop}</h4>
                             <p><strong>Season:</strong> ${rec.season || DEFAULT_CROP_DATA.season}</p>
                             <p><strong>Soil Type:</strong> ${rec.soil || DEFAULT_CROP_DATA.soil}</p>
                             <p><strong>Water:</strong> ${rec.water || DEFAULT_CROP_DATA.water}</p>
+                            ${fieldHealth}
                             <p class="reason">"${rec.reason || DEFAULT_CROP_DATA.reason}"</p>
                         </div>
                     `;
@@ -397,18 +419,47 @@ document.addEventListener('DOMContentLoaded', () => {
             try {
                 const response = await fetch('http://127.0.0.1:5000/api/get_advice', {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
+                    headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
                     body: JSON.stringify({ disease: disease, ndvi: "Critical" })
                 });
-                const data = await response.json();
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
 
+                const content = document.getElementById('treatment-plan-content');
+                const render = (markdown) => {
+                    content.innerHTML = markdown.replace(/\*\*(.*?)\*\*/g, '<b>$1</b>').replace(/\n/g, '<br>');
+                };
+                content.innerHTML = '';
                 document.getElementById('treatment-modal').classList.remove('hidden');
-                const htmlAdvice = data.advice.replace(/\*\*(.*?)\*\*/g, '<b>$1</b>').replace(/\n/g, '<br>');
-                document.getElementById('treatment-plan-content').innerHTML = htmlAdvice;
-
                 document.querySelector('.close-modal').onclick = () => {
                     document.getElementById('treatment-modal').classList.add('hidden');
                 };
+
+                // Render the plan chunk by chunk as server-sent events arrive
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffered = '';
+                let markdown = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffered += decoder.decode(value, { stream: true });
+                    const events = buffered.split('\n\n');
+                    buffered = events.pop();
+                    for (const raw of events) {
+                        const event = (raw.match(/^event: (.*)$/m) || [])[1];
+                        const data = (raw.match(/^data: (.*)$/m) || [])[1];
+                        if (!event || !data) continue;
+                        const payload = JSON.parse(data);
+                        if (event === 'chunk') {
+                            markdown += payload.text;
+                        } else if (event === 'done' || event === 'fallback') {
+                            markdown = payload.advice;
+                        } else if (event === 'error') {
+                            throw new Error(payload.error);
+                        }
+                        render(markdown);
+                    }
+                }
             } catch (e) {
                 console.error(e);
                 showToast("Error fetching treatment", "error");
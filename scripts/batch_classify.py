@@ -0,0 +1,201 @@
+import os
+import re
+import sys
+import csv
+import time
+import difflib
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Add repo root to system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import ai_vision, image_pipeline
+
+# --- Configuration ---
+BATCH_SIZE = 64
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def find_images(root):
+    """
+    Walks the tree and returns sorted [(path, folder name relative to root)].
+    """
+    images = []
+    for dirpath, _, filenames in os.walk(root):
+        folder = os.path.relpath(dirpath, root)
+        for name in filenames:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((os.path.join(dirpath, name), folder))
+    images.sort()
+    return images
+
+def _normalize(name):
+    return re.sub(r'[^a-z]', '', name.lower()).replace('tomato', '')
+
+def map_folders_to_classes(folders, class_names):
+    """
+    Maps folder names like 'Tomato___Leaf_Mold' or 'tomato early blight' onto model class names.
+    Returns {folder: class index} for folders that could be matched.
+    """
+    normalized = [_normalize(c) for c in class_names]
+    mapping = {}
+    for folder in folders:
+        key = _normalize(os.path.basename(folder))
+        if not key:
+            continue
+        match = next((i for i, c in enumerate(normalized) if c in key or key in c), None)
+        if match is None:
+            close = difflib.get_close_matches(key, normalized, n=1, cutoff=0.6)
+            match = normalized.index(close[0]) if close else None
+        if match is not None:
+            mapping[folder] = match
+    return mapping
+
+def _decode_rows(shm_name, shape, start, paths):
+    """
+    Worker: decodes `paths` straight into rows [start, start + len(paths)) of the shared batch buffer.
+    Returns the list of row offsets that failed to decode.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        batch = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        failed = []
+        for i, path in enumerate(paths):
+            try:
+                image_pipeline.preprocess_into(path, batch[start + i], ai_vision.IMG_SIZE)
+            except Exception as e:
+                print(f"Decode failed for {path}: {e}")
+                failed.append(start + i)
+        del batch
+        return failed
+    finally:
+        shm.close()
+
+def _submit_batch(pool, shm, shape, paths, workers):
+    """Splits one batch across the pool, each worker filling a contiguous slice of rows."""
+    step = max(1, -(-len(paths) // workers))
+    return [pool.submit(_decode_rows, shm.name, shape, i, paths[i:i + step]) for i in range(0, len(paths), step)]
+
+def write_rows(rows, output_path):
+    fieldnames = ["path", "folder", "predicted_class", "confidence", "true_class", "correct"]
+    if output_path.lower().endswith('.parquet'):
+        try:
+            import pandas as pd
+        except ImportError:
+            print("Error: Writing Parquet needs pandas + pyarrow (pip install pandas pyarrow).")
+            return False
+        pd.DataFrame(rows, columns=fieldnames).to_parquet(output_path, index=False)
+    else:
+        with open(output_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+    return True
+
+def print_confusion_matrix(matrix, class_names):
+    labels = [str(i) for i in range(len(class_names))]
+    print("\n--- Confusion Matrix (rows = true, cols = predicted) ---")
+    for i, name in enumerate(class_names):
+        print(f"{i}: {name}")
+    width = max(5, len(str(int(matrix.max()))) + 1)
+    print("    " + "".join(l.rjust(width) for l in labels))
+    for i, row in enumerate(matrix):
+        print(labels[i].rjust(3) + " " + "".join(str(int(v)).rjust(width) for v in row))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch disease classifier over an image directory tree.")
+    parser.add_argument("root", help="Directory to scan, e.g. 'sample for mobilenetv2' or a nightly capture folder")
+    parser.add_argument("-o", "--output", default="predictions.csv", help="Output .csv or .parquet")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Decode processes")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"Error: Directory not found at {args.root}")
+        return
+
+    images = find_images(args.root)
+    if not images:
+        print(f"No images found under {args.root}")
+        return
+
+    predict_fn = ai_vision.get_predict_fn()
+    if predict_fn is None:
+        print("Error: No model available (see VISION_BACKEND / model.keras).")
+        return
+
+    # Label names follow the model's output width, without the demo randomization of analyze_image
+    num_outputs = predict_fn(np.zeros((1, 224, 224, 3), dtype=np.float32)).shape[1]
+    class_names = ai_vision._class_names_for(num_outputs)
+    folder_classes = map_folders_to_classes(sorted({folder for _, folder in images}), class_names)
+    if folder_classes:
+        print("Folder -> class mapping:")
+        for folder, index in folder_classes.items():
+            print(f"  {folder} -> {class_names[index]}")
+
+    print(f"\nScoring {len(images)} images with {args.workers} decode workers, batch size {args.batch_size}\n")
+
+    shape = (args.batch_size, ai_vision.IMG_SIZE[1], ai_vision.IMG_SIZE[0], 3)
+    nbytes = int(np.prod(shape)) * 4
+    buffers = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(2)]
+    rows = []
+    matrix = np.zeros((len(class_names), len(class_names)), dtype=np.int64)
+    started = time.perf_counter()
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            chunks = [images[i:i + args.batch_size] for i in range(0, len(images), args.batch_size)]
+            pending = _submit_batch(pool, buffers[0], shape, [p for p, _ in chunks[0]], args.workers)
+
+            for k, chunk in enumerate(chunks):
+                failed = set()
+                for future in pending:
+                    failed.update(future.result())
+
+                # Decode the next batch into the other buffer while this one is in the model
+                if k + 1 < len(chunks):
+                    pending = _submit_batch(pool, buffers[(k + 1) % 2], shape, [p for p, _ in chunks[k + 1]], args.workers)
+
+                batch = np.ndarray(shape, dtype=np.float32, buffer=buffers[k % 2].buf)[:len(chunk)]
+                probabilities = predict_fn(batch)
+                del batch
+
+                for i, (path, folder) in enumerate(chunk):
+                    if i in failed:
+                        continue
+                    predicted = int(np.argmax(probabilities[i]))
+                    true_index = folder_classes.get(folder)
+                    if true_index is not None:
+                        matrix[true_index, predicted] += 1
+                    rows.append({
+                        "path": path,
+                        "folder": folder,
+                        "predicted_class": class_names[predicted],
+                        "confidence": float(probabilities[i][predicted]),
+                        "true_class": class_names[true_index] if true_index is not None else "",
+                        "correct": (predicted == true_index) if true_index is not None else "",
+                    })
+
+                done = min((k + 1) * args.batch_size, len(images))
+                rate = done / (time.perf_counter() - started)
+                print(f"\r{done}/{len(images)} images  {rate:.1f} img/s", end="", flush=True)
+    finally:
+        for shm in buffers:
+            shm.close()
+            shm.unlink()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n\nScored {len(rows)} images in {elapsed:.1f} s ({len(rows) / elapsed:.1f} images/sec)")
+    print(f"Skipped (decode errors): {len(images) - len(rows)}")
+
+    if write_rows(rows, args.output):
+        print(f"Predictions written to {args.output}")
+
+    labelled = int(matrix.sum())
+    if labelled:
+        print(f"Top-1 accuracy on {labelled} labelled images: {np.trace(matrix) / labelled:.4f}")
+        print_confusion_matrix(matrix, class_names)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# Add repo root to system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import ai_vision
+
+# --- Configuration ---
+WARMUP_RUNS = 5
+TIMED_RUNS = 200
+
+def time_calls(fn, batch, runs):
+    """Returns per-call latencies in milliseconds."""
+    for _ in range(WARMUP_RUNS):
+        fn(batch)
+    latencies = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn(batch)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    return np.array(latencies)
+
+def report(name, latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:28s} p50={p50:7.2f} ms  p95={p95:7.2f} ms  p99={p99:7.2f} ms")
+    return p50
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-image inference latency: model.predict vs compiled path.")
+    parser.add_argument("--runs", type=int, default=TIMED_RUNS)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--cold", action="store_true",
+                        help="Time start-up and the first request instead (run in a fresh process)")
+    args = parser.parse_args()
+
+    batch = np.random.uniform(-1, 1, (args.batch, 224, 224, 3)).astype(np.float32)
+    t0 = time.perf_counter()
+    model = ai_vision.load_model()
+    load_ms = (time.perf_counter() - t0) * 1000.0
+    if model is None:
+        print("Error: No model available (see VISION_BACKEND / model.keras).")
+        return
+
+    if args.cold:
+        t0 = time.perf_counter()
+        ai_vision.get_predict_fn()(batch)
+        first_ms = (time.perf_counter() - t0) * 1000.0
+        warmup_ms = ai_vision.get_stats()["warmup_ms"] or 0.0
+        print(f"load_model (incl. warm-up {warmup_ms:.0f} ms): {load_ms:.0f} ms")
+        print(f"first request, warmed at load:      {first_ms:.1f} ms")
+        print(f"first request, warmed on request:   {first_ms + warmup_ms:.1f} ms (previous behaviour)")
+        return
+
+    print(f"Backend: {os.getenv('VISION_BACKEND', 'keras')}, batch={args.batch}, runs={args.runs}\n")
+
+    before = report("model.predict (before)", time_calls(lambda b: model.predict(b, verbose=0), batch, args.runs))
+    after = report("compiled predict_fn (after)", time_calls(ai_vision.get_predict_fn(), batch, args.runs))
+
+    batcher = ai_vision._get_batcher()
+    sample = batch[0]
+    report("via batch engine", time_calls(lambda _: batcher.predict(sample), None, args.runs))
+
+    print(f"\nSpeed-up at p50: {before / after:.1f}x")
+
+if __name__ == '__main__':
+    main()
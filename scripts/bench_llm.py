@@ -0,0 +1,87 @@
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Measure the LLM path itself: no response cache, no precomputed corpus
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("ADVICE_CORPUS", "0")
+# Fallback errors under load go to a scratch log, not the repo's debug_log.txt
+os.environ.setdefault("DEBUG_LOG_PATH", os.path.join(tempfile.gettempdir(), "bench_llm_debug_log.txt"))
+
+# Add repo root to system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import data_engine, ai_engine, llm_client
+
+# --- Configuration ---
+REQUESTS = 200
+CONCURRENCY = 32
+WORKLOADS = ("advice", "crop", "diagnosis", "stream")
+
+def make_image():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (224, 224), (60, 140, 60)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def run_one(workload, i, image_bytes):
+    """
+    Returns (seconds, served by the LLM rather than a fallback).
+    For "stream" the seconds are the time to first chunk, or None if the stream failed before one.
+    """
+    t0 = time.perf_counter()
+    if workload == "stream":
+        ttfc = None
+        ok = False
+        try:
+            for _ in llm_client.generate_stream(f"Give a 3-step treatment plan for Leaf Spot {i}."):
+                if ttfc is None:
+                    ttfc = time.perf_counter() - t0
+            ok = True
+        except Exception:
+            pass
+        return ttfc, ok
+    if workload == "advice":
+        # Distinct diseases so single-flight does not coalesce the load away
+        result = data_engine.get_advice(f"Leaf Spot {i}", 0.3)
+        ok = result.get("source", "").startswith("Google Gemini")
+    elif workload == "crop":
+        result = data_engine.get_crop_recommendation(f"Village {i}", {"temp": 28, "condition": "Sunny"})
+        ok = "crop" in result
+    else:
+        result = ai_engine.predict_disease(io.BytesIO(image_bytes))
+        ok = "(Demo)" not in result["detected_disease"]
+    return time.perf_counter() - t0, ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the LLM-backed endpoints' backend functions.")
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--workload", choices=WORKLOADS, action="append")
+    args = parser.parse_args()
+
+    print(f"Provider: {llm_client.get_provider().name}  "
+          f"(max in flight {llm_client.MAX_IN_FLIGHT}, queue timeout {llm_client.QUEUE_TIMEOUT_S}s)")
+    image_bytes = make_image()
+    for workload in args.workload or WORKLOADS:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda i: run_one(workload, i, image_bytes), range(args.requests)))
+        wall = time.perf_counter() - start
+        # Streams that failed before their first chunk have no latency; they are counted, not averaged in
+        latencies = np.array([r[0] for r in results if r[0] is not None]) * 1000.0
+        failed_early = sum(1 for r in results if r[0] is None)
+        served = sum(1 for r in results if r[1])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies.size else (float("nan"),) * 3
+        label = "ttfc " if workload == "stream" else ""
+        print(f"{workload:10s} {label}p50={p50:7.0f} ms  p95={p95:7.0f} ms  p99={p99:7.0f} ms  "
+              f"LLM-served {served / len(results):6.1%}  {len(results) / wall:6.1f} req/s"
+              + (f"  errors before first chunk {failed_early}" if workload == "stream" else ""))
+    print(f"\nClient stats: {llm_client.get_stats()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import numpy as np
+
+# --- Configuration ---
+# Synthetic Sentinel-2 L2A scene: UTM zone 43N (Karnataka), 10 m B04/B08, 20 m SCL
+EPSG = 32643
+ORIGIN = (600000.0, 1700040.0)
+SIZE = 5490          # pixels per side at 10 m (half a Sentinel-2 granule)
+FIELDS = 200
+REPEATS = 3
+SCALE, OFFSET = 0.0001, -0.1
+
+# The archive and the tile cache live in a scratch directory unless given
+_workdir = tempfile.mkdtemp(prefix="bench_local_ndvi_")
+os.environ.setdefault("LOCAL_RASTER_DIR", os.path.join(_workdir, "rasters"))
+os.environ.setdefault("TILE_CACHE_DIR", os.path.join(_workdir, "tiles"))
+os.environ.setdefault("TILE_CACHE_DB", os.path.join(_workdir, "tile_cache.db"))
+os.environ.setdefault("SINGLE_FLIGHT_DB", os.path.join(_workdir, "single_flight.db"))
+os.environ["SATELLITE_SOURCE"] = "local"
+
+# Add repo root to system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import local_rasters, ndvi_stats, tile_cache
+
+def make_scene(directory, size, seed=0):
+    """B04 as .npy, B08 and SCL as strip GeoTIFFs, with a field pattern and a cloud bank."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:size, 0:size]
+    vigor = 0.5 + 0.4 * np.sin(rows / 37.0) * np.cos(cols / 53.0)
+    b08 = (0.25 + 0.2 * vigor + rng.normal(0, 0.01, (size, size)) - OFFSET) / SCALE
+    b04 = (0.12 - 0.08 * vigor + rng.normal(0, 0.005, (size, size)) - OFFSET) / SCALE
+    scl = np.full((size // 2, size // 2), 4, dtype=np.uint8)
+    scl[: size // 8, : size // 6] = 9
+
+    np.save(os.path.join(directory, "B04.npy"), b04.clip(0, 65535).astype(np.uint16))
+    local_rasters.write_strip_tiff(os.path.join(directory, "B08.tif"), b08.clip(0, 65535).astype(np.uint16),
+                                   [ORIGIN[0], 10.0, ORIGIN[1], 10.0], EPSG)
+    local_rasters.write_strip_tiff(os.path.join(directory, "SCL.tif"), scl,
+                                   [ORIGIN[0], 20.0, ORIGIN[1], 20.0], EPSG)
+    today = datetime.date.today()
+    meta = {
+        "id": f"BENCH_{today:%Y%m%d}", "date": today.isoformat(), "cloud_cover": 4.0,
+        "crs": f"EPSG:{EPSG}", "transform": [ORIGIN[0], 10.0, ORIGIN[1], 10.0],
+        "scale": SCALE, "offset": OFFSET,
+        "bands": {"B04": "B04.npy", "B08": "B08.tif", "SCL": "SCL.tif"},
+    }
+    with open(os.path.join(directory, "scene.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+def lonlat_bounds(scene):
+    """Lon/lat box around the scene: exact for EPSG:4326/3857, approximate (spherical inverse) for UTM."""
+    min_x, min_y, max_x, max_y = scene.bounds
+    if not (32601 <= scene.epsg <= 32660 or 32701 <= scene.epsg <= 32760):
+        (lon0, lat0), (lon1, lat1) = (local_rasters.to_lonlat(x, y, scene.epsg) for x, y in ((min_x, min_y), (max_x, max_y)))
+        return lon0, lat0, lon1, lat1
+    central = (scene.epsg % 100) * 6 - 183
+    false_northing = 10000000.0 if scene.epsg > 32700 else 0.0
+    lat0, lat1 = ((y - false_northing) / 110574.0 for y in (min_y, max_y))
+    # Widest at the latitude nearest the equator; the covers() check trims the excess
+    meters_per_deg = 111320.0 * np.cos(np.radians(min(abs(lat0), abs(lat1)) if lat0 * lat1 > 0 else 0.0))
+    lon0, lon1 = (central + (x - 500000.0) / meters_per_deg for x in (min_x, max_x))
+    pad = 0.05 * max(lat1 - lat0, lon1 - lon0)
+    return lon0 - pad, lat0 - pad, lon1 + pad, lat1 + pad
+
+def random_fields(scene, n, seed=1, max_attempts=100):
+    """Field bboxes (snapped like scouts) lying fully inside the scene."""
+    rng = random.Random(seed)
+    # Sample centers around the scene, wherever it is, and keep fields whose corners are covered
+    min_lon, min_lat, max_lon, max_lat = lonlat_bounds(scene)
+    fields = []
+    for _ in range(n * max_attempts):
+        if len(fields) == n:
+            break
+        bbox = tile_cache.field_bbox(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon))
+        if all(scene.covers(x, y) for x in (bbox[0], bbox[2]) for y in (bbox[1], bbox[3])):
+            fields.append(bbox)
+    if len(fields) < n:
+        sys.exit(f"Scene {scene.id} is too small to place {n} fields ({len(fields)} fit)")
+    return fields
+
+def percentiles(samples):
+    p50, p95 = np.percentile(np.array(samples) * 1000.0, [50, 95])
+    return f"p50={p50:7.2f} ms  p95={p95:7.2f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline NDVI from the local raster archive.")
+    parser.add_argument("--size", type=int, default=SIZE, help="scene width/height in 10 m pixels")
+    parser.add_argument("--fields", type=int, default=FIELDS)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    scene_dir = os.path.join(local_rasters.RASTER_DIR, "bench")
+    if not os.path.exists(os.path.join(scene_dir, "scene.json")):
+        t0 = time.perf_counter()
+        make_scene(scene_dir, args.size)
+        print(f"Generated {args.size}x{args.size} scene in {time.perf_counter() - t0:.1f}s -> {scene_dir}")
+    scenes = local_rasters.get_scenes()
+    if not scenes:
+        sys.exit(f"No scenes in {local_rasters.RASTER_DIR}")
+    scene = scenes[0]
+    window = tile_cache.time_window()
+    fields = random_fields(scene, args.fields)
+
+    # Windowed reads straight from the memory maps / TIFF strips
+    reads = []
+    for _ in range(args.repeats):
+        for bbox in fields:
+            t0 = time.perf_counter()
+            ndvi_stats.compute_ndvi(*local_rasters.read_bands(scene, bbox))
+            reads.append(time.perf_counter() - t0)
+    print(f"windowed read + NDVI  {percentiles(reads)}")
+
+    # Baseline: what a whole-band load costs per field without windowing
+    t0 = time.perf_counter()
+    np.load(os.path.join(scene.directory, scene.band_files["B04"]))
+    print(f"full B04 load         {(time.perf_counter() - t0) * 1000:7.2f} ms (per field, per band, unwindowed)")
+
+    # End to end: overlay + statistics, first render then tile-cache hits
+    first, cached = [], []
+    for bbox in fields:
+        t0 = time.perf_counter()
+        local_rasters.render_field(bbox, window)
+        first.append(time.perf_counter() - t0)
+    for bbox in fields:
+        t0 = time.perf_counter()
+        local_rasters.render_field(bbox, window)
+        cached.append(time.perf_counter() - t0)
+    print(f"render_field (cold)   {percentiles(first)}")
+    print(f"render_field (cached) {percentiles(cached)}")
+    print(f"\nLocal raster stats: {local_rasters.get_stats()}")
+
+if __name__ == '__main__':
+    main()
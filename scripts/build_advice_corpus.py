@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Add repo root to system path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import ai_vision, data_engine, llm_client, advice_corpus
+
+# --- Configuration ---
+WORKERS = 4
+# Gemini free tier allows 15 requests per minute
+REQUESTS_PER_SECOND = 0.25
+# Extra passes over entries that failed (rate limited, timed out)
+RETRY_PASSES = 2
+SOURCE_LABEL = "Google Gemini 1.5 Flash (Precomputed)"
+
+class RateLimiter:
+    """Spaces calls evenly at `rate` per second across all worker threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+def input_space(languages):
+    """Every (disease, NDVI status, language) the live advice path can be asked for."""
+    diseases = sorted(set(ai_vision.CLASS_NAMES) | set(ai_vision.LEGACY_CLASS_NAMES))
+    return [(d, n, l) for d in diseases for n in advice_corpus.NDVI_STATUSES for l in languages]
+
+def load_existing(path):
+    """Rows of a previous corpus built with the current prompt, keyed like the corpus."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get("schema_version") != advice_corpus.SCHEMA_VERSION or \
+                meta.get("prompt_version") != advice_corpus.PROMPT_VERSION:
+            return {}
+        rows = conn.execute("SELECT disease, ndvi, language, advice, source FROM advice").fetchall()
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Ignoring existing corpus: {e}")
+        return {}
+    return {(r[0], r[1], r[2]): (r[3], r[4]) for r in rows}
+
+def generate(limiter, disease, ndvi, language):
+    limiter.wait()
+    prompt = data_engine._advice_prompt(disease, ndvi.capitalize(), language)
+    return llm_client.generate(prompt, deadline_s=60)
+
+def write_corpus(path, rows):
+    """Writes a fresh corpus next to the old one and swaps it in atomically."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    building = path + ".building"
+    if os.path.exists(building):
+        os.remove(building)
+
+    conn = sqlite3.connect(building)
+    advice_corpus.create_schema(conn)
+    conn.executemany(
+        "INSERT INTO advice (disease, ndvi, language, advice, source) VALUES (?, ?, ?, ?, ?)",
+        [(*key, advice, source) for key, (advice, source) in sorted(rows.items())]
+    )
+    meta = {
+        "schema_version": advice_corpus.SCHEMA_VERSION,
+        "prompt_version": advice_corpus.PROMPT_VERSION,
+        "corpus_version": time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()),
+        "entries": str(len(rows)),
+    }
+    conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(building, path)
+    return meta
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute treatment advice for every known disease / NDVI / language.")
+    parser.add_argument("--out", default=advice_corpus.CORPUS_PATH)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--rps", type=float, default=REQUESTS_PER_SECOND, help="Max LLM requests per second")
+    parser.add_argument("--languages", default=",".join(data_engine.LANGUAGES), help="Comma-separated codes")
+    parser.add_argument("--force", action="store_true", help="Regenerate entries already in the corpus")
+    args = parser.parse_args()
+
+    if not llm_client.is_configured():
+        print("Error: GEMINI_API_KEY is not set")
+        return
+
+    languages = [l.strip() for l in args.languages.split(",") if l.strip()]
+    rows = {} if args.force else load_existing(args.out)
+    pending = []
+    for disease, ndvi, language in input_space(languages):
+        key = advice_corpus.corpus_key(disease, ndvi, language)
+        if key not in rows:
+            pending.append((key, disease, ndvi, language))
+    print(f"Input space: {len(pending) + len(rows)} entries, {len(rows)} reused, {len(pending)} to generate")
+    print(f"Rate limit: {args.rps} req/s with {args.workers} workers "
+          f"(~{len(pending) / args.rps / 60:.1f} min)")
+
+    limiter = RateLimiter(args.rps)
+    start = time.time()
+    for attempt in range(RETRY_PASSES + 1):
+        if not pending:
+            break
+        failed = []
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(generate, limiter, d, n, l): (key, d, n, l) for key, d, n, l in pending}
+            for i, future in enumerate(as_completed(futures), 1):
+                item = futures[future]
+                try:
+                    rows[item[0]] = (future.result(), SOURCE_LABEL)
+                except Exception as e:
+                    print(f"  Failed {item[1]} / {item[2]} / {item[3]}: {e}")
+                    failed.append(item)
+                if i % 20 == 0:
+                    print(f"  Pass {attempt + 1}: {i}/{len(pending)} done")
+        pending = failed
+
+    meta = write_corpus(args.out, rows)
+    print(f"\nCorpus {meta['corpus_version']} written to {args.out}: {len(rows)} entries "
+          f"in {time.time() - start:.0f}s ({os.path.getsize(args.out) / 1024:.0f} KB)")
+    if pending:
+        print(f"{len(pending)} entries still missing; the live path generates them on demand. Re-run to fill them in.")
+    print("Restart the app workers to load the new corpus.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+import tensorflow as tf
+
+# Add repo root to system path so the serving preprocessing is reused
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import ai_vision
+
+# --- Configuration ---
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATA_DIR = os.path.join(REPO_ROOT, "sample for mobilenetv2")
+KERAS_MODEL_PATH = "model.keras"
+CALIBRATION_SAMPLES = 200
+EVAL_SAMPLES = 500
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SEED = 123
+
+def list_dataset(data_dir):
+    """
+    Returns [(path, label_index)] with labels in flow_from_directory order (sorted folder names).
+    """
+    class_dirs = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    samples = []
+    for label, class_dir in enumerate(class_dirs):
+        folder = os.path.join(data_dir, class_dir)
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(folder, name), label))
+    return samples, class_dirs
+
+def load_batch(paths):
+    return np.stack([ai_vision._prepare_image(p) for p in paths]).astype(np.float32)
+
+def convert(model, mode, calibration_paths):
+    """
+    Post-training quantization of the Keras model.
+    mode: "int8" (full integer, calibrated) or "fp16" (float16 weights).
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        def representative_dataset():
+            for path in calibration_paths:
+                yield [load_batch([path])]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    return converter.convert()
+
+def evaluate(predict_fn, eval_samples, batch_size=32):
+    """
+    Returns (top-1 predictions, mean per-image latency in ms).
+    """
+    predictions = []
+    elapsed = 0.0
+    for start in range(0, len(eval_samples), batch_size):
+        chunk = eval_samples[start:start + batch_size]
+        batch = load_batch([p for p, _ in chunk])
+        t0 = time.perf_counter()
+        probs = predict_fn(batch)
+        elapsed += time.perf_counter() - t0
+        predictions.extend(np.argmax(probs, axis=1).tolist())
+    return np.array(predictions), elapsed / max(len(eval_samples), 1) * 1000.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the disease classifier to quantized TFLite models.")
+    parser.add_argument("--model", default=KERAS_MODEL_PATH, help="Trained Keras model (model.keras / model.h5)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Class-per-folder image directory")
+    parser.add_argument("--out-dir", default=".", help="Where to write model_int8.tflite / model_fp16.tflite")
+    parser.add_argument("--calibration-samples", type=int, default=CALIBRATION_SAMPLES)
+    parser.add_argument("--eval-samples", type=int, default=EVAL_SAMPLES)
+    parser.add_argument("--modes", default="int8,fp16", help="Comma separated: int8,fp16")
+    args = parser.parse_args()
+
+    model_path = args.model if os.path.exists(args.model) else 'model.h5'
+    if not os.path.exists(model_path):
+        print(f"Error: Model not found at {args.model}")
+        return
+    if not os.path.exists(args.data_dir):
+        print(f"Error: Dataset not found at {args.data_dir}")
+        return
+
+    print(f"Loading Keras model from {model_path}...")
+    model = tf.keras.models.load_model(model_path)
+
+    samples, class_dirs = list_dataset(args.data_dir)
+    random.Random(SEED).shuffle(samples)
+    calibration = [p for p, _ in samples[:args.calibration_samples]]
+    eval_samples = samples[args.calibration_samples:args.calibration_samples + args.eval_samples]
+    labels = np.array([label for _, label in eval_samples])
+    print(f"Classes: {class_dirs}")
+    print(f"Calibration images: {len(calibration)}, evaluation images: {len(eval_samples)}")
+
+    keras_preds, keras_ms = evaluate(lambda b: model.predict(b, verbose=0), eval_samples)
+    keras_acc = float(np.mean(keras_preds == labels))
+    report = {
+        "keras": {
+            "path": model_path,
+            "size_mb": os.path.getsize(model_path) / 1e6,
+            "top1": keras_acc,
+            "ms_per_image": keras_ms,
+        }
+    }
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        print(f"\n--- Converting ({mode}) ---")
+        tflite_bytes = convert(model, mode, calibration)
+        out_path = os.path.join(args.out_dir, f"model_{mode}.tflite")
+        with open(out_path, "wb") as f:
+            f.write(tflite_bytes)
+
+        tflite_model = ai_vision.TFLiteModel(out_path, num_threads=os.cpu_count())
+        preds, ms = evaluate(tflite_model.predict, eval_samples)
+        acc = float(np.mean(preds == labels))
+        report[mode] = {
+            "path": out_path,
+            "size_mb": len(tflite_bytes) / 1e6,
+            "top1": acc,
+            "top1_delta": acc - keras_acc,
+            "agreement_with_keras": float(np.mean(preds == keras_preds)),
+            "ms_per_image": ms,
+        }
+        print(f"Saved {out_path} ({len(tflite_bytes) / 1e6:.1f} MB)")
+        print(f"Top-1: {acc:.4f} (Keras {keras_acc:.4f}, delta {acc - keras_acc:+.4f})")
+
+    report_path = os.path.join(args.out_dir, "tflite_export_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n--- Summary ---")
+    for name, row in report.items():
+        delta = f"{row['top1_delta']:+.4f}" if "top1_delta" in row else "   --  "
+        print(f"{name:6s}  top1={row['top1']:.4f}  delta={delta}  {row['ms_per_image']:.2f} ms/img  {row['size_mb']:.1f} MB")
+    print(f"Report written to {report_path}")
+    print("Serve with: VISION_BACKEND=tflite-int8 (or tflite-fp16) python frontend/app.py")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Configuration ---
+HOST = "127.0.0.1"
+PORT = 8089
+# Median response latency; actual latency is log-normal around it
+LATENCY_MS = 1500
+LATENCY_SIGMA = 0.5
+# Streaming: time to first chunk, then the rest of the latency is spread over the chunks
+TTFC_MS = 400
+STREAM_CHUNKS = 8
+ERROR_RATE = 0.0
+ERROR_STATUSES = (429, 503)
+# Fraction of streams that break after half of their chunks
+STREAM_BREAK_RATE = 0.0
+# Fraction of JSON answers wrapped in ```json fences, like Gemini often does
+FENCE_RATE = 0.3
+SEED = 42
+
+# --- Canned answers ---
+CROP_JSON = {
+    "crop": "Ragi (Finger Millet)",
+    "season": "Kharif",
+    "soil": "Red Loamy",
+    "water": "Low to Moderate",
+    "reason": "Drought tolerant and suited to the current temperature; variety 'GPU 28' yields 30 quintals per hectare."
+}
+DIAGNOSIS_JSON = {
+    "plant": "Tomato",
+    "disease": "Early Blight",
+    "confidence": 0.91,
+    "recommendation": "Remove infected lower leaves and spray Mancozeb 2g/liter every 7 days."
+}
+VARIETIES_JSON = {
+    "soil_confirmation": "Red Loamy",
+    "water_confirmation": "Dryland with seasonal tank irrigation",
+    "varieties": ["Ragi (GPU 28)", "Groundnut (TMV 2)", "Maize (NK 6240)"]
+}
+
+def markdown_plan(prompt):
+    disease = re.search(r"Disease Detected: (.*)", prompt)
+    name = disease.group(1).strip() if disease else "the detected disease"
+    return (
+        f"**Treatment Plan for {name}**\n\n"
+        "1. **Immediate Action**: Remove and destroy infected leaves; avoid overhead watering.\n"
+        "2. **Treatment**: Spray Copper Oxychloride 3g/liter, or neem oil 5ml/liter for organic control.\n"
+        "3. **Prevention**: Rotate crops, keep 60cm spacing and use certified disease-free seed."
+    )
+
+def canned_answer(prompt, images, fence):
+    """Picks the answer shape the calling code expects, based on the prompt."""
+    if images or '"plant", "disease"' in prompt:
+        answer = DIAGNOSIS_JSON
+    elif '"varieties"' in prompt:
+        answer = VARIETIES_JSON
+    elif '"crop"' in prompt:
+        answer = CROP_JSON
+    else:
+        return markdown_plan(prompt)
+    text = json.dumps(answer, ensure_ascii=False, indent=2)
+    return f"```json\n{text}\n```" if fence else text
+
+class StubState:
+    """Seeded randomness shared by all handler threads, so a run is reproducible."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        """Returns (latency_s, error status or None, break stream, fence JSON) for one request."""
+        args = self.args
+        with self.lock:
+            self.requests += 1
+            latency = args.latency_ms / 1000.0 * self.rng.lognormvariate(0.0, args.latency_sigma)
+            error = self.rng.choice(args.error_statuses) if self.rng.random() < args.error_rate else None
+            broken = self.rng.random() < args.stream_break_rate
+            fence = self.rng.random() < args.fence_rate
+        return latency, error, broken, fence
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json"):
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != "/generate":
+                self._send(404, json.dumps({"error": "not found"}))
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            latency, error, broken, fence = state.draw()
+            text = canned_answer(request.get("prompt", ""), request.get("images", 0), fence)
+
+            if error is not None:
+                time.sleep(min(latency, 0.2))
+                self._send(error, json.dumps({"error": f"simulated HTTP {error}"}))
+                return
+            if not request.get("stream"):
+                time.sleep(latency)
+                self._send(200, json.dumps({"text": text}))
+                return
+
+            # Streaming: newline-delimited JSON chunks over chunked transfer encoding
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            size = max(1, len(text) // state.args.stream_chunks + 1)
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+            gap = max(0.0, latency - state.args.ttfc_ms / 1000.0) / len(pieces)
+            time.sleep(min(latency, state.args.ttfc_ms / 1000.0))
+            for i, piece in enumerate(pieces):
+                if broken and i == len(pieces) // 2:
+                    self._write_chunk(json.dumps({"error": "simulated stream break"}) + "\n")
+                    break
+                self._write_chunk(json.dumps({"text": piece}) + "\n")
+                time.sleep(gap)
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, line):
+            data = line.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the LLM API. Run the app with LLM_PROVIDER=local to use it."
+    )
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS, help="Median latency")
+    parser.add_argument("--latency-sigma", type=float, default=LATENCY_SIGMA, help="Log-normal spread (0 = fixed)")
+    parser.add_argument("--ttfc-ms", type=float, default=TTFC_MS, help="Time to first chunk when streaming")
+    parser.add_argument("--stream-chunks", type=int, default=STREAM_CHUNKS)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE)
+    parser.add_argument("--error-statuses", type=lambda s: [int(x) for x in s.split(",")],
+                        default=list(ERROR_STATUSES), help="Comma-separated HTTP statuses")
+    parser.add_argument("--stream-break-rate", type=float, default=STREAM_BREAK_RATE)
+    parser.add_argument("--fence-rate", type=float, default=FENCE_RATE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubState(args)))
+    server.daemon_threads = True
+    print(f"LLM stand-in on http://{args.host}:{args.port} "
+          f"(median {args.latency_ms:.0f} ms, error rate {args.error_rate:.0%}, "
+          f"stream breaks {args.stream_break_rate:.0%})")
+    print(f"Point the app at it: LLM_PROVIDER=local LLM_LOCAL_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
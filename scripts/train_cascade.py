@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import MobileNetV3Small
+from tensorflow.keras.layers import Dense, Dropout, Input, Resizing
+from tensorflow.keras.models import Model
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.callbacks import EarlyStopping
+
+# Add repo root to system path so calibration uses the serving preprocessing
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import ai_vision, image_pipeline
+from export_tflite import list_dataset
+
+# --- Configuration ---
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATA_DIR = os.path.join(REPO_ROOT, "sample for mobilenetv2")
+FULL_MODEL_PATH = "model.keras"
+STAGE1_MODEL_PATH = "model_stage1.keras"
+CALIBRATION_PATH = "cascade_calibration.json"
+STAGE1_SIZE = (128, 128)
+STAGE1_ALPHA = 0.75
+BATCH_SIZE = 32
+EPOCHS_HEAD = 3
+EPOCHS_FINE_TUNE = 3
+VALIDATION_SPLIT = 0.2
+# Held out from training and from early stopping; only the threshold is picked on it
+CALIBRATION_SPLIT = 0.1
+# Largest acceptable top-1 drop versus the full model when picking the threshold
+MAX_ACCURACY_DROP = 0.005
+SEED = 123
+
+def build_stage1(num_classes):
+    """
+    Narrow MobileNetV3Small at 128x128. Takes the same (224, 224, 3) [-1, 1] input as the
+    full model and resizes internally, so the serving pipeline is shared.
+    """
+    inputs = Input(shape=(ai_vision.IMG_SIZE[1], ai_vision.IMG_SIZE[0], 3))
+    x = Resizing(STAGE1_SIZE[0], STAGE1_SIZE[1])(inputs)
+    base_model = MobileNetV3Small(
+        input_shape=(STAGE1_SIZE[0], STAGE1_SIZE[1], 3),
+        alpha=STAGE1_ALPHA,
+        include_top=False,
+        weights='imagenet',
+        pooling='avg',
+        include_preprocessing=False  # inputs are already scaled to [-1, 1]
+    )
+    x = base_model(x)
+    x = Dropout(0.2)(x)
+    outputs = Dense(num_classes, activation='softmax')(x)
+    return Model(inputs, outputs), base_model
+
+def make_dataset(samples, training):
+    """tf.data pipeline reading JPEGs with the same [-1, 1] scaling as ai_vision."""
+    paths = [p for p, _ in samples]
+    labels = [l for _, l in samples]
+
+    def load(path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.resize(image, ai_vision.IMG_SIZE)
+        if training:
+            image = tf.image.random_flip_left_right(image)
+            image = tf.image.random_brightness(image, 20.0)
+            image = tf.clip_by_value(image, 0.0, 255.0)
+        return image / 127.5 - 1.0, label
+
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if training:
+        ds = ds.shuffle(len(paths), seed=SEED)
+    return ds.map(load, num_parallel_calls=tf.data.AUTOTUNE).batch(BATCH_SIZE).prefetch(tf.data.AUTOTUNE)
+
+def predict_serving(predict_fn, paths):
+    """Runs a predict function over images decoded by the serving pipeline. Returns (probs, seconds)."""
+    outputs = []
+    elapsed = 0.0
+    buffer = image_pipeline.allocate_batch(BATCH_SIZE, ai_vision.IMG_SIZE)
+    for start in range(0, len(paths), BATCH_SIZE):
+        chunk = paths[start:start + BATCH_SIZE]
+        for i, path in enumerate(chunk):
+            image_pipeline.preprocess_into(path, buffer[i], ai_vision.IMG_SIZE)
+        t0 = time.perf_counter()
+        outputs.append(np.asarray(predict_fn(buffer[:len(chunk)])))
+        elapsed += time.perf_counter() - t0
+    return np.concatenate(outputs), elapsed
+
+def calibrate(stage1_probs, full_probs, labels, stage1_s, full_s, max_drop=MAX_ACCURACY_DROP):
+    """
+    Sweeps confidence thresholds. Returns (chosen row, table).
+    Cascade cost is estimated as stage-1 on everything plus the full model on escalated images.
+    """
+    stage1_pred = stage1_probs.argmax(axis=1)
+    stage1_conf = stage1_probs.max(axis=1)
+    full_pred = full_probs.argmax(axis=1)
+    full_acc = float(np.mean(full_pred == labels))
+    n = len(labels)
+
+    table = []
+    for threshold in np.round(np.arange(0.50, 1.0, 0.01), 2):
+        accept = stage1_conf >= threshold
+        cascade_pred = np.where(accept, stage1_pred, full_pred)
+        escalation = 1.0 - float(accept.mean())
+        seconds = stage1_s + full_s * escalation
+        table.append({
+            "threshold": float(threshold),
+            "coverage": 1.0 - escalation,
+            "escalation_rate": escalation,
+            "top1": float(np.mean(cascade_pred == labels)),
+            "images_per_sec": n / seconds if seconds else 0.0,
+        })
+
+    eligible = [row for row in table if row["top1"] >= full_acc - max_drop]
+    chosen = eligible[0] if eligible else table[-1]
+    return chosen, table, full_acc
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and calibrate the first-stage model for cascade mode.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--full-model", default=FULL_MODEL_PATH)
+    parser.add_argument("--out", default=STAGE1_MODEL_PATH)
+    parser.add_argument("--max-accuracy-drop", type=float, default=MAX_ACCURACY_DROP)
+    args = parser.parse_args()
+
+    full_model_path = args.full_model if os.path.exists(args.full_model) else 'model.h5'
+    if not os.path.exists(full_model_path):
+        print(f"Error: Full model not found at {args.full_model}")
+        return
+    if not os.path.exists(args.data_dir):
+        print(f"Error: Dataset not found at {args.data_dir}")
+        return
+
+    samples, class_dirs = list_dataset(args.data_dir)
+    random.Random(SEED).shuffle(samples)
+    # EarlyStopping picks weights on the validation split, so the threshold is calibrated on a third one
+    calibration_start = int(len(samples) * (1 - CALIBRATION_SPLIT))
+    val_start = int(len(samples) * (1 - CALIBRATION_SPLIT - VALIDATION_SPLIT))
+    train_samples = samples[:val_start]
+    val_samples = samples[val_start:calibration_start]
+    calibration_samples = samples[calibration_start:]
+    num_classes = len(class_dirs)
+    print(f"Classes: {class_dirs}")
+    print(f"Train: {len(train_samples)}, validation: {len(val_samples)}, calibration: {len(calibration_samples)}")
+
+    # --- Stage 1 training ---
+    model, base_model = build_stage1(num_classes)
+    train_ds = make_dataset(train_samples, training=True)
+    val_ds = make_dataset(val_samples, training=False)
+
+    print("\n--- Stage 1: Head Training ---")
+    base_model.trainable = False
+    model.compile(optimizer=Adam(1e-3), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    model.fit(train_ds, validation_data=val_ds, epochs=EPOCHS_HEAD)
+
+    print("\n--- Stage 1: Fine-Tuning ---")
+    base_model.trainable = True
+    for layer in base_model.layers[:-30]:
+        layer.trainable = False
+    model.compile(optimizer=Adam(1e-5), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    model.fit(train_ds, validation_data=val_ds, epochs=EPOCHS_FINE_TUNE,
+              callbacks=[EarlyStopping(monitor='val_loss', patience=2, restore_best_weights=True)])
+    model.save(args.out)
+    print(f"Stage-1 model saved to {args.out}")
+
+    # --- Calibration on the held-out calibration split, through the serving pipeline ---
+    print("\n--- Calibrating Threshold ---")
+    full_model = tf.keras.models.load_model(full_model_path)
+    full_fn = ai_vision._compile_keras_model(full_model)
+    stage1_fn = ai_vision._compile_keras_model(model)
+    calibration_paths = [p for p, _ in calibration_samples]
+    labels = np.array([l for _, l in calibration_samples])
+
+    # Warm up both traced functions before timing
+    warmup = np.zeros((BATCH_SIZE, ai_vision.IMG_SIZE[1], ai_vision.IMG_SIZE[0], 3), dtype=np.float32)
+    full_fn(warmup)
+    stage1_fn(warmup)
+
+    full_probs, full_s = predict_serving(full_fn, calibration_paths)
+    stage1_probs, stage1_s = predict_serving(stage1_fn, calibration_paths)
+    chosen, table, full_acc = calibrate(stage1_probs, full_probs, labels, stage1_s, full_s,
+                                        args.max_accuracy_drop)
+
+    report = {
+        "threshold": chosen["threshold"],
+        "coverage": chosen["coverage"],
+        "escalation_rate": chosen["escalation_rate"],
+        "cascade_top1": chosen["top1"],
+        "full_top1": full_acc,
+        "stage1_top1": float(np.mean(stage1_probs.argmax(axis=1) == labels)),
+        "cascade_images_per_sec": chosen["images_per_sec"],
+        "full_images_per_sec": len(labels) / full_s if full_s else 0.0,
+        "max_accuracy_drop": args.max_accuracy_drop,
+        "stage1_model": args.out,
+        "stage1_input": list(STAGE1_SIZE),
+        "calibration_images": len(labels),
+        "sweep": table,
+    }
+    with open(CALIBRATION_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n--- Cascade Trade-off ---")
+    print(f"{'threshold':>9} {'coverage':>9} {'top1':>7} {'img/s':>8}")
+    for row in table[::5]:
+        print(f"{row['threshold']:9.2f} {row['coverage']:9.1%} {row['top1']:7.4f} {row['images_per_sec']:8.1f}")
+    print(f"\nFull model:  top1={full_acc:.4f}  {report['full_images_per_sec']:.1f} img/s")
+    print(f"Cascade:     top1={chosen['top1']:.4f}  {chosen['images_per_sec']:.1f} img/s  "
+          f"(threshold {chosen['threshold']:.2f}, stage 1 covers {chosen['coverage']:.1%}, "
+          f"{chosen['escalation_rate']:.1%} escalated; {len(labels)} calibration images)")
+    print(f"Calibration written to {CALIBRATION_PATH}")
+    print("Serve with: VISION_CASCADE=1 python frontend/app.py")
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,14 @@
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, abort
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from PIL import Image
 import agri_data
 import ai_vision
+import geocoding
+import tile_cache
+import uploads
 
 # --- Configuration ---
 app = Flask(__name__)
@@ -14,10 +16,20 @@ app.config['SECRET_KEY'] = 'open-agri-os-secret-key-change-in-prod' # Change thi
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 
+class InMemoryUploadRequest(Flask.request_class):
+    """Uploaded images stay in memory, size-capped and magic-byte checked while streaming."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return uploads.CappedImageBuffer()
+
+app.request_class = InMemoryUploadRequest
+
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 db = SQLAlchemy(app)
+
+# Load and warm up the vision model now rather than on the first diagnosis
+ai_vision.preload()
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -87,13 +99,16 @@ def scout_info():
     if not place_name:
         return jsonify({'error': 'Place name required'}), 400
         
-    coords = agri_data.get_coordinates(place_name)
-    if not coords:
+    try:
+        location = geocoding.resolve(place_name)
+    except geocoding.GeocoderBusy as e:
+        return jsonify({'error': str(e)}), 503
+    if not location:
         return jsonify({'error': 'Location not found'}), 404
         
-    lat, lon = coords
-    rec = agri_data.get_crop_recommendation(lat, lon)
-    weather = agri_data.get_weather(lat, lon)
+    coords = location.coords
+    rec = agri_data.get_crop_recommendation(location.lat, location.lon)
+    weather = agri_data.get_weather(location)
     ndvi = agri_data.get_sentinel_ndvi(coords)
     
     return jsonify({
@@ -103,9 +118,16 @@ def scout_info():
         'ndvi': ndvi
     })
 
+@app.errorhandler(uploads.UploadRejected)
+def upload_rejected(e):
+    return jsonify({'error': e.message}), e.status_code
+
 @app.route('/api/predict_disease', methods=['POST'])
 @login_required
 def predict_disease():
+    if request.content_length and request.content_length > uploads.MAX_IMAGE_BYTES + 64 * 1024:
+        return jsonify({'error': 'Image exceeds the upload limit.'}), 413
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
         
@@ -114,13 +136,10 @@ def predict_disease():
         return jsonify({'error': 'No file selected'}), 400
         
     if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Process image
-        image = Image.open(filepath)
-        result = ai_vision.analyze_image(image)
+        # Process image straight from memory
+        data = file.stream.getvalue()
+        uploads.persist_async(data, secure_filename(file.filename), app.config['UPLOAD_FOLDER'])
+        result = ai_vision.analyze_image(data)
         
         return jsonify(result)
 
@@ -134,6 +153,16 @@ def get_advice():
     advice = agri_data.get_gemini_advice(disease, ndvi_status)
     return jsonify(advice)
 
+@app.route('/tiles/cache/<name>')
+def cached_tile(name):
+    # Content-addressed satellite renders never change, so clients may cache them for good
+    path = tile_cache.file_path(name)
+    if path is None or not os.path.exists(path):
+        abort(404)
+    response = send_file(path, max_age=tile_cache.MAX_AGE_S)
+    response.headers['Cache-Control'] = f'public, max-age={tile_cache.MAX_AGE_S}, immutable'
+    return response
+
 # --- Main ---
 if __name__ == '__main__':
     with app.app_context():